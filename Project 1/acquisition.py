@@ -0,0 +1,811 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import sys
+import queue
+import asyncio
+import logging
+import argparse
+import threading
+import time
+import serial
+import numpy as np
+
+from buffers import RingBuffer
+from instrumentation import Instrumentation, setupLogging, EXPORT_INTERVAL
+
+log = logging.getLogger(__name__)
+
+# Default serial settings of data.ino
+# ADJUST TO THE CORRECT PORT! IF YOU ARE USING WINDOWS, IT WILL BE 'COMX', WHERE X IS THE PORT NUMBER
+# IF YOU ARE USING LINUX, IT WILL BE '/dev/ttyUSBX', WHERE X IS THE PORT NUMBER!!!
+DEFAULT_PORT = 'COM7'
+BAUDRATE = 38400
+# Time (s) the Arduino takes to reset after the port is opened
+RESET_DELAY = 2
+# Default number of samples kept in memory by the engine
+CAPACITY = 2000000
+
+# Largest single read from the serial port (bytes)
+READ_SIZE = 65536
+
+# Streaming modes negotiated with the Arduino through SET_MODE
+ASCII_MODE = "ASCII"
+BINARY_MODE = "BINARY"
+
+# Number of analog inputs (A0, A1, ...) sampled together, negotiated through SET_CHANNELS
+MAX_CHANNELS = 6
+
+# Sampling timing negotiated through SET_TIMING: DELAY waits acquisitionInterval after sending each
+# sample (so the real period also includes the time spent sending), TIMER samples from a hardware
+# timer interrupt into a small burst buffer on the Arduino
+DELAY_TIMING = "DELAY"
+TIMER_TIMING = "TIMER"
+
+# Timing accounting: a sample is late if it was taken more than LATE_TOLERANCE of a period (and more
+# than one timestamp tick, TIMESTAMP_RESOLUTION ms) after it was due. Without sequence numbers (ASCII
+# mode), gaps are found from the timestamps, which only works for periods of at least MIN_GAP_INTERVAL ms.
+LATE_TOLERANCE = 0.5
+TIMESTAMP_RESOLUTION = 1.0
+MIN_GAP_INTERVAL = 2.0
+
+# Binary frame sent by data.ino in binary mode (8 + 2 * channels bytes, little-endian):
+# sync word 0xA55A, sequence counter, one 10-bit value per channel, millis() timestamp and
+# a checksum equal to the sum of every byte after the sync word (mod 256)
+SYNC_WORD = 0xA55A
+
+# Returns the NumPy layout of a binary frame carrying `channels` values
+def frameDtype(channels=1):
+    return np.dtype([
+        ('sync', '<u2'),
+        ('seq', 'u1'),
+        ('values', '<u2', (channels,)),
+        ('timestamp', '<u4'),
+        ('checksum', 'u1'),
+    ])
+
+FRAME_DTYPE = frameDtype(1)
+FRAME_SIZE = FRAME_DTYPE.itemsize
+
+# On-device aggregation negotiated through SET_AGGREGATE <n>: the Arduino samples n times faster and
+# sends one record per window of n samples (n = 1 sends every sample, as usual), with the mean, minimum
+# and maximum of each channel, the number of samples and the timestamp of the first one. The records are
+# sent every SET_INTERVAL ms, as the samples were.
+# On the host such a record is a row of aggregateColumns(channels) values: the means first (so column c
+# is still "channel c" for the analysis), then the minima, the maxima and the count.
+MAX_WINDOW = 1000
+AGGREGATE_FIELDS = ("mean", "min", "max")
+
+# Binary aggregate record (10 + 6 * channels bytes, little-endian): sync word 0xA55B, sequence counter
+# of the records, mean (in 1/MEAN_SCALE of an ADC unit), min and max of each channel, count, timestamp
+# and checksum (as in a frame)
+AGGREGATE_SYNC_WORD = 0xA55B
+MEAN_SCALE = 64
+
+def aggregateDtype(channels=1):
+    return np.dtype([
+        ('sync', '<u2'),
+        ('seq', 'u1'),
+        ('mean', '<u2', (channels,)),
+        ('min', '<u2', (channels,)),
+        ('max', '<u2', (channels,)),
+        ('count', '<u2'),
+        ('timestamp', '<u4'),
+        ('checksum', 'u1'),
+    ])
+
+# Number of value columns of an aggregate record with `channels` channels
+def aggregateColumns(channels):
+    return len(AGGREGATE_FIELDS) * channels + 1
+
+# Column of `field` ("mean", "min", "max" or "count") of `channel` in an aggregate record
+def aggregateColumn(channels, field, channel=0):
+    if field == "count":
+        return len(AGGREGATE_FIELDS) * channels
+    return AGGREGATE_FIELDS.index(field) * channels + channel
+
+# Description of aggregated data (kept in the metadata of the sessions that store it)
+def aggregateMeta(channels, window):
+    columns = [f"{field} A{c}" for field in AGGREGATE_FIELDS for c in range(channels)] + ["count"]
+    return {"window": window, "channels": channels, "columns": columns}
+
+# -----------------------------------------------------------------------------------------------------
+# -------------------------------------------- Parsing ------------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Parses a chunk of raw bytes made of "value, timestamp" lines ("v0, v1, ..., timestamp" with several channels).
+# Returns (timestamps, values, errors, remainder), where values has one column per channel and remainder
+# is the incomplete last line, which must be prepended to the next chunk. All complete lines are converted
+# in one NumPy call.
+def parseLines(data, channels=1):
+    return _parseRows(data, channels, np.int64)
+
+# Parses a chunk of aggregate lines ("mean0, ..., min0, ..., max0, ..., count, timestamp"), like parseLines.
+# The values have aggregateColumns(channels) columns.
+def parseAggregateLines(data, channels=1):
+    return _parseRows(data, aggregateColumns(channels), np.float64)
+
+# Lines of `columns` comma-separated numbers followed by a timestamp, converted to `dtype`
+def _parseRows(data, columns, dtype):
+    lines = data.split(b'\n')
+    remainder = lines.pop()
+
+    # Lines sent by the Arduino when it does not understand a command
+    errors = sum(1 for line in lines if line.strip() == b"ERROR")
+    good = [line for line in lines if line.count(b',') == columns]
+
+    if not good:
+        return np.empty(0, dtype=np.int64), np.empty((0, columns), dtype=dtype), errors, remainder
+
+    numbers = np.fromstring(b','.join(good).decode('ascii', 'replace'), dtype=dtype, sep=',') \
+        if _isNumeric(good) else None
+
+    # Fall back to line by line parsing if the batch had a corrupted line
+    if numbers is None or len(numbers) != (columns + 1) * len(good):
+        convert = int if dtype == np.int64 else float
+        rows = []
+        for line in good:
+            try:
+                rows.append(tuple(map(convert, line.split(b','))))
+            except ValueError:
+                pass
+        numbers = np.array(rows, dtype=dtype).reshape(-1)
+
+    # One row per line: the values followed by the timestamp
+    numbers = numbers.reshape(-1, columns + 1)
+    return numbers[:, columns].astype(np.int64), numbers[:, :columns], errors, remainder
+
+# Quick check that a batch only contains digits, separators and whitespace
+def _isNumeric(lines):
+    return not b''.join(lines).translate(None, b'0123456789,.- \r\t')
+
+# Builds ASCII lines from arrays of samples (values with one column per channel)
+def encodeLines(timestamps, values):
+    values = np.asarray(values).reshape(len(timestamps), -1)
+    rows = np.column_stack((values, timestamps)).astype(np.int64).tolist()
+    line = b", ".join([b"%d"] * len(rows[0])) + b"\r\n" if rows else b""
+    return b"".join(line % tuple(row) for row in rows)
+
+# Builds aggregate lines from aggregate records (values with aggregateColumns(channels) columns)
+def encodeAggregateLines(timestamps, values):
+    values = np.asarray(values, dtype=np.float64).reshape(len(timestamps), -1)
+    channels = (values.shape[1] - 1) // len(AGGREGATE_FIELDS)
+    rows = np.column_stack((values, timestamps)).tolist()
+    line = b", ".join([b"%.2f"] * channels + [b"%d"] * (2 * channels + 2)) + b"\r\n" if rows else b""
+    return b"".join(line % tuple(row) for row in rows)
+
+# Builds binary frames from arrays of samples (the host side counterpart of data.ino, used for testing)
+def encodeFrames(seq, timestamps, values):
+    values = np.asarray(values).reshape(len(timestamps), -1)
+    dtype = frameDtype(values.shape[1])
+    frames = np.zeros(len(timestamps), dtype=dtype)
+    frames['sync'] = SYNC_WORD
+    frames['seq'] = np.asarray(seq) & 0xFF
+    frames['values'] = values
+    frames['timestamp'] = timestamps
+    raw = frames.view(np.uint8).reshape(-1, dtype.itemsize)
+    frames['checksum'] = raw[:, 2:dtype.itemsize - 1].sum(axis=1, dtype=np.uint32) & 0xFF
+    return frames.tobytes()
+
+# Builds binary aggregate records (values with aggregateColumns(channels) columns)
+def encodeAggregates(seq, timestamps, values):
+    values = np.asarray(values, dtype=np.float64).reshape(len(timestamps), -1)
+    channels = (values.shape[1] - 1) // len(AGGREGATE_FIELDS)
+    dtype = aggregateDtype(channels)
+    records = np.zeros(len(timestamps), dtype=dtype)
+    records['sync'] = AGGREGATE_SYNC_WORD
+    records['seq'] = np.asarray(seq) & 0xFF
+    records['mean'] = np.rint(values[:, :channels] * MEAN_SCALE)
+    records['min'] = values[:, channels:2 * channels]
+    records['max'] = values[:, 2 * channels:3 * channels]
+    records['count'] = values[:, -1]
+    records['timestamp'] = timestamps
+    raw = records.view(np.uint8).reshape(-1, dtype.itemsize)
+    records['checksum'] = raw[:, 2:dtype.itemsize - 1].sum(axis=1, dtype=np.uint32) & 0xFF
+    return records.tobytes()
+
+# Decodes a chunk of raw bytes made of binary frames.
+# Returns (seq, timestamps, values, skipped, remainder): skipped is the number of bytes thrown away
+# while resynchronizing (line noise, partial frames, text) and remainder must be prepended to the next chunk.
+# A frame is only accepted if both its sync word and its checksum match, so after noise the decoder
+# always locks again on the next valid frame.
+def decodeFrames(data, channels=1):
+    frames, skipped, remainder = _decodeRecords(data, frameDtype(channels), SYNC_WORD)
+    return frames['seq'], frames['timestamp'], frames['values'], skipped, remainder
+
+# Decodes a chunk of binary aggregate records, like decodeFrames.
+# The values have aggregateColumns(channels) columns (means in ADC units).
+def decodeAggregates(data, channels=1):
+    records, skipped, remainder = _decodeRecords(data, aggregateDtype(channels), AGGREGATE_SYNC_WORD)
+    values = np.empty((len(records), aggregateColumns(channels)), dtype=np.float64)
+    values[:, :channels] = records['mean'] / MEAN_SCALE
+    values[:, channels:2 * channels] = records['min']
+    values[:, 2 * channels:3 * channels] = records['max']
+    values[:, -1] = records['count']
+    return records['seq'], records['timestamp'], values, skipped, remainder
+
+# Finds the records of `dtype` (starting with `sync`, ending with a checksum) in a chunk of raw bytes.
+# Returns (records, skipped, remainder).
+def _decodeRecords(data, dtype, sync_word):
+    size = dtype.itemsize
+    buf = np.frombuffer(data, dtype=np.uint8)
+    last_start = len(buf) - size
+
+    # Fast path: the chunk is a clean sequence of whole frames
+    n = len(buf) // size
+    if n:
+        frames = np.frombuffer(data, dtype=dtype, count=n)
+        raw = buf[:n * size].reshape(n, size)
+        sums = raw[:, 2:size - 1].sum(axis=1, dtype=np.uint32) & 0xFF
+        if np.all(frames['sync'] == sync_word) and np.array_equal(sums, frames['checksum']):
+            return frames, 0, data[n * size:]
+
+    if last_start < 0:
+        return np.empty(0, dtype=dtype), 0, data
+
+    # Every position holding the sync word followed by a full frame with a valid checksum
+    sync = (buf[:last_start + 1] == (sync_word & 0xFF)) & (buf[1:last_start + 2] == (sync_word >> 8))
+    starts = np.flatnonzero(sync)
+    if len(starts):
+        cumsum = np.concatenate(([0], np.cumsum(buf, dtype=np.uint32)))
+        sums = (cumsum[starts + size - 1] - cumsum[starts + 2]) & 0xFF
+        starts = starts[sums == buf[starts + size - 1]]
+
+    # Drop candidates overlapping an earlier accepted frame (a sync word inside a frame's payload)
+    if len(starts) > 1 and np.any(np.diff(starts) < size):
+        accepted = []
+        end = 0
+        for start in starts:
+            if start >= end:
+                accepted.append(start)
+                end = start + size
+        starts = np.array(accepted, dtype=np.intp)
+
+    # Keep the tail that could still be the beginning of a frame
+    consumed = starts[-1] + size if len(starts) else 0
+    keep_from = max(consumed, last_start + 1)
+    skipped = keep_from - size * len(starts)
+
+    if not len(starts):
+        return np.empty(0, dtype=dtype), skipped, data[keep_from:]
+
+    frames = buf[starts[:, None] + np.arange(size)]
+    return frames.copy().view(dtype).reshape(-1), skipped, data[keep_from:]
+
+# -----------------------------------------------------------------------------------------------------
+# ------------------------------------------ Timing statistics ----------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Running account of how well the sampling kept to its period, updated with every batch (vectorized):
+#   dropped: samples that never reached the host (sequence number gaps in binary mode, timestamp gaps of
+#            whole periods in ASCII mode), counted in `gaps` separate events
+#   duplicates: frames received twice in binary mode (same sequence number), not timed
+#   late:    samples taken more than LATE_TOLERANCE of a period after they were due
+#   jitter:  deviation (ms) of each sampling interval from the nominal period (RMS and maximum)
+# The nominal period is `interval` (ms) when known (SET_INTERVAL), otherwise it is estimated from the
+# timestamps. `timed` tells whether the Arduino samples from its hardware timer (TIMER_TIMING), which
+# keeps the period exactly, so any longer interval in ASCII mode is a gap.
+# clear() starts a new session; restart() only forgets the last sample (e.g. after a mode change).
+class TimingStats:
+    def __init__(self, interval=None, timed=False):
+        self.interval = interval
+        self.timed = timed
+        self.clear()
+
+    def clear(self):
+        self.samples = 0
+        self.dropped = 0
+        self.gaps = 0
+        self.duplicates = 0
+        self.late = 0
+        self.intervals = 0
+        self.deviation_sum = 0.0
+        self.deviation_sumsq = 0.0
+        self.max_jitter = 0.0
+        # Device time covered by the session (sum of the valid intervals), for the estimated period
+        self.span = 0.0
+        self.restart()
+
+    def restart(self):
+        self.last_timestamp = None
+        self.last_seq = None
+
+    # Nominal sampling period (ms), or None while it cannot be estimated yet
+    def period(self):
+        if self.interval:
+            return float(self.interval)
+        periods = self.intervals + self.dropped
+        return self.span / periods if periods and self.span > 0 else None
+
+    # Accounts for a batch of device timestamps (ms) and, in binary mode, their sequence numbers
+    def update(self, timestamps, seq=None):
+        if not len(timestamps):
+            return
+        self.samples += len(timestamps)
+        t = np.asarray(timestamps, dtype=np.float64)
+        if self.last_timestamp is not None:
+            t = np.concatenate(((self.last_timestamp,), t))
+        dt = np.diff(t)
+        self.last_timestamp = float(t[-1])
+
+        if seq is not None:
+            s = np.asarray(seq, dtype=np.int64)
+            if self.last_seq is not None:
+                s = np.concatenate(((self.last_seq,), s))
+            self.last_seq = int(s[-1])
+            step = np.diff(s)
+            # A repeated sequence number is the same frame received twice (after a resync), not a wrap
+            repeated = step == 0
+            self.duplicates += int(np.count_nonzero(repeated))
+            # Sequence numbers wrap at 256
+            missing = (step - 1) & 0xFF
+        else:
+            repeated = np.zeros(len(dt), dtype=bool)
+            missing = np.zeros(len(dt), dtype=np.int64)
+
+        # Intervals going backwards come from a restart of the Arduino clock and are not timed (nor are
+        # the ones of duplicated frames)
+        valid = (dt >= 0) & ~repeated
+        dt, missing = dt[valid], missing[valid]
+        # The period is estimated (when not set) from this batch too
+        self.span += float(dt.sum())
+        self.intervals += len(dt)
+        period = self.period()
+        if seq is None and period is not None and period >= MIN_GAP_INTERVAL and len(dt):
+            # With DELAY timing every sample can be late: intervals are compared with the period actually
+            # kept in this batch, so that late samples are not taken for gaps
+            actual = period if self.timed else max(period, float(np.median(dt)))
+            missing = np.maximum(np.rint(dt / actual) - 1, 0).astype(np.int64)
+        self.dropped += int(missing.sum())
+        self.gaps += int(np.count_nonzero(missing))
+        if period is None or not len(dt):
+            return
+
+        deviation = dt - period * (missing + 1)
+        self.late += int(np.count_nonzero(deviation > max(LATE_TOLERANCE * period, TIMESTAMP_RESOLUTION)))
+        self.deviation_sum += float(deviation.sum())
+        self.deviation_sumsq += float(np.dot(deviation, deviation))
+        self.max_jitter = max(self.max_jitter, float(np.abs(deviation).max()))
+
+    # Returns a dict with the statistics of the session so far
+    def stats(self):
+        n = max(self.intervals, 1)
+        return {
+            "samples": self.samples,
+            "dropped": self.dropped,
+            "gaps": self.gaps,
+            "duplicates": self.duplicates,
+            "late": self.late,
+            "loss": self.dropped / (self.samples + self.dropped) if self.samples else 0.0,
+            "period_ms": self.period(),
+            "rate": 1000.0 * self.intervals / self.span if self.span > 0 else None,
+            "mean_deviation_ms": self.deviation_sum / n,
+            "jitter_ms": float(np.sqrt(self.deviation_sumsq / n)),
+            "max_jitter_ms": self.max_jitter,
+        }
+
+# -----------------------------------------------------------------------------------------------------
+# ------------------------------------------ Serial reader --------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Background thread that drains the serial port with large reads, parses whole batches of lines
+# and hands them to the GUI through a thread-safe queue of (timestamps, values) arrays.
+# Acquisition therefore keeps running at full baud while the GUI thread is busy redrawing.
+# The "read" and "parse" stages and the "backlog" gauge (bytes waiting in the port) are recorded in
+# `instruments` (an Instrumentation).
+class SerialReader(threading.Thread):
+    def __init__(self, ser, instruments=None):
+        super().__init__(daemon=True)
+        self.ser = ser
+        self.instruments = instruments or Instrumentation(enabled=False)
+        self.batches = queue.Queue()
+        self.errors = 0
+        # Binary mode: bytes skipped to resync
+        self.skipped = 0
+        # Dropped/late samples and jitter of the current session
+        self.timing = TimingStats()
+        self.mode = ASCII_MODE
+        self.channels = 1
+        # Samples per aggregate record (1: raw samples)
+        self.window = 1
+        # Functions called from this thread with every parsed batch (e.g. the session recorder)
+        self.sinks = []
+        # Whether batches are also queued for drain() (not needed when only the sinks consume them)
+        self.queued = True
+        self.running = True
+        self.clearRequested = threading.Event()
+
+    def run(self):
+        remainder = b''
+        mode, channels, window = self.mode, self.channels, self.window
+        while self.running:
+            try:
+                # Discard stale data if the graph was cleared
+                if self.clearRequested.is_set():
+                    self.ser.reset_input_buffer()
+                    remainder = b''
+                    self.timing.clear()
+                    self.clearRequested.clear()
+
+                # Anything left over from the previous format is useless in the new one
+                if (mode, channels, window) != (self.mode, self.channels, self.window):
+                    mode, channels, window = self.mode, self.channels, self.window
+                    remainder = b''
+                    self.timing.restart()
+
+                # Block for the first byte (up to the port timeout), then take everything waiting
+                data = self.ser.read(1)
+                if not data:
+                    continue
+                start = time.perf_counter()
+                waiting = self.ser.in_waiting
+                if waiting:
+                    data += self.ser.read(min(waiting, READ_SIZE))
+                parsed = time.perf_counter()
+                self.instruments.record("read", parsed - start, nbytes=len(data))
+                self.instruments.gauge("backlog", waiting)
+
+                if mode == BINARY_MODE:
+                    decode = decodeAggregates if window > 1 else decodeFrames
+                    seq, timestamps, values, skipped, remainder = decode(remainder + data, channels)
+                    self.skipped += skipped
+                    self.timing.update(timestamps, seq)
+                else:
+                    parse = parseAggregateLines if window > 1 else parseLines
+                    timestamps, values, errors, remainder = parse(remainder + data, channels)
+                    if errors:
+                        self.errors += errors
+                        log.warning("Invalid line received from the Arduino (%d so far)", self.errors)
+                    self.timing.update(timestamps)
+                self.instruments.record("parse", time.perf_counter() - parsed, len(timestamps), len(data))
+                if len(timestamps):
+                    if self.queued:
+                        self.batches.put(((channels, window), timestamps, values))
+                    # Lines carry no sequence numbers
+                    batch_seq = seq if mode == BINARY_MODE else None
+                    for sink in list(self.sinks):
+                        sink(timestamps, values, batch_seq)
+
+            except Exception as e:
+                if not self.running:
+                    break
+                log.error("Error reading data: %s", e)
+                time.sleep(0.1)
+
+    # Registers/unregisters a function to be called with every batch (timestamps, values, seq), from the
+    # reader thread (seq is None in ASCII mode)
+    def addSink(self, sink):
+        self.sinks.append(sink)
+
+    def removeSink(self, sink):
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+
+    # Switches the decoder used for the incoming stream (ASCII_MODE or BINARY_MODE)
+    def setMode(self, mode):
+        self.mode = mode
+
+    # Sets the number of channels expected in each line/frame
+    def setChannels(self, channels):
+        self.channels = channels
+
+    # Sets the number of samples per aggregate record (1 for raw samples)
+    def setWindow(self, window):
+        self.window = window
+
+    # Returns every batch received since the last call (batches parsed before the last setChannels/setWindow
+    # are dropped: they do not fit the new format)
+    def drain(self):
+        batches = []
+        while True:
+            try:
+                batch_format, timestamps, values = self.batches.get_nowait()
+            except queue.Empty:
+                return batches
+            if batch_format == (self.channels, self.window):
+                batches.append((timestamps, values))
+
+    # Drops everything received so far (queued batches and the port's input buffer)
+    def clear(self):
+        self.clearRequested.set()
+        self.drain()
+
+    def stop(self):
+        self.running = False
+        self.join(timeout=2)
+
+# -----------------------------------------------------------------------------------------------------
+# ------------------------------------------ Acquisition engine ---------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# GUI-free acquisition of data.ino: owns the serial port, the command protocol (GET, STOP,
+# SET_INTERVAL, SET_MODE, SET_CHANNELS, SET_TIMING, SET_AGGREGATE, CLEAR), the reader thread and the sample
+# buffer, which keeps one shared timestamp column and one value column per channel (`columns` columns:
+# aggregateColumns(channels) while aggregating).
+# Batches of (timestamps, values[n, channels]) can be consumed in three ways:
+#   - callbacks added with addCallback(), called from the reader thread as soon as a batch is parsed;
+#   - poll(), which moves the queued batches into the buffer (e.g. from a GUI timer) and returns them;
+#   - iterating over the engine (blocking) or over stream() (asyncio).
+# With queued=False the batches only go to the callbacks (poll() and the iterators get nothing).
+class AcquisitionEngine:
+    def __init__(self, port=DEFAULT_PORT, baudrate=BAUDRATE, capacity=CAPACITY, ser=None, queued=True):
+        self.port = port
+        self.queued = queued
+        self.baudrate = baudrate
+        # An already open serial-like object can be given instead of a port name
+        self.ser = ser
+        self.reader = None
+        self.capacity = capacity
+        self.channels = 1
+        self.window = 1
+        self.buffer = RingBuffer(capacity, dtype=np.float32, shape=(1,))
+        self.mode = ASCII_MODE
+        self.sampling = DELAY_TIMING
+        self.interval = None
+        self.active = False
+        # Per-stage counters and latency histograms (read and parse in the reader thread, append in poll())
+        self.instruments = Instrumentation()
+
+    # Opens the port (waiting for the Arduino to reset) and starts the reader thread.
+    # Raises serial.SerialException if the port cannot be opened.
+    def open(self):
+        if self.ser is None:
+            self.ser = serial.Serial(self.port, self.baudrate, timeout=0.1)
+            time.sleep(RESET_DELAY)
+        self.reader = SerialReader(self.ser, self.instruments)
+        self.reader.queued = self.queued
+        self.reader.start()
+        return self
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.stop()
+        if self.ser is not None and self.ser.is_open:
+            self.ser.close()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
+    # -------------------------------------------- Commands -----------------------------------------------
+
+    def send(self, command):
+        self.ser.write(f"{command}\n".encode('utf-8'))
+        log.debug("Sent: %s", command)
+
+    # Starts the acquisition on the Arduino
+    def start(self):
+        self.send("GET")
+        self.active = True
+
+    # Stops the acquisition on the Arduino
+    def stop(self):
+        self.send("STOP")
+        self.active = False
+
+    # Sets the interval (ms) between acquisitions (between records while aggregating)
+    def setInterval(self, interval):
+        interval = int(interval)
+        if interval <= 0:
+            raise ValueError("The interval must be a positive number of milliseconds")
+        self.send(f"SET_INTERVAL {interval}")
+        self.interval = interval
+        self.reader.timing.interval = interval
+
+    # Switches between delay-paced (DELAY_TIMING) and hardware-timer (TIMER_TIMING) sampling
+    def setTiming(self, timing):
+        if timing not in (DELAY_TIMING, TIMER_TIMING):
+            raise ValueError(f"Unknown sampling timing: {timing}")
+        self.send(f"SET_TIMING {timing}")
+        self.sampling = timing
+        self.reader.timing.timed = timing == TIMER_TIMING
+
+    # Dropped/late samples and jitter since the last clear (see TimingStats)
+    def timingStats(self):
+        return self.reader.timing.stats()
+
+    # Switches between the ASCII and binary streaming protocols
+    def setMode(self, mode):
+        if mode not in (ASCII_MODE, BINARY_MODE):
+            raise ValueError(f"Unknown streaming mode: {mode}")
+        self.send(f"SET_MODE {mode}")
+        self.reader.setMode(mode)
+        self.mode = mode
+
+    # Sets the number of analog inputs sampled together (A0 to A<channels - 1>).
+    # The buffer is replaced by a new one with the right number of columns, so it starts empty.
+    def setChannels(self, channels):
+        channels = int(channels)
+        if not 1 <= channels <= MAX_CHANNELS:
+            raise ValueError(f"The number of channels must be between 1 and {MAX_CHANNELS}")
+        self.send(f"SET_CHANNELS {channels}")
+        self.reader.setChannels(channels)
+        self.reader.clear()
+        self.channels = channels
+        self.buffer = RingBuffer(self.capacity, dtype=np.float32, shape=(self.columns,))
+
+    # Number of value columns of each sample (or aggregate record)
+    @property
+    def columns(self):
+        return aggregateColumns(self.channels) if self.window > 1 else self.channels
+
+    # Makes the Arduino sample `window` times faster and send one aggregate record (mean/min/max/count) per
+    # `window` samples instead of every sample (1 to go back to raw samples). The buffer is replaced, so it
+    # starts empty.
+    def setAggregate(self, window):
+        window = int(window)
+        if not 1 <= window <= MAX_WINDOW:
+            raise ValueError(f"The aggregation window must be between 1 and {MAX_WINDOW} samples")
+        self.send(f"SET_AGGREGATE {window}")
+        self.reader.setWindow(window)
+        self.reader.clear()
+        self.window = window
+        self.buffer = RingBuffer(self.capacity, dtype=np.float32, shape=(self.columns,))
+
+    # Drops every sample (buffer, queued batches, port input) and restarts the Arduino's clock
+    def clear(self):
+        self.reader.clear()
+        self.buffer.clear()
+        self.send("CLEAR")
+        self.active = False
+
+    # ---------------------------------------------- Data -------------------------------------------------
+
+    # Registers/unregisters a function called with (timestamps, values, seq) from the reader thread
+    # (seq: sequence numbers of the binary frames/records, None in ASCII mode)
+    def addCallback(self, callback):
+        self.reader.addSink(callback)
+
+    def removeCallback(self, callback):
+        self.reader.removeSink(callback)
+
+    # Moves every batch received since the last call into the buffer and returns them
+    def poll(self):
+        start = time.perf_counter()
+        batches = self.reader.drain()
+        samples = 0
+        for timestamps, values in batches:
+            self.buffer.extend(timestamps, values)
+            samples += len(timestamps)
+        self.instruments.record("append", time.perf_counter() - start, samples)
+        self.instruments.gauge("queued_batches", len(batches))
+        return batches
+
+    # Blocking iteration over the incoming batches (each one is also added to the buffer)
+    def __iter__(self):
+        while self.reader.is_alive():
+            try:
+                batch_format, timestamps, values = self.reader.batches.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if batch_format != (self.reader.channels, self.reader.window):
+                continue
+            self.buffer.extend(timestamps, values)
+            yield timestamps, values
+
+    # Asynchronous iteration over the incoming batches, for use inside an asyncio event loop
+    async def stream(self):
+        loop = asyncio.get_running_loop()
+        batches = asyncio.Queue()
+        callback = lambda timestamps, values, seq: loop.call_soon_threadsafe(batches.put_nowait, (timestamps, values))
+        self.addCallback(callback)
+        try:
+            while True:
+                timestamps, values = await batches.get()
+                yield timestamps, values
+        finally:
+            self.removeCallback(callback)
+
+# -----------------------------------------------------------------------------------------------------
+# --------------------------------------------- Main --------------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Headless acquisition: records a session (without any GUI) for a given duration
+if __name__ == '__main__':
+    from recording import SessionWriter
+    from trigger import Trigger, EDGES, PRETRIGGER, POSTTRIGGER
+    from sharedring import SharedRingWriter, segmentName, SHARED_NAME
+
+    parser = argparse.ArgumentParser(description="Headless data acquisition from data.ino")
+    parser.add_argument("--port", default=DEFAULT_PORT, help="serial port of the Arduino")
+    parser.add_argument("--baudrate", type=int, default=BAUDRATE)
+    parser.add_argument("--interval", type=int, help="interval between acquisitions (ms)")
+    parser.add_argument("--binary", action="store_true", help="use the binary streaming mode")
+    parser.add_argument("--channels", type=int, default=1, help="number of analog inputs sampled")
+    parser.add_argument("--timer", action="store_true", help="sample from the Arduino's hardware timer")
+    parser.add_argument("--aggregate", type=int, default=1,
+                        help="samples per mean/min/max record sent by the Arduino (1 for raw samples)")
+    parser.add_argument("--duration", type=float, default=10, help="acquisition time (s)")
+    parser.add_argument("--output", help="session folder (default: a new folder in recordings/)")
+    parser.add_argument("--trigger", type=float, help="only record the windows around crossings of this level")
+    parser.add_argument("--edge", default=EDGES[0], choices=EDGES, help="trigger edge")
+    parser.add_argument("--trigger-channel", type=int, default=0, help="channel the trigger looks at")
+    parser.add_argument("--pre", type=int, default=PRETRIGGER, help="samples kept before each trigger")
+    parser.add_argument("--post", type=int, default=POSTTRIGGER, help="samples kept from each trigger on")
+    parser.add_argument("--holdoff", type=float, default=0.0, help="minimum time between two triggers (ms)")
+    parser.add_argument("--hysteresis", type=float, default=0.0, help="trigger hysteresis (ADC units)")
+    parser.add_argument("--metrics", help=f"append pipeline metrics to this file every {EXPORT_INTERVAL:g} s")
+    parser.add_argument("--publish", nargs="?", const=SHARED_NAME,
+                        help=f"publish the samples in shared memory for other processes (default name: {SHARED_NAME})")
+    parser.add_argument("--log-level", default="INFO", help="DEBUG, INFO, WARNING or ERROR")
+    args = parser.parse_args()
+    setupLogging(args.log_level.upper())
+
+    try:
+        # The samples only go to the callbacks (recorder, trigger, publisher): nothing is queued for poll()
+        engine = AcquisitionEngine(args.port, args.baudrate, capacity=1, queued=False).open()
+    except serial.SerialException as e:
+        print("Failed to open serial port:", e)
+        sys.exit(1)
+
+    if args.interval:
+        engine.setInterval(args.interval)
+    if args.binary:
+        engine.setMode(BINARY_MODE)
+    if args.channels != 1:
+        engine.setChannels(args.channels)
+    if args.timer:
+        engine.setTiming(TIMER_TIMING)
+    if args.aggregate != 1:
+        engine.setAggregate(args.aggregate)
+
+    recorder = SessionWriter(args.output, channels=engine.columns)
+    if engine.window > 1:
+        recorder.meta["aggregate"] = aggregateMeta(engine.channels, engine.window)
+    recorder.start()
+    trigger = None
+    process = None
+    if args.trigger is not None:
+        # Only the captured windows go to the recorder (from the reader thread as well)
+        trigger = Trigger(args.trigger, args.edge, args.pre, args.post, args.trigger_channel, args.hysteresis,
+                          args.holdoff)
+        trigger.addCallback(lambda timestamps, values, position: recorder.write(timestamps, values))
+        process = lambda timestamps, values, seq: trigger.process(timestamps, values)
+        engine.addCallback(process)
+    else:
+        engine.addCallback(recorder.write)
+    publisher = None
+    if args.publish:
+        # Every sample (not only the captured windows) is published, on the Arduino's timeline
+        publisher = SharedRingWriter(segmentName(args.publish))
+        columns = aggregateMeta(engine.channels, engine.window)["columns"] if engine.window > 1 else \
+            [f"A{c}" for c in range(engine.channels)]
+        publisher.setFormat(engine.columns, {"port": args.port, "device": 0, "channels": engine.channels,
+                                             "window": engine.window, "columns": columns})
+        engine.addCallback(lambda timestamps, values, seq: publisher.write(timestamps, values))
+    try:
+        engine.start()
+        # The samples go to the recorder from the reader thread: this one only waits
+        deadline = time.monotonic() + args.duration
+        next_export = time.monotonic() + EXPORT_INTERVAL
+        while time.monotonic() < deadline:
+            if args.metrics and time.monotonic() >= next_export:
+                engine.instruments.export(args.metrics)
+                next_export += EXPORT_INTERVAL
+            time.sleep(0.1)
+        engine.stop()
+    except KeyboardInterrupt:
+        engine.stop()
+    finally:
+        # The timing of the acquisition is kept with the session
+        recorder.meta["timing"] = engine.timingStats()
+        if trigger is not None:
+            engine.removeCallback(process)
+            recorder.meta["trigger"] = trigger.settings()
+        if args.metrics:
+            engine.instruments.export(args.metrics)
+        engine.close()
+        recorder.stop()
+        if publisher is not None:
+            publisher.close()
+    timing = recorder.meta["timing"]
+    print(f"Saved {recorder.samples} samples to {recorder.path}")
+    if trigger is not None:
+        print(f"{trigger.count} windows captured")
+    print(f"Dropped {timing['dropped']} samples in {timing['gaps']} gaps, {timing['late']} late, "
+          f"jitter {timing['jitter_ms']:.3f} ms RMS ({timing['max_jitter_ms']:.0f} ms max)")
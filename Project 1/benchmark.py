@@ -0,0 +1,345 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import os
+import sys
+import tty
+import json
+import time
+import argparse
+import threading
+import serial
+import numpy as np
+
+from buffers import RingBuffer
+from decimation import MinMaxPyramid
+from acquisition import AcquisitionEngine, parseLines, decodeFrames, encodeFrames, encodeLines, BINARY_MODE, TIMER_TIMING
+from acquisition import aggregateColumn
+from simulator import DeviceSimulator
+from recording import ReplayPort
+from multidevice import MultiAcquisition
+
+# Chunk size (bytes) used to feed the parse benchmark, similar to what the reader gets from the port
+CHUNK_SIZE = 4096
+# Largest clock error (relative) of the simulated devices in the multi-device benchmark
+MAX_SKEW = 2e-3
+# Plot refresh interval (s) of the end-to-end benchmark, same as gui.py
+PLOT_INTERVAL = 0.033
+# Width (pixels) of the simulated plot
+PIXELS = 1000
+
+# -----------------------------------------------------------------------------------------------------
+# -------------------------------------------- Helpers ------------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Builds n samples of data.ino output (ASCII lines or binary frames)
+def makePayload(n, binary, channels=1):
+    timestamps = np.arange(n, dtype=np.int64)
+    values = (512 + 400 * np.sin(timestamps[:, None] / 100.0 + np.arange(channels))).astype(np.int64)
+    if binary:
+        return encodeFrames(np.arange(n), timestamps, values)
+    return encodeLines(timestamps, values)
+
+# Creates a headless pyqtgraph curve, or returns None if Qt/pyqtgraph are not installed
+def makeCurve():
+    try:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt5.QtWidgets import QApplication
+        import pyqtgraph as pg
+    except ImportError:
+        return None, None
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    widget = pg.PlotWidget()
+    widget.resize(PIXELS, 400)
+    return app, widget.plot(pen='r')
+
+def percentiles(latencies):
+    if not len(latencies):
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"p50": p50, "p95": p95, "p99": p99, "max": float(np.max(latencies))}
+
+# -----------------------------------------------------------------------------------------------------
+# ------------------------------------------ Stage benchmarks -----------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Read stage: raw bytes through a pseudo-terminal into serial.Serial.read(), without any parsing
+def benchRead(samples, binary, channels):
+    payload = makePayload(samples, binary, channels)
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    ser = serial.Serial(os.ttyname(slave), timeout=0.1)
+
+    def writer():
+        view = memoryview(payload)
+        while view:
+            view = view[os.write(master, view[:CHUNK_SIZE]):]
+    thread = threading.Thread(target=writer, daemon=True)
+
+    received = 0
+    start, cpu = time.perf_counter(), time.thread_time()
+    thread.start()
+    while received < len(payload):
+        data = ser.read(max(1, ser.in_waiting))
+        if not data:
+            break
+        received += len(data)
+    elapsed, cpu = time.perf_counter() - start, time.thread_time() - cpu
+
+    thread.join()
+    ser.close()
+    os.close(master)
+    os.close(slave)
+    n = samples * received // len(payload)
+    return {"samples": n, "rate": n / elapsed, "cpu_per_sample_us": 1e6 * cpu / max(n, 1)}
+
+# Parse stage: parseLines/decodeFrames over chunks of an in-memory stream
+def benchParse(samples, binary, channels):
+    payload = makePayload(samples, binary, channels)
+    chunks = [payload[i:i + CHUNK_SIZE] for i in range(0, len(payload), CHUNK_SIZE)]
+    parsed = 0
+    remainder = b''
+    start, cpu = time.perf_counter(), time.process_time()
+    for chunk in chunks:
+        if binary:
+            _, timestamps, _, _, remainder = decodeFrames(remainder + chunk, channels)
+        else:
+            timestamps, _, _, remainder = parseLines(remainder + chunk, channels)
+        parsed += len(timestamps)
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    return {"samples": parsed, "rate": parsed / elapsed, "cpu_per_sample_us": 1e6 * cpu / max(parsed, 1)}
+
+# Plot stage: buffer/pyramid updates plus one redraw per batch of `batch` samples
+def benchPlot(samples, batch, capacity):
+    buffer = RingBuffer(capacity, dtype=np.float32, shape=(1,))
+    pyramid = MinMaxPyramid(buffer, channel=0)
+    app, curve = makeCurve()
+    timestamps = np.arange(samples, dtype=np.float64)
+    values = (512 + 400 * np.sin(timestamps / 100.0)).astype(np.float32)[:, None]
+
+    frames = 0
+    start, cpu = time.perf_counter(), time.process_time()
+    for i in range(0, samples, batch):
+        buffer.extend(timestamps[i:i + batch], values[i:i + batch])
+        pyramid.extend(timestamps[i:i + batch], values[i:i + batch, 0])
+        t, _ = buffer.data()
+        x, y = pyramid.envelope(t[0], t[-1], PIXELS)
+        if curve is not None:
+            curve.setData(x, y)
+            app.processEvents()
+        frames += 1
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    return {
+        "samples": samples,
+        "rate": samples / elapsed,
+        "fps": frames / elapsed,
+        "cpu_per_sample_us": 1e6 * cpu / samples,
+        "setData": curve is not None,
+    }
+
+# -----------------------------------------------------------------------------------------------------
+# ------------------------------------------ End to end -----------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Full pipeline: simulator -> pty -> AcquisitionEngine -> buffer/pyramid -> redraw, like gui.py does.
+# Latency is measured from the moment a sample is written by the simulator to the end of the redraw
+# that first shows it. The CPU time includes the simulator, which runs in the same process.
+def benchEndToEnd(rate, duration, binary, channels, timer, baudrate, noise, capacity, aggregate=1):
+    simulator = DeviceSimulator(rate, baudrate, noise)
+    simulator.start()
+    result = runPipeline(serial.Serial(simulator.port, timeout=0.1), simulator, duration, binary, channels, capacity,
+                         timer, aggregate)
+    simulator.stop()
+    return result
+
+# Same pipeline fed by a recorded session (speed=0 replays as fast as the display path can take it).
+# Sessions recorded with on-device aggregation are replayed as aggregate records of the same window.
+def benchReplay(path, speed, duration, binary, capacity):
+    port = ReplayPort(path, speed)
+    result = runPipeline(port, port, duration, binary, port.channels, capacity, aggregate=port.window)
+    result["replay_rate"] = port.rate()
+    return result
+
+# Runs the GUI's acquisition and display loop on `ser` for `duration` seconds (every channel is drawn).
+# `source` gives the host time at which each sample was sent (writeTimes) and the number sent.
+# With aggregate > 1 the samples are aggregate records of that many samples, drawn as min/max envelopes.
+def runPipeline(ser, source, duration, binary, channels, capacity, timer=False, aggregate=1):
+    engine = AcquisitionEngine(capacity=capacity, ser=ser).open()
+    if binary:
+        engine.setMode(BINARY_MODE)
+    if timer:
+        engine.setTiming(TIMER_TIMING)
+    if channels != 1:
+        engine.setChannels(channels)
+    if aggregate > 1:
+        engine.setAggregate(aggregate)
+    bounds = [(aggregateColumn(channels, "min", c), aggregateColumn(channels, "max", c)) if aggregate > 1 else None
+              for c in range(channels)]
+    pyramids = [MinMaxPyramid(engine.buffer, channel=c, bounds=bounds[c]) for c in range(channels)]
+    curves = [makeCurve() for _ in range(channels)]
+
+    # Timestamps shown on each redraw and the time of that redraw (matched to the send times at the end)
+    shown_timestamps = []
+    shown_times = []
+    frames = 0
+    # The reader empties the port after a format change: it must have done so before the first samples
+    # arrive (a replay at full speed sends the whole session at once)
+    deadline = time.perf_counter() + 1.0
+    while engine.reader.clearRequested.is_set() and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    engine.start()
+    start, cpu = time.perf_counter(), time.process_time()
+    while time.perf_counter() - start < duration:
+        tick = time.perf_counter()
+        batches = engine.poll()
+        for timestamps, values in batches:
+            for c, pyramid in enumerate(pyramids):
+                if pyramid.bounds is not None:
+                    pyramid.extend(timestamps, values[:, pyramid.bounds[0]], values[:, pyramid.bounds[1]])
+                else:
+                    pyramid.extend(timestamps, values[:, c])
+        if batches:
+            t, _ = engine.buffer.data()
+            for pyramid, (app, curve) in zip(pyramids, curves):
+                x, y = pyramid.envelope(t[0], t[-1], PIXELS)
+                if curve is not None:
+                    curve.setData(x, y)
+                    app.processEvents()
+            frames += 1
+            shown = time.perf_counter()
+            for timestamps, _ in batches:
+                shown_timestamps.append(timestamps)
+                shown_times.append(np.full(len(timestamps), shown))
+        time.sleep(max(0.0, PLOT_INTERVAL - (time.perf_counter() - tick)))
+    engine.stop()
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+
+    # Let the samples already in flight arrive before counting the drops
+    time.sleep(0.2)
+    engine.poll()
+    received = engine.buffer.total
+    sent = source.sent if hasattr(source, "sent") else source.replayed
+    timing = engine.timingStats()
+    engine.close()
+
+    latencies = np.empty(0)
+    if shown_times:
+        latencies = 1000 * (np.concatenate(shown_times) - source.writeTimes(np.concatenate(shown_timestamps)))
+    return {
+        "sent": sent,
+        "received": received,
+        "dropped": max(sent - received, 0),
+        "rate": received / elapsed,
+        "fps": frames / elapsed,
+        "latency_ms": percentiles(latencies[np.isfinite(latencies)]),
+        "cpu_per_sample_us": 1e6 * cpu / max(received, 1),
+        "bytes_skipped": engine.reader.skipped,
+        "link_bytes_per_s": source.bytes_sent / elapsed if hasattr(source, "bytes_sent") else None,
+        "timing": {key: timing[key] for key in ("dropped", "late", "jitter_ms", "max_jitter_ms")},
+    }
+
+# Several simulated devices (each with its own clock error) read together by a MultiAcquisition.
+# The alignment error is the aligned timestamp of each sample minus the host time at which it was written:
+# it should stay within a few ms of zero (slightly negative: a sample is taken before it is sent).
+def benchMultiDevice(devices, rate, duration, binary, channels, baudrate, capacity):
+    rng = np.random.default_rng(0)
+    simulators = [DeviceSimulator(rate, baudrate, seed=d, skew=rng.uniform(-MAX_SKEW, MAX_SKEW))
+                  for d in range(devices)]
+    for simulator in simulators:
+        simulator.start()
+    acquisition = MultiAcquisition([s.port for s in simulators], capacity=capacity).open()
+    # Device and aligned timestamps of every batch (the engine callbacks run right after the aligning one)
+    raw = [[] for _ in simulators]
+    aligned = [[] for _ in simulators]
+    for d, engine in enumerate(acquisition.engines):
+        engine.addCallback(lambda timestamps, values, seq, d=d: raw[d].append(timestamps))
+    acquisition.addCallback(lambda device, timestamps, values, seq: aligned[device].append(timestamps))
+    if binary:
+        acquisition.setMode(BINARY_MODE)
+    if channels != 1:
+        acquisition.setChannels(channels)
+
+    acquisition.start()
+    start, cpu = time.perf_counter(), time.process_time()
+    while time.perf_counter() - start < duration:
+        acquisition.poll()
+        time.sleep(PLOT_INTERVAL)
+    acquisition.stop()
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    time.sleep(0.2)
+    acquisition.poll()
+    acquisition.close()
+
+    received = [buffer.total for buffer in acquisition.buffers]
+    errors = []
+    for simulator, device_times, host_times in zip(simulators, raw, aligned):
+        if device_times:
+            written = simulator.writeTimes(np.concatenate(device_times))
+            errors.append(np.concatenate(host_times) - 1000 * (written - acquisition.epoch))
+    errors = np.concatenate(errors) if errors else np.empty(0)
+    sent = sum(simulator.sent for simulator in simulators)
+    for simulator in simulators:
+        simulator.stop()
+    return {
+        "devices": devices,
+        "sent": sent,
+        "received": sum(received),
+        "rate": sum(received) / elapsed,
+        "rate_per_device": sum(received) / elapsed / devices,
+        "cpu_per_sample_us": 1e6 * cpu / max(sum(received), 1),
+        "alignment_error_ms": percentiles(errors[np.isfinite(errors)]),
+        "skew_ppm": {f"D{d}": skew for d, (_, skew) in enumerate(acquisition.clocks())},
+    }
+
+# -----------------------------------------------------------------------------------------------------
+# --------------------------------------------- Main --------------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+def show(name, result):
+    print(f"\n{name}")
+    for key, value in result.items():
+        if isinstance(value, dict):
+            value = ", ".join(f"{k}={v:.2f}" if v is not None else f"{k}=-" for k, v in value.items())
+        elif isinstance(value, float):
+            value = f"{value:,.2f}"
+        print(f"  {key:<20} {value}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Throughput/latency benchmark of the acquisition path")
+    parser.add_argument("--samples", type=int, default=200000, help="samples for the stage benchmarks")
+    parser.add_argument("--rate", type=float, default=5000, help="simulated samples per second")
+    parser.add_argument("--duration", type=float, default=5, help="end-to-end run time (s)")
+    parser.add_argument("--baudrate", type=int, default=0, help="emulated baud rate (0 for unlimited)")
+    parser.add_argument("--noise", type=float, default=0.0, help="probability of corrupting each byte")
+    parser.add_argument("--binary", action="store_true", help="use the binary streaming mode")
+    parser.add_argument("--channels", type=int, default=1, help="number of analog inputs sampled")
+    parser.add_argument("--timer", action="store_true", help="simulate hardware-timer sampling")
+    parser.add_argument("--aggregate", type=int, default=1, help="samples per aggregate record (end to end)")
+    parser.add_argument("--devices", type=int, default=0, help="also read this many simulated devices together")
+    parser.add_argument("--replay", help="also run the pipeline on a recorded session folder")
+    parser.add_argument("--speed", type=float, default=0, help="replay speed (0 for as fast as possible)")
+    parser.add_argument("--capacity", type=int, default=2000000, help="samples kept in memory")
+    parser.add_argument("--json", help="also save the results to this file")
+    args = parser.parse_args()
+
+    results = {
+        "read": benchRead(args.samples, args.binary, args.channels),
+        "parse": benchParse(args.samples, args.binary, args.channels),
+        "plot": benchPlot(args.samples, max(1, int(args.rate * PLOT_INTERVAL)), args.capacity),
+        "end_to_end": benchEndToEnd(args.rate, args.duration, args.binary, args.channels, args.timer,
+                                    args.baudrate or None, args.noise, args.capacity, args.aggregate),
+    }
+    if args.devices:
+        results["multi_device"] = benchMultiDevice(args.devices, args.rate, args.duration, args.binary, args.channels,
+                                                   args.baudrate or None, args.capacity)
+    if args.replay:
+        results["replay"] = benchReplay(args.replay, args.speed, args.duration, args.binary, args.capacity)
+    for name, result in results.items():
+        show(name, result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4, default=float)
@@ -0,0 +1,86 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import numpy as np
+
+# -----------------------------------------------------------------------------------------------------
+# ------------------------------------------ Ring buffer ----------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Fixed-capacity buffer for (timestamp, value) samples, backed by preallocated NumPy arrays.
+# Every sample is written twice, at index i and i + capacity, so the last `capacity` samples are
+# always available as one contiguous slice. Appending and reading the window are both O(1),
+# no matter how many points are kept. Each value may itself be an array of the given shape
+# (e.g. shape=(2,) for a (min, max) pair).
+class RingBuffer:
+    def __init__(self, capacity, dtype=np.float64, shape=()):
+        self.capacity = int(capacity)
+        self.timestamps = np.zeros(2 * self.capacity, dtype=np.float64)
+        self.values = np.zeros((2 * self.capacity,) + tuple(shape), dtype=dtype)
+        self.clear()
+
+    def clear(self):
+        # Forget all samples (the arrays themselves are kept and reused)
+        self.head = 0
+        self.count = 0
+        # Total number of samples ever appended, used to know if anything new arrived
+        self.total = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, value):
+        # Store one sample in both halves of the arrays
+        i = self.head
+        self.timestamps[i] = self.timestamps[i + self.capacity] = timestamp
+        self.values[i] = self.values[i + self.capacity] = value
+        self.head = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.total += 1
+
+    def extend(self, timestamps, values):
+        # Store a whole batch of samples with vectorized writes
+        timestamps = np.asarray(timestamps)
+        values = np.asarray(values)
+        n = len(timestamps)
+        if n == 0:
+            return
+        # Only the last `capacity` samples of a batch can survive
+        if n > self.capacity:
+            skipped = n - self.capacity
+            timestamps = timestamps[skipped:]
+            values = values[skipped:]
+            self.head = (self.head + skipped) % self.capacity
+            self.total += skipped
+            n = self.capacity
+
+        idx = (self.head + np.arange(n)) % self.capacity
+        self.timestamps[idx] = timestamps
+        self.timestamps[idx + self.capacity] = timestamps
+        self.values[idx] = values
+        self.values[idx + self.capacity] = values
+        self.head = (self.head + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+        self.total += n
+
+    def data(self, channel=None):
+        # Returns views (no copy) of the stored samples, oldest first (only one column if channel is given)
+        start = self.head + self.capacity - self.count
+        end = self.head + self.capacity
+        return self.timestamps[start:end], self.column(channel)[start:end]
+
+    # Absolute number (counted since the last clear) of the oldest sample still stored
+    def first(self):
+        return self.total - self.count
+
+    # Returns views of the samples with absolute numbers start <= n < end (they must still be stored)
+    def slice(self, start, end, channel=None):
+        offset = self.head + self.capacity - self.total
+        return self.timestamps[start + offset:end + offset], self.column(channel)[start + offset:end + offset]
+
+    # Values of one channel (a strided view), or all of them if channel is None
+    def column(self, channel):
+        return self.values if channel is None else self.values[:, channel]
@@ -3,6 +3,325 @@ bool dataAcquisitionActive = false;
 int acquisitionInterval = 50;
 unsigned long resetTime = 0;  
 
+// Binary streaming mode (negotiated with SET_MODE BINARY / SET_MODE ASCII)
+bool binaryMode = false;
+// Sequence number of the next sample (also counted for the samples lost in a full burst buffer)
+volatile uint8_t sequence = 0;
+
+// Number of analog inputs sampled together, A0 to A<channelCount - 1> (set with SET_CHANNELS)
+const int MAX_CHANNELS = 6;
+const uint8_t CHANNEL_PINS[MAX_CHANNELS] = {A0, A1, A2, A3, A4, A5};
+volatile int channelCount = 1;
+
+// One sample of every channel, with its timestamp and sequence number
+struct Sample {
+  int values[MAX_CHANNELS];
+  unsigned long timestamp;
+  uint8_t sequence;
+};
+
+// Sampling timing (negotiated with SET_TIMING DELAY / SET_TIMING TIMER):
+//   DELAY: sample, send and then delay(acquisitionInterval), so the real period also includes the
+//          time spent sending
+//   TIMER: the Timer1 interrupt samples every acquisitionInterval ms into a small burst buffer, which
+//          loop() sends; when the link cannot keep up and the buffer is full, samples are dropped but
+//          their sequence numbers are still used, so the host can count them. The interrupt only takes the
+//          timestamp and starts the first conversion: each ADC-complete interrupt stores one channel and
+//          starts the next, so interrupts are never kept disabled for a whole analogRead()
+bool timerMode = false;
+const int BURST_SIZE = 16;
+Sample burst[BURST_SIZE];
+volatile uint8_t burstHead = 0;
+volatile uint8_t burstCount = 0;
+// Channel being converted for the sample after the last one in the burst buffer (-1 when idle)
+volatile int8_t adcChannel = -1;
+void sendBurst();
+
+// On-device aggregation (negotiated with SET_AGGREGATE <n>): the inputs are sampled n times faster and
+// one record is sent per window of n samples, with the mean, minimum and maximum of each channel, the
+// number of samples and the timestamp of the first one (n = 1 sends every sample, as usual). The records
+// keep the pace of acquisitionInterval, so the link carries as many bytes as before (a record is a few
+// samples long) while the peaks between the records now show up in the min/max.
+const int MAX_WINDOW = 1000;
+int aggregateWindow = 1;
+
+struct Window {
+  int minimum[MAX_CHANNELS];
+  int maximum[MAX_CHANNELS];
+  unsigned long sum[MAX_CHANNELS];
+  unsigned int count;
+  unsigned long timestamp;
+};
+Window window;
+// Sequence number of the next aggregate record
+uint8_t windowSequence = 0;
+
+// Time (us) between two samples: acquisitionInterval, divided among the samples of a record when aggregating
+unsigned long samplePeriod() {
+  return (unsigned long) acquisitionInterval * 1000UL / aggregateWindow;
+}
+
+// Waits for the next sample in DELAY timing (the time spent sending comes on top of it)
+void waitSample() {
+  unsigned long period = samplePeriod();
+  delay(period / 1000);
+  delayMicroseconds(period % 1000);
+}
+
+// Reads every channel, under a single timestamp
+void takeSample(Sample &sample) {
+  for (int c = 0; c < channelCount; c++) {
+    sample.values[c] = analogRead(CHANNEL_PINS[c]);
+  }
+  sample.timestamp = millis() - resetTime;
+  sample.sequence = sequence++;
+}
+
+// Starts the conversion of one channel, interrupting when it is done (AVcc reference, as analogRead())
+void startConversion(int channel) {
+  ADMUX = (1 << REFS0) | ((CHANNEL_PINS[channel] - A0) & 0x07);
+  ADCSRA |= (1 << ADIE) | (1 << ADSC);
+}
+
+// Timer1 compare interrupt: one sample per sample period (its channels are converted afterwards)
+ISR(TIMER1_COMPA_vect) {
+  if (burstCount == BURST_SIZE || adcChannel >= 0) {
+    // Burst buffer full (or the previous sample still converting): the sample is lost, only its
+    // sequence number is used up
+    sequence++;
+    return;
+  }
+  Sample &sample = burst[(burstHead + burstCount) % BURST_SIZE];
+  sample.timestamp = millis() - resetTime;
+  sample.sequence = sequence++;
+  adcChannel = 0;
+  startConversion(0);
+}
+
+// ADC conversion complete: stores the channel and starts the next one; the sample is added to the burst
+// buffer once every channel is converted
+ISR(ADC_vect) {
+  Sample &sample = burst[(burstHead + burstCount) % BURST_SIZE];
+  sample.values[adcChannel] = ADC;
+  adcChannel++;
+  if (adcChannel < channelCount) {
+    startConversion(adcChannel);
+  } else {
+    adcChannel = -1;
+    ADCSRA &= ~(1 << ADIE);
+    burstCount++;
+  }
+}
+
+// Starts Timer1 in CTC mode, interrupting every sample period
+// (prescaler 64, in steps of 4 us, for periods up to 262 ms, 1024 for up to 4194 ms, at 16 MHz)
+void startTimer() {
+  unsigned long period = samplePeriod();
+  unsigned long ticks = (F_CPU / 64 / 1000) * period / 1000;
+  uint8_t prescaler = (1 << CS11) | (1 << CS10);
+  if (ticks > 65536) {
+    ticks = (F_CPU / 1024) * (period / 1000) / 1000;
+    prescaler = (1 << CS12) | (1 << CS10);
+  }
+  if (ticks > 65536) {
+    ticks = 65536;
+  }
+  if (ticks < 1) {
+    ticks = 1;
+  }
+
+  noInterrupts();
+  burstHead = 0;
+  burstCount = 0;
+  TCCR1A = 0;
+  TCCR1B = (1 << WGM12) | prescaler;
+  TCNT1 = 0;
+  OCR1A = ticks - 1;
+  TIMSK1 |= (1 << OCIE1A);
+  interrupts();
+}
+
+// Stops Timer1 and waits for the sample being converted, so the burst buffer keeps every sample taken
+void stopTimer() {
+  noInterrupts();
+  TIMSK1 &= ~(1 << OCIE1A);
+  TCCR1B = 0;
+  interrupts();
+  while (adcChannel >= 0) {}
+}
+
+// Drops the samples waiting in the burst buffer
+void clearBurst() {
+  noInterrupts();
+  burstHead = 0;
+  burstCount = 0;
+  interrupts();
+}
+
+// Starts/stops the sampling timer according to the current state (only used in TIMER timing).
+// The samples already taken are sent before the timer is stopped or restarted.
+void updateTimer() {
+  stopTimer();
+  sendBurst();
+  if (dataAcquisitionActive && timerMode) {
+    startTimer();
+  }
+}
+
+// Binary frame: sync word 0xA55A, sequence counter, one value per channel, timestamp and checksum
+// (8 + 2 * channelCount bytes, little-endian). Every channel shares the frame's timestamp.
+const uint8_t SYNC_LOW = 0x5A;
+const uint8_t SYNC_HIGH = 0xA5;
+const int MAX_FRAME_SIZE = 8 + 2 * MAX_CHANNELS;
+
+// Sends one sample of every channel as a binary frame
+void sendFrame(const Sample &sample) {
+  uint8_t frame[MAX_FRAME_SIZE];
+  int size = 0;
+  frame[size++] = SYNC_LOW;
+  frame[size++] = SYNC_HIGH;
+  frame[size++] = sample.sequence;
+  for (int c = 0; c < channelCount; c++) {
+    frame[size++] = sample.values[c] & 0xFF;
+    frame[size++] = (sample.values[c] >> 8) & 0xFF;
+  }
+  frame[size++] = sample.timestamp & 0xFF;
+  frame[size++] = (sample.timestamp >> 8) & 0xFF;
+  frame[size++] = (sample.timestamp >> 16) & 0xFF;
+  frame[size++] = (sample.timestamp >> 24) & 0xFF;
+
+  // Checksum: sum of every byte after the sync word
+  uint8_t checksum = 0;
+  for (int i = 2; i < size; i++) {
+    checksum += frame[i];
+  }
+  frame[size++] = checksum;
+
+  Serial.write(frame, size);
+}
+
+// Sends one sample of every channel as a text line: "v0, v1, ..., timestamp"
+void sendLine(const Sample &sample) {
+  String line = "";
+  for (int c = 0; c < channelCount; c++) {
+    line += String(sample.values[c]) + ", ";
+  }
+  Serial.println(line + String(sample.timestamp));
+}
+
+void sendSample(const Sample &sample) {
+  if (binaryMode) {
+    sendFrame(sample);
+  } else {
+    sendLine(sample);
+  }
+}
+
+// Binary aggregate record: sync word 0xA55B, record sequence counter, mean (in 1/64 of an ADC unit),
+// min and max of each channel, count, timestamp and checksum (10 + 6 * channelCount bytes, little-endian)
+const uint8_t AGGREGATE_SYNC_HIGH = 0xA5;
+const uint8_t AGGREGATE_SYNC_LOW = 0x5B;
+const int MAX_RECORD_SIZE = 10 + 6 * MAX_CHANNELS;
+
+void putWord(uint8_t *record, int &size, unsigned int value) {
+  record[size++] = value & 0xFF;
+  record[size++] = (value >> 8) & 0xFF;
+}
+
+// Sends the current window as an aggregate record and starts a new one
+void sendWindow() {
+  if (window.count == 0) {
+    return;
+  }
+  if (binaryMode) {
+    uint8_t record[MAX_RECORD_SIZE];
+    int size = 0;
+    record[size++] = AGGREGATE_SYNC_LOW;
+    record[size++] = AGGREGATE_SYNC_HIGH;
+    record[size++] = windowSequence;
+    for (int c = 0; c < channelCount; c++) {
+      putWord(record, size, (window.sum[c] * 64 + window.count / 2) / window.count);
+    }
+    for (int c = 0; c < channelCount; c++) {
+      putWord(record, size, window.minimum[c]);
+    }
+    for (int c = 0; c < channelCount; c++) {
+      putWord(record, size, window.maximum[c]);
+    }
+    putWord(record, size, window.count);
+    putWord(record, size, window.timestamp & 0xFFFF);
+    putWord(record, size, (window.timestamp >> 16) & 0xFFFF);
+
+    uint8_t checksum = 0;
+    for (int i = 2; i < size; i++) {
+      checksum += record[i];
+    }
+    record[size++] = checksum;
+    Serial.write(record, size);
+  } else {
+    // "mean0, ..., min0, ..., max0, ..., count, timestamp"
+    String line = "";
+    for (int c = 0; c < channelCount; c++) {
+      line += String((float) window.sum[c] / window.count, 2) + ", ";
+    }
+    for (int c = 0; c < channelCount; c++) {
+      line += String(window.minimum[c]) + ", ";
+    }
+    for (int c = 0; c < channelCount; c++) {
+      line += String(window.maximum[c]) + ", ";
+    }
+    Serial.println(line + String(window.count) + ", " + String(window.timestamp));
+  }
+  windowSequence++;
+  window.count = 0;
+}
+
+// Adds a sample to the current window, which is sent once it holds aggregateWindow samples
+void aggregateSample(const Sample &sample) {
+  if (window.count == 0) {
+    window.timestamp = sample.timestamp;
+    for (int c = 0; c < channelCount; c++) {
+      window.minimum[c] = sample.values[c];
+      window.maximum[c] = sample.values[c];
+      window.sum[c] = 0;
+    }
+  }
+  for (int c = 0; c < channelCount; c++) {
+    window.minimum[c] = min(window.minimum[c], sample.values[c]);
+    window.maximum[c] = max(window.maximum[c], sample.values[c]);
+    window.sum[c] += sample.values[c];
+  }
+  window.count++;
+  if (window.count >= aggregateWindow) {
+    sendWindow();
+  }
+}
+
+// Sends a sample, or adds it to the current window when aggregating
+void handleSample(const Sample &sample) {
+  if (aggregateWindow > 1) {
+    aggregateSample(sample);
+  } else {
+    sendSample(sample);
+  }
+}
+
+// Sends every sample the timer interrupt has taken so far (oldest first)
+void sendBurst() {
+  while (burstCount > 0) {
+    Sample sample;
+    noInterrupts();
+    sample = burst[burstHead];
+    interrupts();
+    handleSample(sample);
+
+    noInterrupts();
+    burstHead = (burstHead + 1) % BURST_SIZE;
+    burstCount--;
+    interrupts();
+  }
+}
+
 void setup() {
   // Initialize serial communication at 38400 baud
   Serial.begin(38400);
@@ -18,11 +337,15 @@ void loop() {
     // Stop acquisition if the incoming command is STOP
     if (command == "STOP") {  
       dataAcquisitionActive = false;  
+      // The samples still in the burst buffer are sent, then the window being built with the samples it has
+      updateTimer();
+      sendWindow();
     } 
 
     // Start acquisition if the incoming command is GET
     else if (command == "GET") {
       dataAcquisitionActive = true;  
+      updateTimer();
     }
 
     // Set the interval to what was sent by the user if the incoming command is SET_INTERVAL
@@ -37,14 +360,85 @@ void loop() {
         int newInterval = command.toInt();  
         if (newInterval > 0) {
           acquisitionInterval = newInterval;  
+          updateTimer();
         }
       }
     }
 
+    // Switch between the ASCII and binary streaming modes if the incoming command is SET_MODE
+    else if (command.startsWith("SET_MODE")) {
+      command.replace("SET_MODE", "");
+      command.trim();
+
+      if (command == "BINARY") {
+        binaryMode = true;
+        sequence = 0;
+      } else if (command == "ASCII") {
+        binaryMode = false;
+      } else {
+        Serial.println("ERROR");
+      }
+    }
+
+    // Set the number of channels sampled (1 to MAX_CHANNELS) if the incoming command is SET_CHANNELS
+    else if (command.startsWith("SET_CHANNELS")) {
+      command.replace("SET_CHANNELS", "");
+      command.trim();
+
+      int newCount = command.toInt();
+      if (newCount >= 1 && newCount <= MAX_CHANNELS) {
+        channelCount = newCount;
+        window.count = 0;
+      } else {
+        Serial.println("ERROR");
+      }
+    }
+
+    // Switch between delay-paced and hardware-timer sampling if the incoming command is SET_TIMING
+    else if (command.startsWith("SET_TIMING")) {
+      command.replace("SET_TIMING", "");
+      command.trim();
+
+      // The timer is only reprogrammed for a valid timing
+      if (command == "TIMER") {
+        timerMode = true;
+        updateTimer();
+      } else if (command == "DELAY") {
+        timerMode = false;
+        updateTimer();
+      } else {
+        Serial.println("ERROR");
+      }
+    }
+
+    // Set the number of samples per aggregate record (1 to MAX_WINDOW, 1 sends every sample) if the incoming command is SET_AGGREGATE
+    else if (command.startsWith("SET_AGGREGATE")) {
+      command.replace("SET_AGGREGATE", "");
+      command.trim();
+
+      int newWindow = command.toInt();
+      if (newWindow >= 1 && newWindow <= MAX_WINDOW) {
+        // The samples taken at the old pace are sent first, then the timer restarts at the new one
+        stopTimer();
+        sendBurst();
+        aggregateWindow = newWindow;
+        window.count = 0;
+        windowSequence = 0;
+        updateTimer();
+      } else {
+        Serial.println("ERROR");
+      }
+    }
+
     // Restarts the timer is the incoming command is CLEAR
     else if (command == "CLEAR") {
       dataAcquisitionActive = false;  
+      stopTimer();
+      clearBurst();
       resetTime = millis();
+      sequence = 0;
+      window.count = 0;
+      windowSequence = 0;
     }
     // Invalid command
     else {
@@ -52,11 +446,15 @@ void loop() {
     }
   }
 
-  if (dataAcquisitionActive) {
-    // Read the analog value from pin A0 and send it along with the current timestamp
-    int value = analogRead(A0);  
-    Serial.println(String(value) + ", " + String(millis() - resetTime));
+  if (dataAcquisitionActive && timerMode) {
+    sendBurst();
+  }
+  else if (dataAcquisitionActive) {
+    // Read every channel and send them along with a single timestamp
+    Sample sample;
+    takeSample(sample);
+    handleSample(sample);
     // Wait before next reading
-    delay(acquisitionInterval);
+    waitSample();
   }
 }
\ No newline at end of file
@@ -0,0 +1,120 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import numpy as np
+
+from buffers import RingBuffer
+
+# Number of samples of one level merged into a single bucket of the next level
+FACTOR = 4
+# Levels are added until the coarsest one has less than this many buckets
+MIN_BUCKETS = 256
+
+# -----------------------------------------------------------------------------------------------------
+# ----------------------------------------- Min/max pyramid -------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Multi-resolution min/max envelope of the samples held in a RingBuffer.
+# Level L keeps, for each bucket of FACTOR**L consecutive samples, its first timestamp and its
+# (min, max) values. The levels are updated incrementally as batches arrive (amortized O(1) per sample),
+# so any time window can be drawn with about one bucket per pixel, without losing spikes, and the
+# raw samples are used once the window is narrow enough.
+# For aggregate records (see acquisition.py), `bounds` gives the (min, max) columns of the buffer: the
+# levels are built from them and even the finest view is drawn as the records' min/max envelope.
+class MinMaxPyramid:
+    def __init__(self, buffer, factor=FACTOR, channel=None, bounds=None):
+        self.buffer = buffer
+        # Column of a multi-channel buffer this pyramid describes
+        self.channel = channel
+        self.bounds = bounds
+        self.factor = factor
+        self.levels = []
+        size = factor
+        while buffer.capacity // size >= MIN_BUCKETS:
+            # +2 buckets so the ones overlapping the oldest raw samples are still available
+            self.levels.append(RingBuffer(buffer.capacity // size + 2, dtype=buffer.values.dtype, shape=(2,)))
+            size *= factor
+        self.clear()
+
+    def clear(self):
+        for level in self.levels:
+            level.clear()
+        # Samples (or buckets) of each level waiting for their bucket to be complete
+        self.pending = [None] * len(self.levels)
+
+    # Adds a batch of samples (the same batch that was appended to the raw buffer, only this channel's values).
+    # With `bounds`, the batch's minima and maxima are given instead (values and maxs).
+    def extend(self, timestamps, values, maxs=None):
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        mins = np.asarray(values)
+        maxs = mins if maxs is None else np.asarray(maxs)
+        for i, level in enumerate(self.levels):
+            if self.pending[i] is not None:
+                t, lo, hi = self.pending[i]
+                timestamps = np.concatenate((t, timestamps))
+                mins = np.concatenate((lo, mins))
+                maxs = np.concatenate((hi, maxs))
+
+            complete = len(timestamps) // self.factor * self.factor
+            self.pending[i] = (timestamps[complete:], mins[complete:], maxs[complete:])
+            if not complete:
+                return
+
+            # Reduce every group of `factor` entries to one bucket
+            timestamps = timestamps[:complete:self.factor]
+            mins = mins[:complete].reshape(-1, self.factor).min(axis=1)
+            maxs = maxs[:complete].reshape(-1, self.factor).max(axis=1)
+            level.extend(timestamps, np.column_stack((mins, maxs)))
+
+    # Returns (x, y) arrays to draw the samples with start <= timestamp <= end using about
+    # `pixels` points. Decimated windows are drawn as a min/max zigzag, one pair per bucket.
+    def envelope(self, start, end, pixels):
+        if self.bounds is None:
+            timestamps, values = self.buffer.data(self.channel)
+            lows = highs = values
+        else:
+            timestamps, lows = self.buffer.data(self.bounds[0])
+            _, highs = self.buffer.data(self.bounds[1])
+        first = int(np.searchsorted(timestamps, start, side='left'))
+        last = int(np.searchsorted(timestamps, end, side='right'))
+        # One extra sample on each side so the curve reaches the edges of the view
+        first = max(first - 1, 0)
+        last = min(last + 1, len(timestamps))
+        n = last - first
+        pixels = max(int(pixels), 1)
+
+        # Pick the coarsest level that still has at least one bucket per pixel
+        level = -1
+        size = 1
+        while level + 1 < len(self.levels) and n // (size * self.factor) >= pixels:
+            level += 1
+            size *= self.factor
+
+        if level < 0 or n <= 2 * pixels:
+            if self.bounds is None:
+                return timestamps[first:last], values[first:last]
+            return (np.repeat(timestamps[first:last], 2),
+                    np.column_stack((lows[first:last], highs[first:last])).reshape(-1))
+
+        # Buckets fully inside the level (absolute sample numbers are used to find them)
+        offset = self.buffer.first()
+        bucket_t, bucket_v = self.levels[level].data()
+        first_bucket = max((offset + first) // size, self.levels[level].first())
+        last_bucket = min((offset + last) // size, self.levels[level].total)
+        i0 = first_bucket - self.levels[level].first()
+        i1 = last_bucket - self.levels[level].first()
+        t = bucket_t[i0:i1]
+        lo = bucket_v[i0:i1, 0]
+        hi = bucket_v[i0:i1, 1]
+
+        # Newest samples whose bucket is not complete yet come straight from the raw buffer
+        tail = max(last_bucket * size - offset, first)
+        if tail < last:
+            t = np.append(t, timestamps[tail])
+            lo = np.append(lo, lows[tail:last].min())
+            hi = np.append(hi, highs[tail:last].max())
+
+        return np.repeat(t, 2), np.column_stack((lo, hi)).reshape(-1)
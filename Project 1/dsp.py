@@ -0,0 +1,180 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Number of samples of the rolling statistics window
+STATS_WINDOW = 1000
+# Running sums are recomputed from scratch every RESYNC samples to stop rounding errors from piling up
+RESYNC = 1000000
+
+# Welch spectrum: samples per segment, overlap between segments and number of segments averaged
+SEGMENT = 1024
+OVERLAP = 0.5
+SEGMENTS = 8
+
+# -----------------------------------------------------------------------------------------------------
+# ---------------------------------------- Rolling statistics -----------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Mean, RMS, standard deviation, min and max of the last `window` samples of a RingBuffer.
+# update() reads the new samples (and the ones leaving the window) straight from the buffer, so the
+# cost is O(1) per sample and no copy of the history is kept:
+#   - sum and sum of squares are updated by adding the new samples and subtracting the old ones;
+#   - min/max use the van Herk/Gil-Werman scheme: the window always spans the end of the previous
+#     block of `window` samples (whose suffix minima/maxima are computed once, when it is complete)
+#     and the start of the current block (whose running min/max is kept).
+class RollingStats:
+    def __init__(self, buffer, window=STATS_WINDOW, channel=None):
+        self.buffer = buffer
+        self.channel = channel
+        self.window = int(window)
+        self.clear()
+
+    def clear(self):
+        self.seen = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.since_resync = 0
+        self.prefix_min = np.inf
+        self.prefix_max = -np.inf
+        self.suffix_min = None
+        self.suffix_max = None
+        self.suffix_start = None
+
+    # Processes every sample appended to the buffer since the last call
+    def update(self):
+        total = self.buffer.total
+        # The buffer was cleared
+        if total < self.seen:
+            self.clear()
+        if total == self.seen:
+            return
+
+        start = self.seen
+        old_start, old_end = max(start - self.window, 0), max(total - self.window, 0)
+        if old_start < self.buffer.first() or self.since_resync >= RESYNC:
+            self.resync()
+        else:
+            _, new = self.buffer.slice(start, total, self.channel)
+            _, old = self.buffer.slice(old_start, old_end, self.channel)
+            new = new.astype(np.float64)
+            old = old.astype(np.float64)
+            self.sum += new.sum() - old.sum()
+            self.sumsq += np.dot(new, new) - np.dot(old, old)
+            self.since_resync += total - start
+
+        self.updateBlocks(start, total)
+        self.seen = total
+
+    # Recomputes the sums over the current window
+    def resync(self):
+        total = self.buffer.total
+        _, values = self.buffer.slice(max(total - self.window, self.buffer.first()), total, self.channel)
+        values = values.astype(np.float64)
+        self.sum = values.sum()
+        self.sumsq = np.dot(values, values)
+        self.since_resync = 0
+
+    def updateBlocks(self, start, total):
+        block = total // self.window * self.window
+        if block > start:
+            # A block was completed: keep its suffix min/max and restart the running ones
+            previous = block - self.window
+            if previous >= self.buffer.first():
+                _, values = self.buffer.slice(previous, block, self.channel)
+                self.suffix_min = np.minimum.accumulate(values[::-1])[::-1]
+                self.suffix_max = np.maximum.accumulate(values[::-1])[::-1]
+                self.suffix_start = previous
+            else:
+                self.suffix_min = self.suffix_max = self.suffix_start = None
+            self.prefix_min, self.prefix_max = np.inf, -np.inf
+            start = block
+
+        if total > start:
+            _, values = self.buffer.slice(start, total, self.channel)
+            self.prefix_min = min(self.prefix_min, values.min())
+            self.prefix_max = max(self.prefix_max, values.max())
+
+    # Returns a dict with the statistics of the current window (None while the buffer is empty)
+    def stats(self):
+        n = min(self.window, self.seen, self.buffer.count)
+        if n <= 0:
+            return None
+        mean = self.sum / n
+        meansq = self.sumsq / n
+
+        lo, hi = self.prefix_min, self.prefix_max
+        window_start = self.seen - n
+        if self.suffix_start is not None and window_start < self.suffix_start + self.window:
+            i = max(window_start - self.suffix_start, 0)
+            lo = min(lo, self.suffix_min[i])
+            hi = max(hi, self.suffix_max[i])
+
+        return {
+            "samples": n,
+            "mean": float(mean),
+            "rms": float(np.sqrt(max(meansq, 0.0))),
+            "std": float(np.sqrt(max(meansq - mean * mean, 0.0))),
+            "min": float(lo),
+            "max": float(hi),
+        }
+
+# -----------------------------------------------------------------------------------------------------
+# --------------------------------------------- Spectrum ----------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Welch power spectrum of the most recent samples of a RingBuffer.
+# The overlapping segments are strided views of the buffer (no copy of the history); the Hann window,
+# the frequency axis and the work array the segments are windowed into are allocated once and reused.
+# The spectrum is only recomputed once a new hop of samples has arrived.
+class Spectrum:
+    def __init__(self, buffer, segment=SEGMENT, overlap=OVERLAP, segments=SEGMENTS, channel=None):
+        self.buffer = buffer
+        self.channel = channel
+        self.segment = int(segment)
+        self.hop = max(1, int(self.segment * (1 - overlap)))
+        self.segments = int(segments)
+        self.window = np.hanning(self.segment)
+        # Scale so that the result is a power spectral density (units^2/Hz once divided by fs)
+        self.scale = 1.0 / np.sum(self.window ** 2)
+        self.work = np.empty((self.segments, self.segment), dtype=np.float64)
+        self.bins = np.fft.rfftfreq(self.segment)
+        self.computed = None
+        self.result = None
+
+    # Returns (frequencies in Hz, power spectral density), or None if there are not enough samples yet
+    def compute(self):
+        total = self.buffer.total
+        if self.computed is not None and 0 <= total - self.computed < self.hop:
+            return self.result
+
+        timestamps, values = self.buffer.data(self.channel)
+        available = (len(values) - self.segment) // self.hop + 1
+        if len(values) < self.segment or available < 1:
+            return None
+        count = min(self.segments, available)
+        span = self.segment + (count - 1) * self.hop
+
+        # Sampling frequency from the timestamps (ms) of the samples being analysed
+        duration = timestamps[-1] - timestamps[-span]
+        if duration <= 0:
+            return None
+        fs = 1000.0 * (span - 1) / duration
+
+        segments = sliding_window_view(values[-span:], self.segment)[::self.hop]
+        work = self.work[:count]
+        np.subtract(segments, segments.mean(axis=1, keepdims=True), out=work)
+        np.multiply(work, self.window, out=work)
+        power = np.abs(np.fft.rfft(work, axis=1)) ** 2
+        density = power.mean(axis=0) * self.scale / fs
+        # One-sided spectrum: every bin except DC (and Nyquist) carries the power of both halves
+        density[1:-1] *= 2
+
+        self.computed = total
+        self.result = (self.bins * fs, density)
+        return self.result
@@ -5,30 +5,76 @@
 # -----------------------------------------------------------------------------------------------------
 
 import sys
-import serial
 import time
+import logging
+import argparse
+import serial
 import numpy as np
-from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QVBoxLayout, QHBoxLayout, QMessageBox, QLabel, QLineEdit, QWidget
+from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QVBoxLayout, QHBoxLayout, QMessageBox, QLabel, QLineEdit, QWidget, QCheckBox, QComboBox
 from PyQt5.QtCore import QTimer
 import pyqtgraph as pg
 
-# Maximum number of points to display
-MAX_POINTS = 1e4  
+from decimation import MinMaxPyramid
+from dsp import RollingStats, Spectrum
+from acquisition import ASCII_MODE, BINARY_MODE, DELAY_TIMING, TIMER_TIMING, DEFAULT_PORT, BAUDRATE, MAX_CHANNELS
+from acquisition import aggregateColumn, aggregateMeta
+from multidevice import MultiAcquisition
+from recording import MultiSessionWriter, ReplayPort
+from trigger import Trigger, EDGES
+from sharedring import SHARED_NAME
+from instrumentation import setupLogging, EXPORT_INTERVAL
+
+log = logging.getLogger(__name__)
+
+# Maximum number of points kept in memory (the plot only draws about one min/max pair per pixel)
+MAX_POINTS = 2000000
+# Interval between plot refreshes (ms), independent of the acquisition interval
+PLOT_INTERVAL = 33
+# Interval between status bar updates (ms)
+STATUS_INTERVAL = 1000
+# Aggregation windows (samples per mean/min/max record sent by the Arduino) offered in the GUI
+AGGREGATE_WINDOWS = [1, 4, 8, 16, 32, 64, 128, 256]
+
+# Curve colour of each trace (A0, A1, ... of the first device, then of the next one, ...)
+CHANNEL_COLORS = ['r', 'g', 'b', 'c', 'm', 'y', 'w', (255, 128, 0), (128, 0, 255), (0, 160, 128)]
 
 # -----------------------------------------------------------------------------------------------------
 # --------------------------------------------- UI ----------------------------------------------------
 # -----------------------------------------------------------------------------------------------------
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, ports=(DEFAULT_PORT,), baudrate=BAUDRATE, replay=None, metrics=None, publish=None):
         super().__init__()
         self.title = 'Data Acquisition - Raspberry Pi'
+        # The acquisition reads every port (one Arduino each) in its own thread, aligns the clocks of the
+        # Arduinos to the computer's and keeps the last MAX_POINTS samples of each one on that timeline.
+        # When replaying a recorded session, the session takes the place of the serial port.
+        self.replay = replay
+        self.acquisition = MultiAcquisition(ports, baudrate, MAX_POINTS, sers=[replay] if replay is not None else None)
+        # Total number of samples already drawn, so the curve is only redrawn when new data arrives
+        self.plotted = 0
+        # Session being recorded to disk (None when not recording)
+        self.recorder = None
+        # Trigger on the analysis trace (None for continuous display), the device it runs on and its last capture
+        self.trigger = None
+        self.trigger_device = 0
+        self.last_capture = None
+        # File the pipeline metrics are appended to every EXPORT_INTERVAL seconds (None to disable)
+        self.metrics = metrics
+        # Name the samples are published under for other local processes (see sharedring.py), or None
+        self.publish = publish
+        self.last_export = time.monotonic()
+        self.curves = []
         self.initUI()
         self.initSerial()
-        # Creates timer (for data reading)
+        # Creates timer (for plotting the data received by the reader thread)
         self.timer = QTimer(self)
         # Sets a function to be called every time the timer times out
         self.timer.timeout.connect(self.read_from_arduino)
+        # Status bar readout of the pipeline (samples/s, redraw FPS, serial backlog), refreshed every second
+        self.statusTimer = QTimer(self)
+        self.statusTimer.timeout.connect(self.updateStatus)
+        self.statusTimer.start(STATUS_INTERVAL)
 
     def initUI(self):
         self.setWindowTitle(self.title)
@@ -44,6 +90,29 @@ class MainWindow(QMainWindow):
         # Create graph widget
         self.graphWidget = pg.PlotWidget()
         self.globalLayout.addWidget(self.graphWidget)
+        # One curve per trace (channel of a device), updated in place with setData (instead of clearing and replotting)
+        self.curves = []
+        # Panning/zooming redraws the curve at the resolution of the new view (coalesced in a single-shot timer)
+        self.viewTimer = QTimer(self)
+        self.viewTimer.setSingleShot(True)
+        self.viewTimer.timeout.connect(self.redrawView)
+        self.graphWidget.getViewBox().sigXRangeChanged.connect(lambda: self.viewTimer.start(0))
+
+        # Rolling statistics of the latest samples
+        self.statsLabel = QLabel('')
+        self.globalLayout.addWidget(self.statsLabel)
+
+        # Dropped/late samples and jitter since the last clear
+        self.timingLabel = QLabel('')
+        self.globalLayout.addWidget(self.timingLabel)
+
+        # Spectrum of the latest samples (hidden until enabled)
+        self.spectrumWidget = pg.PlotWidget()
+        self.spectrumWidget.setLabel('bottom', 'Frequency', units='Hz')
+        self.spectrumWidget.setLogMode(y=True)
+        self.spectrumCurve = self.spectrumWidget.plot(pen='y')
+        self.spectrumWidget.hide()
+        self.globalLayout.addWidget(self.spectrumWidget)
 
         # Options layout (input and buttons, everything bellow the graph)
         self.optionsLayout = QHBoxLayout()
@@ -68,6 +137,84 @@ class MainWindow(QMainWindow):
 
         # Add the interval layout to the input layout, and the input layout to the options layout
         self.inputLayout.addLayout(self.intervalLayout)
+
+        # Checkbox to switch the Arduino to the compact binary protocol
+        self.binaryCheckbox = QCheckBox('Binary streaming mode')
+        self.binaryCheckbox.stateChanged.connect(self.sendMode)
+        self.inputLayout.addWidget(self.binaryCheckbox)
+
+        # Checkbox to make the Arduino sample from its hardware timer instead of delay()
+        self.timerCheckbox = QCheckBox('Hardware-timed sampling')
+        self.timerCheckbox.stateChanged.connect(self.sendTiming)
+        self.inputLayout.addWidget(self.timerCheckbox)
+
+        # Number of analog inputs sampled together (A0 to A<n-1>), only changed while stopped
+        self.channelsLayout = QHBoxLayout()
+        self.channelsLayout.addWidget(QLabel('Channels:'))
+        self.channelsCombo = QComboBox()
+        self.channelsCombo.addItems([str(n) for n in range(1, MAX_CHANNELS + 1)])
+        self.channelsLayout.addWidget(self.channelsCombo)
+        self.channelsButton = QPushButton('Set channels', self)
+        self.channelsButton.clicked.connect(self.sendChannels)
+        self.channelsLayout.addWidget(self.channelsButton)
+        self.inputLayout.addLayout(self.channelsLayout)
+
+        # On-device aggregation: the Arduino samples that many times faster and sends the mean/min/max of every
+        # window of samples, once per interval, instead of each sample (only changed while stopped); the graph
+        # then shows the min/max envelope of each window
+        self.aggregateLayout = QHBoxLayout()
+        self.aggregateLayout.addWidget(QLabel('Samples per record:'))
+        self.aggregateCombo = QComboBox()
+        self.aggregateCombo.addItems([str(n) if n > 1 else "1 (raw)" for n in AGGREGATE_WINDOWS])
+        self.aggregateLayout.addWidget(self.aggregateCombo)
+        self.aggregateButton = QPushButton('Set aggregation', self)
+        self.aggregateButton.clicked.connect(self.sendAggregate)
+        self.aggregateLayout.addWidget(self.aggregateButton)
+        self.inputLayout.addLayout(self.aggregateLayout)
+
+        # Checkboxes to show/hide each trace's curve (rebuilt when the number of channels changes)
+        self.visibleLayout = QHBoxLayout()
+        self.inputLayout.addLayout(self.visibleLayout)
+        self.visibleCheckboxes = []
+
+        # Trace used for the statistics and the spectrum
+        self.analysisLayout = QHBoxLayout()
+        self.analysisLayout.addWidget(QLabel('Analysis channel:'))
+        self.analysisCombo = QComboBox()
+        self.analysisCombo.currentIndexChanged.connect(self.selectAnalysisChannel)
+        self.analysisLayout.addWidget(self.analysisCombo)
+        self.inputLayout.addLayout(self.analysisLayout)
+
+        # Trigger on the analysis trace: level, edge, samples before/after the trigger and hold-off (ms).
+        # While it is on, only the captured windows are drawn (and recorded).
+        self.triggerLayout = QHBoxLayout()
+        self.triggerCheckbox = QCheckBox('Trigger')
+        self.triggerCheckbox.stateChanged.connect(self.setTrigger)
+        self.triggerLayout.addWidget(self.triggerCheckbox)
+        self.triggerLevel = QLineEdit("512")
+        self.triggerLayout.addWidget(QLabel('Level:'))
+        self.triggerLayout.addWidget(self.triggerLevel)
+        self.triggerEdge = QComboBox()
+        self.triggerEdge.addItems([edge.capitalize() for edge in EDGES])
+        self.triggerLayout.addWidget(self.triggerEdge)
+        self.triggerPre = QLineEdit("200")
+        self.triggerLayout.addWidget(QLabel('Pre:'))
+        self.triggerLayout.addWidget(self.triggerPre)
+        self.triggerPost = QLineEdit("800")
+        self.triggerLayout.addWidget(QLabel('Post:'))
+        self.triggerLayout.addWidget(self.triggerPost)
+        self.triggerHoldoff = QLineEdit("0")
+        self.triggerLayout.addWidget(QLabel('Hold-off (ms):'))
+        self.triggerLayout.addWidget(self.triggerHoldoff)
+        # Single shot: after a capture the trigger waits for the Arm button
+        self.singleCheckbox = QCheckBox('Single')
+        self.triggerLayout.addWidget(self.singleCheckbox)
+        self.armButton = QPushButton('Arm', self)
+        self.armButton.clicked.connect(self.armTrigger)
+        self.triggerLayout.addWidget(self.armButton)
+        self.triggerLabel = QLabel('')
+        self.triggerLayout.addWidget(self.triggerLabel)
+        self.inputLayout.addLayout(self.triggerLayout)
         self.optionsLayout.addLayout(self.inputLayout)
 
         # Buttons layout
@@ -83,6 +230,22 @@ class MainWindow(QMainWindow):
         self.clearButton.clicked.connect(self.clearGraph)
         self.buttonLayout.addWidget(self.clearButton)
 
+        # Checkbox to show/hide the spectrum
+        self.spectrumCheckbox = QCheckBox('Show spectrum', self)
+        self.spectrumCheckbox.stateChanged.connect(self.toggleSpectrum)
+        self.buttonLayout.addWidget(self.spectrumCheckbox)
+
+        # Checkbox to switch the debug log (every command sent, ...) on and off
+        self.debugCheckbox = QCheckBox('Debug log', self)
+        self.debugCheckbox.setChecked(logging.getLogger().isEnabledFor(logging.DEBUG))
+        self.debugCheckbox.stateChanged.connect(self.toggleDebugLog)
+        self.buttonLayout.addWidget(self.debugCheckbox)
+
+        # Start/Stop recording button (streams every sample to a session folder)
+        self.recordButton = QPushButton('Start Recording', self)
+        self.recordButton.clicked.connect(self.toggleRecording)
+        self.buttonLayout.addWidget(self.recordButton)
+
         # Add the button layout to the options layout and the options layout to the global layout
         self.optionsLayout.addLayout(self.buttonLayout)
         self.globalLayout.addLayout(self.optionsLayout)
@@ -94,119 +257,386 @@ class MainWindow(QMainWindow):
     # -------------------------------------- Functions ----------------------------------------------------
     # -----------------------------------------------------------------------------------------------------
 
-    # Starts the serial communication with the Arduino. If the port is not found, a message box is shown and the program exits.
+    # Starts the serial communication with the Arduinos. If a port is not found, a message box is shown and the program exits.
     def initSerial(self):
         try:
-            # ADJUST TO THE CORRECT PORT! IF YOU ARE USING WINDOWS, IT WILL BE 'COMX', WHERE X IS THE PORT NUMBER
-            # IF YOU ARE USING LINUX, IT WILL BE '/dev/ttyUSBX', WHERE X IS THE PORT NUMBER!!!
-            self.ser = serial.Serial('COM7', 38400, timeout=1)  
-            # Wait for the Arduino to reset
-            time.sleep(2) 
-        except serial.SerialException:
-            QMessageBox.critical(self, 'Connection Error', 'Failed to open serial port.')
+            # Opens the ports, waits for the Arduinos to reset and starts the reader threads
+            self.acquisition.open()
+        except serial.SerialException as e:
+            QMessageBox.critical(self, 'Connection Error', f'Failed to open serial port: {e}')
             sys.exit()
+        # A recorded session is replayed with the channels it was recorded with
+        if self.replay is not None and self.replay.channels != self.acquisition.channels:
+            self.acquisition.setChannels(self.replay.channels)
+        if self.replay is not None and self.replay.window != self.acquisition.window:
+            self.acquisition.setAggregate(self.replay.window)
+        if self.publish:
+            self.acquisition.publish(self.publish)
+        self.initChannels()
+
+    # Creates the curves, envelopes and analysis of every trace (channel of a device).
+    # The channels of a device share its buffer's timestamp column; each one gets its own min/max pyramid.
+    def initChannels(self):
+        # The trigger was set on a trace that may no longer exist
+        self.triggerCheckbox.setChecked(False)
+        channels = self.acquisition.channels
+        # (device, channel) of each trace, and its name (the device number is left out with a single device)
+        self.traces = [(d, c) for d in range(len(self.acquisition)) for c in range(channels)]
+        names = [f"A{c}" if len(self.acquisition) == 1 else f"D{d}:A{c}" for d, c in self.traces]
+        # Aggregate records are drawn from their min/max columns
+        window = self.acquisition.window
+        self.pyramids = [MinMaxPyramid(self.acquisition.buffers[d], channel=c,
+                                       bounds=(aggregateColumn(channels, "min", c), aggregateColumn(channels, "max", c))
+                                       if window > 1 else None)
+                         for d, c in self.traces]
+        self.plotted = 0
+
+        for curve in self.curves:
+            self.graphWidget.removeItem(curve)
+        self.curves = [self.graphWidget.plot(pen=CHANNEL_COLORS[i % len(CHANNEL_COLORS)], name=name)
+                       for i, name in enumerate(names)]
+
+        for checkbox in self.visibleCheckboxes:
+            self.visibleLayout.removeWidget(checkbox)
+            checkbox.deleteLater()
+        self.visibleCheckboxes = []
+        for name in names:
+            checkbox = QCheckBox(name)
+            checkbox.setChecked(True)
+            checkbox.stateChanged.connect(self.redrawView)
+            self.visibleLayout.addWidget(checkbox)
+            self.visibleCheckboxes.append(checkbox)
+
+        self.channelsCombo.setCurrentIndex(channels - 1)
+        if window in AGGREGATE_WINDOWS:
+            self.aggregateCombo.setCurrentIndex(AGGREGATE_WINDOWS.index(window))
+        # Rebuilding the combo box selects the first trace, which (re)creates the statistics and spectrum
+        self.analysisCombo.blockSignals(True)
+        self.analysisCombo.clear()
+        self.analysisCombo.addItems(names)
+        self.analysisCombo.blockSignals(False)
+        self.selectAnalysisChannel()
+
+    # Streaming analysis of the selected trace: rolling statistics and Welch spectrum
+    def selectAnalysisChannel(self):
+        device, channel = self.traces[max(self.analysisCombo.currentIndex(), 0)]
+        self.stats = RollingStats(self.acquisition.buffers[device], channel=channel)
+        self.spectrum = Spectrum(self.acquisition.buffers[device], channel=channel)
+        self.statsLabel.setText('')
+        self.spectrumCurve.setData([], [])
+        self.updateAnalysis()
+
+    # Function to change the number of channels sampled by the Arduino (clears the data acquired so far)
+    def sendChannels(self):
+        if self.timer.isActive():
+            QMessageBox.warning(self, 'Error', 'Stop the acquisition before changing the number of channels.')
+            return
+        if self.recorder is not None:
+            QMessageBox.warning(self, 'Error', 'Stop the recording before changing the number of channels.')
+            return
+        channels = self.channelsCombo.currentIndex() + 1
+        if self.replay is not None and channels != self.replay.channels:
+            QMessageBox.warning(self, 'Error', f'The recorded session has {self.replay.channels} channels.')
+            self.channelsCombo.setCurrentIndex(self.acquisition.channels - 1)
+            return
+        self.acquisition.setChannels(channels)
+        self.initChannels()
+
+    # Function to change the number of samples per aggregate record (clears the data acquired so far)
+    def sendAggregate(self):
+        if self.timer.isActive():
+            QMessageBox.warning(self, 'Error', 'Stop the acquisition before changing the aggregation.')
+            return
+        if self.recorder is not None:
+            QMessageBox.warning(self, 'Error', 'Stop the recording before changing the aggregation.')
+            return
+        window = AGGREGATE_WINDOWS[self.aggregateCombo.currentIndex()]
+        if self.replay is not None and window != self.replay.window:
+            QMessageBox.warning(self, 'Error', f'The recorded session has {self.replay.window} samples per record.')
+            self.aggregateCombo.setCurrentIndex(AGGREGATE_WINDOWS.index(self.acquisition.window))
+            return
+        self.acquisition.setAggregate(window)
+        self.initChannels()
 
     # Function to start/stop the acquisition
     def toggleAcquisition(self):
         # Checks if the timer is active (if it is, the acquisition is running)
         if self.timer.isActive():
-            # If it is, stop the timer and change the button text
+            # If it is, stop the timer (plotting whatever is still queued) and change the button text
             self.timer.stop()
+            self.read_from_arduino()
             self.toggleButton.setText('Start Acquisition')
 
-            # Send the stop command to the Arduino, making it stop sending data
-            try:
-                command = f"STOP\n"
-                self.ser.write(command.encode('utf-8'))
-                print(f"Sent: {command.strip()}")  # Debugging output
-            except ValueError:
-                QMessageBox.warning(self, 'Error', 'Please try a valid command.')
+            # Send the stop command to the Arduinos, making them stop sending data
+            self.acquisition.stop()
+            if self.replay is not None:
+                log.info("Replay rate: %.0f samples/s", self.replay.rate())
 
         # If the timer is not active, start the acquisition
         else:
-            try:
-                # Checks the interval value written by the user and starts the timer with that interval
-                interval = int(self.inputInterval.text())
-                self.timer.start(interval)
-
-                #Changes the button text
-                self.toggleButton.setText('Stop Acquisition')
-                
-                # Send the start command to the Arduino, making it start sending data
-                command = f"GET\n"
-                self.ser.write(command.encode('utf-8')) 
-                print(f"Sent: {command.strip()}")  # Debugging output
+            # Starts the plot timer (the data itself is read by the reader thread)
+            self.timer.start(PLOT_INTERVAL)
 
-            except ValueError:
-                QMessageBox.warning(self, 'Error', 'Please enter a valid number.')
+            #Changes the button text
+            self.toggleButton.setText('Stop Acquisition')
+
+            # Send the start command to the Arduinos, making them start sending data
+            self.acquisition.start()
 
     # Function to send the interval to the Arduino
     def sendInterval(self):
         try:
             # Checks the interval value written by the user and sends it to the Arduino, along with SET_INTERVAL for identification
-            interval = int(self.inputInterval.text().strip())
-            self.timer.setInterval(interval)
-            command = f"SET_INTERVAL {interval}\n"
-            self.ser.write(command.encode('utf-8')) 
-            print(f"Sent: {command.strip()}") # Debugging output
+            self.acquisition.setInterval(self.inputInterval.text().strip())
 
         except ValueError:
             QMessageBox.warning(self, 'Error', 'Please enter a valid number.')
 
-    # Function to read data from the Arduino and plot it on the graph
-    def read_from_arduino(self):
-        # Initialize lists if not already present
-        if not hasattr(self, "timestamps"):
-            self.timestamps = []
-            self.values = []
-
-        while self.ser.in_waiting > 0:
+    # Function to start/stop recording every acquired sample to disk
+    def toggleRecording(self):
+        if self.recorder is None:
+            devices = [(port, engine.columns) for port, engine in zip(self.acquisition.ports, self.acquisition.engines)]
             try:
-                # Read and decode data from Arduino
-                line = self.ser.readline().decode('utf-8').strip()
-
-                if line == "ERROR":
-                    print("Invalid command received by Arduino!")
-                else:
-                    value, timestamp = map(int, line.split(','))
-                    print(f"Value: {value}, Time: {timestamp}ms")  # Debugging
-
-                    # Append new data
-                    self.timestamps.append(timestamp)
-                    self.values.append(value)
-
-                    # Keep only the last MAX_POINTS to avoid crashes
-                    if len(self.timestamps) > MAX_POINTS:
-                        self.timestamps.pop(0)
-                        self.values.pop(0)
-
-                    # Clear the graph and replot only the latest data
-                    self.graphWidget.clear()
-                    self.graphWidget.plot(self.timestamps, self.values, pen='r', symbol='o')
-
-            except Exception as e:
-                print("Error reading data:", e)
-
+                self.recorder = MultiSessionWriter(devices)
+            except OSError as e:
+                QMessageBox.warning(self, 'Error', f'Failed to create the session files: {e}')
+                return
+            # Aggregate records are stored as they are, with the meaning of each column
+            if self.acquisition.window > 1:
+                for writer in self.recorder.writers:
+                    writer.meta["aggregate"] = aggregateMeta(self.acquisition.channels, self.acquisition.window)
+            self.recorder.start()
+            # The recorder is fed directly by the reader threads, so the GUI thread does no extra work.
+            # With the trigger on, only the captured windows are recorded.
+            if self.trigger is not None:
+                self.trigger.addCallback(self.recordCapture)
+            else:
+                self.acquisition.addCallback(self.recorder.write)
+            self.recordButton.setText('Stop Recording')
+            log.info("Recording to %s", self.recorder.path)
+        else:
+            self.acquisition.removeCallback(self.recorder.write)
+            # The timing (and clock alignment) of each device is kept with its session
+            for writer, timing, (offset, skew) in zip(self.recorder.writers, self.acquisition.timingStats(),
+                                                      self.acquisition.clocks()):
+                writer.meta["timing"] = timing
+                writer.meta["clock"] = {"offset_ms": offset, "skew_ppm": skew}
+            if self.trigger is not None:
+                self.trigger.removeCallback(self.recordCapture)
+                self.recorder.writers[self.trigger_device].meta["trigger"] = self.trigger.settings()
+            self.recorder.stop()
+            log.info("Saved %d samples to %s", self.recorder.samples, self.recorder.path)
+            self.recorder = None
+            self.recordButton.setText('Start Recording')
+
+    # Called by the reader thread with every window captured by the trigger while recording
+    def recordCapture(self, timestamps, values, position):
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.write(self.trigger_device, timestamps, values)
+
+    # Function to switch the trigger on (with the settings entered) or off, on the analysis trace
+    def setTrigger(self):
+        enabled = self.triggerCheckbox.isChecked()
+        if self.recorder is not None and enabled != (self.trigger is not None):
+            QMessageBox.warning(self, 'Error', 'Stop the recording before switching the trigger.')
+            self.triggerCheckbox.blockSignals(True)
+            self.triggerCheckbox.setChecked(not enabled)
+            self.triggerCheckbox.blockSignals(False)
+            return
+        if self.trigger is not None:
+            self.acquisition.setTrigger(self.trigger_device, None)
+            self.trigger = None
+        self.last_capture = None
+        self.triggerLabel.setText('')
+        if enabled:
+            try:
+                device, channel = self.traces[max(self.analysisCombo.currentIndex(), 0)]
+                trigger = Trigger(float(self.triggerLevel.text()), EDGES[self.triggerEdge.currentIndex()],
+                                  int(self.triggerPre.text()), int(self.triggerPost.text()), channel,
+                                  holdoff=float(self.triggerHoldoff.text()), rearm=not self.singleCheckbox.isChecked())
+            except ValueError:
+                QMessageBox.warning(self, 'Error', 'Please enter valid trigger settings.')
+                self.triggerCheckbox.setChecked(False)
+                return
+            self.trigger, self.trigger_device = trigger, device
+            self.acquisition.setTrigger(device, trigger)
+            for curve in self.curves:
+                curve.setData([], [])
+            self.graphWidget.setLabel('bottom', 'Time from trigger', units='ms')
+        else:
+            self.graphWidget.setLabel('bottom', '')
+            self.plotted = 0
+            self.redrawView()
+
+    # Function to arm the trigger again (after a single-shot capture)
+    def armTrigger(self):
+        if self.trigger is not None:
+            self.trigger.arm()
+
+    # Function to switch the Arduino (and the reader thread) between ASCII and binary streaming
+    def sendMode(self):
+        mode = BINARY_MODE if self.binaryCheckbox.isChecked() else ASCII_MODE
+        self.acquisition.setMode(mode)
+
+    # Function to switch the Arduino between delay-paced and hardware-timer sampling
+    def sendTiming(self):
+        timing = TIMER_TIMING if self.timerCheckbox.isChecked() else DELAY_TIMING
+        self.acquisition.setTiming(timing)
+
+    # Function to take the data read from the Arduino (by the reader thread) and plot it on the graph
+    def read_from_arduino(self):
+        # The acquisition appends new data to the buffers (the oldest samples are overwritten once MAX_POINTS is reached)
+        for device, timestamps, values in self.acquisition.poll():
+            for (d, channel), pyramid in zip(self.traces, self.pyramids):
+                if d == device and pyramid.bounds is not None:
+                    pyramid.extend(timestamps, values[:, pyramid.bounds[0]], values[:, pyramid.bounds[1]])
+                elif d == device:
+                    pyramid.extend(timestamps, values[:, channel])
+
+        self.updatePlot()
+
+    # Function to redraw the curve, at most once per timer tick and only if new samples arrived
+    def updatePlot(self):
+        # With the trigger on, the graph is only redrawn when a new window was captured
+        if self.trigger is not None:
+            captures = self.trigger.poll()
+            if captures:
+                self.last_capture = captures[-1]
+                self.redrawView()
+            self.triggerLabel.setText(f"{self.trigger.count} captures" +
+                                      ("" if self.trigger.armed else " (press Arm)"))
+        total = sum(buffer.total for buffer in self.acquisition.buffers)
+        if total == self.plotted:
+            return
+        self.plotted = total
+        if self.trigger is None:
+            self.redrawView()
+        self.updateAnalysis()
+
+    # Function to update the rolling statistics and, if shown, the spectrum
+    def updateAnalysis(self):
+        self.stats.update()
+        stats = self.stats.stats()
+        if stats is not None:
+            self.statsLabel.setText(
+                f"Last {stats['samples']} samples - mean: {stats['mean']:.1f}  RMS: {stats['rms']:.1f}  "
+                f"std: {stats['std']:.1f}  min: {stats['min']:.0f}  max: {stats['max']:.0f}")
+
+        # Totals over every device (and the worst jitter)
+        timings = self.acquisition.timingStats()
+        period = timings[0]['period_ms']
+        period = f"{period:.2f} ms" if period is not None else "-"
+        received = sum(timing['samples'] for timing in timings)
+        dropped = sum(timing['dropped'] for timing in timings)
+        loss = dropped / (received + dropped) if received else 0.0
+        text = (f"Period: {period}  dropped: {dropped} ({100 * loss:.1f}%) in "
+                f"{sum(timing['gaps'] for timing in timings)} gaps  late: {sum(timing['late'] for timing in timings)}  "
+                f"jitter: {max(timing['jitter_ms'] for timing in timings):.2f} ms RMS, "
+                f"{max(timing['max_jitter_ms'] for timing in timings):.0f} ms max")
+        if len(self.acquisition) > 1:
+            text += "  clock skew: " + ", ".join(f"D{d} {skew:+.0f} ppm"
+                                                 for d, (_, skew) in enumerate(self.acquisition.clocks()))
+        self.timingLabel.setText(text)
+
+        if self.spectrumWidget.isVisible():
+            result = self.spectrum.compute()
+            if result is not None:
+                frequencies, density = result
+                # The DC bin is left out (the mean is removed from every segment)
+                self.spectrumCurve.setData(frequencies[1:], density[1:])
+
+    # Function to show/hide the spectrum panel
+    def toggleSpectrum(self):
+        self.spectrumWidget.setVisible(self.spectrumCheckbox.isChecked())
+        self.updateAnalysis()
+
+    # Function to draw the visible time window with about one min/max bucket per horizontal pixel
+    def redrawView(self):
+        if self.trigger is not None:
+            self.drawCapture()
+            return
+        buffers = [buffer for buffer in self.acquisition.buffers if len(buffer)]
+        if not buffers:
+            return
+        start_time = time.perf_counter()
+        viewBox = self.graphWidget.getViewBox()
+        # While auto-ranging the whole history of every device is visible, otherwise only the window the user zoomed in
+        if viewBox.autoRangeEnabled()[0]:
+            start = min(buffer.data()[0][0] for buffer in buffers)
+            end = max(buffer.data()[0][-1] for buffer in buffers)
+        else:
+            start, end = viewBox.viewRange()[0]
+        # Only the visible traces are decimated and drawn
+        for pyramid, curve, checkbox in zip(self.pyramids, self.curves, self.visibleCheckboxes):
+            if checkbox.isChecked():
+                x, y = pyramid.envelope(start, end, viewBox.width())
+                curve.setData(x, y)
+            else:
+                curve.setData([], [])
+        self.acquisition.instruments.record("redraw", time.perf_counter() - start_time)
+
+    # Function to draw the last captured window (every channel of the triggering device), centred on the trigger
+    def drawCapture(self):
+        if self.last_capture is None:
+            return
+        start_time = time.perf_counter()
+        timestamps, values, position = self.last_capture
+        x = timestamps - timestamps[position]
+        for (device, channel), curve, checkbox in zip(self.traces, self.curves, self.visibleCheckboxes):
+            if device == self.trigger_device and checkbox.isChecked():
+                curve.setData(x, values[:, channel])
+            else:
+                curve.setData([], [])
+        self.acquisition.instruments.record("redraw", time.perf_counter() - start_time)
+
+    # Function to show the pipeline readout in the status bar (and append the metrics to their file)
+    def updateStatus(self):
+        if self.metrics and time.monotonic() - self.last_export >= EXPORT_INTERVAL:
+            snapshot = self.acquisition.export(self.metrics)
+            self.last_export = time.monotonic()
+        else:
+            snapshot = self.acquisition.snapshot()
+        # Read/parse stages are per device, redraw is done once for all of them
+        devices = snapshot["devices"]
+        backlog = max(device["gauges"].get("backlog", {}).get("max", 0) for device in devices)
+        rate = sum(device["stages"].get("parse", {}).get("items_per_s", 0.0) for device in devices)
+        stages = snapshot["pipeline"]["stages"]
+        fps = stages.get("redraw", {}).get("calls_per_s", 0.0)
+        redraw = stages.get("redraw", {}).get("p99_us")
+        redraw = f"{redraw / 1000:.1f} ms" if redraw is not None else "-"
+        self.statusBar().showMessage(
+            f"{rate:,.0f} samples/s  |  {fps:.1f} FPS (p99 redraw {redraw})  |  backlog {backlog} bytes")
+
+    # Function to switch the debug log on and off
+    def toggleDebugLog(self):
+        logging.getLogger().setLevel(logging.DEBUG if self.debugCheckbox.isChecked() else logging.INFO)
 
     # Function to clear the graph
     def clearGraph(self):
-        # clears the graph and the data lists
-        self.graphWidget.clear()
-        self.timestamps = []
-        self.values = []
-        try:
-            # Clears incoming data buffer
-            self.ser.reset_input_buffer()  
-            command = f"CLEAR\n"
-            self.ser.write(command.encode('utf-8'))
-            print(f"Sent: {command.strip()}")
-        except ValueError:
-            QMessageBox.warning(self, 'Error', 'Please try a valid command.')
+        # clears the graph, the data buffer and the incoming data (batches not yet plotted included)
+        self.acquisition.clear()
+        for pyramid in self.pyramids:
+            pyramid.clear()
+        self.stats.clear()
+        self.plotted = 0
+        self.last_capture = None
+        for curve in self.curves:
+            curve.setData([], [])
+        self.spectrumCurve.setData([], [])
+        self.statsLabel.setText('')
+        self.timingLabel.setText('')
 
     # Function to close the serial port when the window is closed
     def closeEvent(self, event):
-        if hasattr(self, 'ser') and self.ser.is_open:
-            self.ser.close()
+        if self.recorder is not None:
+            self.acquisition.removeCallback(self.recorder.write)
+            if self.trigger is not None:
+                self.trigger.removeCallback(self.recordCapture)
+            self.recorder.stop()
+        if self.metrics:
+            self.acquisition.export(self.metrics)
+        self.acquisition.close()
         event.accept()
 
 # -----------------------------------------------------------------------------------------------------
@@ -214,7 +644,21 @@ class MainWindow(QMainWindow):
 # -----------------------------------------------------------------------------------------------------
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    window = MainWindow()
+    parser = argparse.ArgumentParser(description="Data acquisition GUI for data.ino")
+    parser.add_argument("--port", nargs="+", default=[DEFAULT_PORT],
+                        help="serial port of the Arduino (several ports are acquired together)")
+    parser.add_argument("--baudrate", type=int, default=BAUDRATE)
+    parser.add_argument("--replay", help="replay a recorded session folder instead of reading the Arduino")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed (0 for as fast as possible)")
+    parser.add_argument("--metrics", help=f"append pipeline metrics to this file every {EXPORT_INTERVAL:g} s")
+    parser.add_argument("--publish", nargs="?", const=SHARED_NAME,
+                        help=f"publish the samples in shared memory for other processes (default name: {SHARED_NAME})")
+    parser.add_argument("--log-level", default="INFO", help="DEBUG, INFO, WARNING or ERROR")
+    args, qt_args = parser.parse_known_args()
+    setupLogging(args.log_level.upper())
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    replay = ReplayPort(args.replay, args.speed) if args.replay else None
+    window = MainWindow(args.port, args.baudrate, replay, args.metrics, args.publish)
     sys.exit(app.exec_())
 
@@ -0,0 +1,171 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import json
+import time
+import bisect
+import logging
+import threading
+
+# Latency histogram buckets: log-spaced from 1 us to 10 s, BUCKETS_PER_DECADE per decade
+BUCKETS_PER_DECADE = 8
+MIN_LATENCY = 1e-6
+DECADES = 7
+# Minimum time (s) between two log messages with the same text (the others are counted and skipped)
+LOG_INTERVAL = 1.0
+# Interval (s) between two snapshots appended to the metrics file
+EXPORT_INTERVAL = 5.0
+
+# -----------------------------------------------------------------------------------------------------
+# ----------------------------------------------- Stages ----------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+BUCKET_EDGES = [MIN_LATENCY * 10 ** (i / BUCKETS_PER_DECADE) for i in range(DECADES * BUCKETS_PER_DECADE + 1)]
+
+# Counters and latency histogram of one stage of the pipeline (e.g. serial read, parse, redraw).
+# record() costs a bisect and a few additions, so it can be called for every batch. Every stage is
+# only written by one thread, and read (approximately) by whoever takes a snapshot, so no lock is used.
+class StageStats:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_EDGES) + 1)
+        self.calls = 0
+        self.items = 0
+        self.bytes = 0
+        self.time = 0.0
+        self.max = 0.0
+
+    # Records one run of the stage that took `seconds` and handled `items` samples/frames and `nbytes` bytes
+    def record(self, seconds, items=0, nbytes=0):
+        self.buckets[bisect.bisect_left(BUCKET_EDGES, seconds)] += 1
+        self.calls += 1
+        self.items += items
+        self.bytes += nbytes
+        self.time += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    # Upper edge (s) of the bucket holding the q-th quantile of the recorded latencies
+    def quantile(self, q):
+        if not self.calls:
+            return None
+        target = q * self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target and count:
+                return min(BUCKET_EDGES[i], self.max) if i < len(BUCKET_EDGES) else self.max
+        return self.max
+
+# -----------------------------------------------------------------------------------------------------
+# ------------------------------------------- Instrumentation -----------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Named stages and gauges of the acquisition/display pipeline.
+#   record(stage, seconds, items, nbytes): one run of a stage (counters + latency histogram)
+#   gauge(name, value): a level such as the serial backlog (last value and maximum since the last snapshot)
+#   snapshot(): totals, rates and latency percentiles since the previous snapshot, as a dict
+#   export(path): appends a snapshot to a JSON-lines file
+# When disabled, record() and gauge() return immediately.
+class Instrumentation:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+        self.start = self.last_time = time.perf_counter()
+        self.last_counts = {}
+
+    def stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            with self.lock:
+                stage = self.stages.setdefault(name, StageStats())
+        return stage
+
+    def record(self, name, seconds, items=0, nbytes=0):
+        if self.enabled:
+            self.stage(name).record(seconds, items, nbytes)
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+        last, peak = self.gauges.get(name, (value, value))
+        self.gauges[name] = (value, max(peak, value))
+
+    def clear(self):
+        with self.lock:
+            self.stages = {}
+            self.gauges = {}
+            self.last_counts = {}
+            self.start = self.last_time = time.perf_counter()
+
+    def snapshot(self):
+        now = time.perf_counter()
+        elapsed = max(now - self.last_time, 1e-9)
+        result = {"time": time.time(), "uptime": now - self.start, "stages": {}, "gauges": {}}
+        for name, stage in list(self.stages.items()):
+            calls, items, nbytes = stage.calls, stage.items, stage.bytes
+            last_calls, last_items, last_bytes = self.last_counts.get(name, (0, 0, 0))
+            self.last_counts[name] = (calls, items, nbytes)
+            p50, p99 = stage.quantile(0.5), stage.quantile(0.99)
+            result["stages"][name] = {
+                "calls": calls,
+                "items": items,
+                "bytes": nbytes,
+                "calls_per_s": (calls - last_calls) / elapsed,
+                "items_per_s": (items - last_items) / elapsed,
+                "bytes_per_s": (nbytes - last_bytes) / elapsed,
+                "mean_us": 1e6 * stage.time / calls if calls else None,
+                "p50_us": 1e6 * p50 if p50 is not None else None,
+                "p99_us": 1e6 * p99 if p99 is not None else None,
+                "max_us": 1e6 * stage.max,
+            }
+        for name, (last, peak) in list(self.gauges.items()):
+            result["gauges"][name] = {"last": last, "max": peak}
+            # The maximum restarts at every snapshot
+            self.gauges[name] = (last, last)
+        self.last_time = now
+        return result
+
+    # Appends a snapshot to `path` (one JSON object per line) and returns it
+    def export(self, path):
+        snapshot = self.snapshot()
+        with open(path, "a") as f:
+            f.write(json.dumps(snapshot) + "\n")
+        return snapshot
+
+# -----------------------------------------------------------------------------------------------------
+# ---------------------------------------------- Logging ----------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Logging filter that lets through at most one message with the same text every `interval` seconds.
+# The number of messages skipped in between is added to the next one that gets through.
+class RateLimitFilter(logging.Filter):
+    def __init__(self, interval=LOG_INTERVAL):
+        super().__init__()
+        self.interval = interval
+        self.last = {}
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        last, skipped = self.last.get(key, (None, 0))
+        if last is not None and now - last < self.interval:
+            self.last[key] = (last, skipped + 1)
+            return False
+        self.last[key] = (now, 0)
+        if skipped:
+            record.msg = f"{record.msg} ({skipped} similar messages skipped)"
+        return True
+
+# Configures the console logging of the project (level: "DEBUG", "INFO", "WARNING", ...)
+def setupLogging(level="INFO", interval=LOG_INTERVAL):
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s", "%H:%M:%S"))
+    handler.addFilter(RateLimitFilter(interval))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
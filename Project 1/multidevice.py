@@ -0,0 +1,337 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import json
+import time
+import queue
+import collections
+import numpy as np
+
+from buffers import RingBuffer
+from acquisition import AcquisitionEngine, DEFAULT_PORT, BAUDRATE, CAPACITY, aggregateMeta
+from instrumentation import Instrumentation
+from sharedring import SharedRingWriter, segmentName, SHARED_NAME, SHARED_CAPACITY
+from recording import ReplayPort
+
+# Clock alignment: the minimum host-device offset is kept for every ALIGN_BUCKET seconds of device
+# time, and a line (offset and skew) is fitted through the minima of the last ALIGN_WINDOW seconds
+ALIGN_BUCKET = 1.0
+ALIGN_WINDOW = 60.0
+
+# -----------------------------------------------------------------------------------------------------
+# ------------------------------------------ Clock alignment ------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Maps the millis() timestamps of one device to the host's time.perf_counter() clock, in ms since `epoch`.
+# Every batch gives an upper bound of the offset between the two clocks: the newest sample of the batch
+# was taken at the latest when the batch was read, so host_time - device_time = offset + transfer delay.
+# The lower envelope of these bounds (the batches that waited the least) follows the true offset; a line
+# fitted through it also follows the drift of the Arduino's oscillator relative to the host clock.
+class ClockAligner:
+    def __init__(self, epoch, bucket=ALIGN_BUCKET, window=ALIGN_WINDOW):
+        self.epoch = epoch
+        self.bucket = bucket * 1000
+        self.window = int(window / bucket)
+        self.reset()
+
+    # Forgets the fit (the device clock was restarted by CLEAR)
+    def reset(self):
+        # (device time, minimum offset) of each bucket, oldest first
+        self.points = collections.deque(maxlen=self.window)
+        self.last_device = None
+        self.last_aligned = -np.inf
+        self.reference = 0.0
+        self.offset = None
+        self.skew = 0.0
+
+    # Accounts for a batch of device timestamps (ms) read from the port at host time `host_time` (s)
+    def update(self, host_time, timestamps):
+        if not len(timestamps):
+            return
+        device = float(timestamps[-1])
+        if self.last_device is not None and device < self.last_device:
+            self.reset()
+        self.last_device = device
+        offset = (host_time - self.epoch) * 1000 - device
+
+        bucket = device // self.bucket
+        if self.points and self.points[-1][0] // self.bucket == bucket:
+            if offset < self.points[-1][1]:
+                self.points[-1] = (device, offset)
+            else:
+                return
+        else:
+            self.points.append((device, offset))
+        self.fit()
+
+    def fit(self):
+        points = np.array(self.points)
+        self.reference = points[-1, 0]
+        if len(points) < 3:
+            self.offset = float(points[:, 1].min())
+            self.skew = 0.0
+            return
+        x = points[:, 0] - self.reference
+        y = points[:, 1]
+        self.skew, self.offset = np.polyfit(x, y, 1)
+        # The fitted line must stay under every bound (it is a lower envelope)
+        self.offset -= max(float(np.max(self.offset + self.skew * x - y)), 0.0)
+
+    # Converts device timestamps (ms) to host time (ms since epoch). The result never goes back in time,
+    # even when the fit is corrected, so it can be appended to the buffers and recordings as it is.
+    def align(self, timestamps):
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if self.offset is None or not len(timestamps):
+            return timestamps
+        aligned = timestamps + self.offset + self.skew * (timestamps - self.reference)
+        aligned = np.maximum.accumulate(np.maximum(aligned, self.last_aligned))
+        self.last_aligned = aligned[-1]
+        return aligned
+
+# Aligner of a source whose timestamps are already on the right timeline (a replayed session): they are kept
+# as they were recorded, so the replay shows the original times and sample rate
+class IdentityAligner:
+    def __init__(self):
+        self.offset = 0.0
+        self.skew = 0.0
+
+    def reset(self):
+        pass
+
+    def update(self, host_time, timestamps):
+        pass
+
+    def align(self, timestamps):
+        return np.asarray(timestamps, dtype=np.float64)
+
+# -----------------------------------------------------------------------------------------------------
+# ------------------------------------------ Multiple devices -----------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Acquisition from several data.ino devices at once, one AcquisitionEngine (and reader thread) per port.
+# Every batch is aligned to the host clock in the reader thread that parsed it, so the devices share
+# a single timeline (ms since the MultiAcquisition was created) in:
+#   - buffers[d]: RingBuffer of device d (aligned timestamps, one column per channel);
+#   - poll(): list of (device, timestamps, values) batches received since the last call;
+#   - callbacks added with addCallback(callback(device, timestamps, values, seq)), e.g. a MultiSessionWriter
+#     (seq: sequence numbers of the binary frames/records, None in ASCII mode).
+# Commands (start, stop, setInterval, ...) are sent to every device.
+# With queued=False the batches only go to the callbacks, triggers and shared rings (poll() gets nothing), so
+# a consumer that never polls (e.g. one that only records or publishes) does not pile them up.
+class MultiAcquisition:
+    def __init__(self, ports=(DEFAULT_PORT,), baudrate=BAUDRATE, capacity=CAPACITY, sers=None, queued=True):
+        self.epoch = time.perf_counter()
+        self.queued = queued
+        self.ports = list(ports)
+        sers = list(sers) if sers is not None else [None] * len(self.ports)
+        # The engines only hand the batches over to the callbacks: the aligned copies are kept here
+        self.engines = [AcquisitionEngine(port, baudrate, capacity=1, ser=ser, queued=False)
+                        for port, ser in zip(self.ports, sers)]
+        self.capacity = capacity
+        # Replayed sessions keep their recorded timestamps (they are not on the host clock)
+        self.aligners = [IdentityAligner() if isinstance(ser, ReplayPort) else ClockAligner(self.epoch) for ser in sers]
+        self.buffers = [RingBuffer(capacity, dtype=np.float32, shape=(1,)) for _ in self.engines]
+        self.batches = queue.Queue()
+        self.callbacks = []
+        self.forwarders = []
+        # Trigger (see trigger.py) fed with the aligned batches of each device (None for continuous acquisition)
+        self.triggers = [None] * len(self.engines)
+        # Shared-memory rings the aligned batches of each device are published to (see publish())
+        self.publishers = []
+        # Stages of the consumer side (append in poll(), redraw in the GUI); every engine keeps its own
+        # read/parse stages
+        self.instruments = Instrumentation()
+
+    def __len__(self):
+        return len(self.engines)
+
+    @property
+    def channels(self):
+        return self.engines[0].channels
+
+    # Samples per aggregate record (1: raw samples)
+    @property
+    def window(self):
+        return self.engines[0].window
+
+    # Opens every port (raises serial.SerialException if one of them cannot be opened)
+    def open(self):
+        try:
+            for device, engine in enumerate(self.engines):
+                engine.open()
+                forwarder = self.makeForwarder(device)
+                engine.addCallback(forwarder)
+                self.forwarders.append(forwarder)
+        except Exception:
+            self.close()
+            raise
+        return self
+
+    def close(self):
+        for engine in self.engines:
+            if engine.reader is not None:
+                engine.close()
+        self.unpublish()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Callback run by the reader thread of `device` for every parsed batch
+    def makeForwarder(self, device):
+        aligner = self.aligners[device]
+
+        def forward(timestamps, values, seq):
+            aligner.update(time.perf_counter(), timestamps)
+            aligned = aligner.align(timestamps)
+            if self.queued:
+                self.batches.put((device, aligned, values))
+            for callback in list(self.callbacks):
+                callback(device, aligned, values, seq)
+            trigger = self.triggers[device]
+            if trigger is not None:
+                trigger.process(aligned, values)
+            if self.publishers:
+                self.publishers[device].write(aligned, values)
+        return forward
+
+    # -------------------------------------------- Commands -----------------------------------------------
+
+    def start(self):
+        for engine in self.engines:
+            engine.start()
+
+    def stop(self):
+        for engine in self.engines:
+            engine.stop()
+
+    def setInterval(self, interval):
+        for engine in self.engines:
+            engine.setInterval(interval)
+
+    def setMode(self, mode):
+        for engine in self.engines:
+            engine.setMode(mode)
+
+    def setTiming(self, timing):
+        for engine in self.engines:
+            engine.setTiming(timing)
+
+    # Sets the number of channels of every device (the buffers are replaced, so they start empty)
+    def setChannels(self, channels):
+        for engine in self.engines:
+            engine.setChannels(channels)
+        self.resetBuffers()
+
+    # Sets the on-device aggregation window of every device (see AcquisitionEngine.setAggregate)
+    def setAggregate(self, window):
+        for engine in self.engines:
+            engine.setAggregate(window)
+        self.resetBuffers()
+
+    def resetBuffers(self):
+        self.drain()
+        self.buffers = [RingBuffer(self.capacity, dtype=np.float32, shape=(engine.columns,))
+                        for engine in self.engines]
+        for device, publisher in enumerate(self.publishers):
+            publisher.setFormat(self.engines[device].columns, self.describe(device))
+
+    # Drops every sample and restarts the clocks of the devices (and their alignment)
+    def clear(self):
+        for engine, aligner, buffer, trigger in zip(self.engines, self.aligners, self.buffers, self.triggers):
+            engine.clear()
+            aligner.reset()
+            buffer.clear()
+            if trigger is not None:
+                trigger.reset()
+        for publisher in self.publishers:
+            publisher.clear()
+        self.drain()
+
+    # ---------------------------------------------- Data -------------------------------------------------
+
+    def addCallback(self, callback):
+        self.callbacks.append(callback)
+
+    def removeCallback(self, callback):
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+
+    # Runs `trigger` (or nothing if None) on the batches of `device`, in its reader thread
+    def setTrigger(self, device, trigger):
+        self.triggers[device] = trigger
+
+    def drain(self):
+        batches = []
+        while True:
+            try:
+                batches.append(self.batches.get_nowait())
+            except queue.Empty:
+                return batches
+
+    # Moves every batch received since the last call into the buffers and returns them (batches still in
+    # the format used before the last setChannels/setAggregate are dropped)
+    def poll(self):
+        start = time.perf_counter()
+        batches = [batch for batch in self.drain() if batch[2].shape[1] == self.buffers[batch[0]].values.shape[1]]
+        for device, timestamps, values in batches:
+            self.buffers[device].extend(timestamps, values)
+        self.instruments.record("append", time.perf_counter() - start, sum(len(batch[1]) for batch in batches))
+        return batches
+
+    # Publishes the aligned samples of every device in a shared-memory ring (named `name`_0, `name`_1, ...),
+    # from the reader threads, so other local processes can read them with sharedring.SharedRingReader
+    def publish(self, name=SHARED_NAME, capacity=SHARED_CAPACITY):
+        self.unpublish()
+        publishers = [SharedRingWriter(segmentName(name, device), capacity) for device in range(len(self))]
+        for device, publisher in enumerate(publishers):
+            publisher.setFormat(self.engines[device].columns, self.describe(device))
+        self.publishers = publishers
+
+    def unpublish(self):
+        publishers, self.publishers = self.publishers, []
+        for publisher in publishers:
+            publisher.close()
+
+    # Description of the stream of one device (shared with the readers of its ring)
+    def describe(self, device):
+        engine = self.engines[device]
+        meta = {
+            "port": str(self.ports[device]),
+            "device": device,
+            "channels": engine.channels,
+            "window": engine.window,
+            "columns": [f"A{c}" for c in range(engine.channels)],
+            # Timestamps are ms of the host timeline, which started at this Unix time
+            "epoch": time.time() - (time.perf_counter() - self.epoch),
+        }
+        if engine.window > 1:
+            meta["columns"] = aggregateMeta(engine.channels, engine.window)["columns"]
+        return meta
+
+    # Offset (ms, host minus device) and skew (ppm, positive when the device clock runs fast) of each device
+    def clocks(self):
+        return [(aligner.offset, -1e6 * aligner.skew) for aligner in self.aligners]
+
+    # Timing statistics (see TimingStats) of each device
+    def timingStats(self):
+        return [engine.timingStats() for engine in self.engines]
+
+    # Instrumentation snapshot of the consumer side and of every device, as a dict
+    def snapshot(self):
+        return {
+            "pipeline": self.instruments.snapshot(),
+            "devices": [engine.instruments.snapshot() for engine in self.engines],
+        }
+
+    # Appends a snapshot to `path` (one JSON object per line) and returns it
+    def export(self, path):
+        snapshot = self.snapshot()
+        with open(path, "a") as f:
+            f.write(json.dumps(snapshot) + "\n")
+        return snapshot
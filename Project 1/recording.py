@@ -0,0 +1,417 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import os
+import json
+import queue
+import threading
+import time
+import numpy as np
+
+from acquisition import encodeFrames, encodeLines, encodeAggregates, encodeAggregateLines, ASCII_MODE, BINARY_MODE
+
+# Folder where new sessions are created
+RECORDINGS_DIR = "recordings"
+# A sparse index entry (timestamp, sample number) is kept every INDEX_STRIDE samples
+INDEX_STRIDE = 4096
+# Maximum time (s) between flushes of the session files
+FLUSH_INTERVAL = 1.0
+# Maximum number of batches waiting to be written before new ones are dropped
+MAX_PENDING = 4096
+# Maximum number of samples encoded at once by the replay port
+REPLAY_CHUNK = 8192
+
+# Session layout: one append-only file per column (the shared timestamps, the sequence numbers and one
+# file per channel) plus the sparse index and a small JSON header
+TIMESTAMP_DTYPE = np.dtype('<f8')
+VALUE_DTYPE = np.dtype('<f4')
+SEQ_DTYPE = np.dtype('u1')
+INDEX_DTYPE = np.dtype([('timestamp', '<f8'), ('sample', '<i8')])
+TIMESTAMPS_FILE = "timestamps.bin"
+SEQ_FILE = "seq.bin"
+VALUES_FILE = "values_{}.bin"
+# Single value column of the sessions recorded before multi-channel support
+LEGACY_VALUES_FILE = "values.bin"
+INDEX_FILE = "index.bin"
+META_FILE = "session.json"
+# Sub-folder of each device in a multi-device session
+DEVICE_FOLDER = "device_{}"
+
+# -----------------------------------------------------------------------------------------------------
+# ------------------------------------------- Writer --------------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Background thread that streams every acquired sample to a session folder.
+# Batches are handed over with write() (which never blocks the caller) and appended to the column
+# files by the thread, which flushes them every FLUSH_INTERVAL seconds.
+# Timestamps are made monotonic (a CLEAR restarts millis() on the Arduino), so they can be searched.
+# The sequence numbers of binary frames are kept, so a replay shows the same gaps; batches without them
+# (ASCII mode, trigger captures) count on from the last one.
+class SessionWriter(threading.Thread):
+    def __init__(self, path=None, channels=1):
+        super().__init__(daemon=True)
+        if path is None:
+            path = os.path.join(RECORDINGS_DIR, time.strftime("session_%Y%m%d_%H%M%S"))
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+        self.pending = queue.Queue(maxsize=MAX_PENDING)
+        self.samples = 0
+        self.dropped = 0
+        self.offset = 0.0
+        self.last_timestamp = None
+        self.next_seq = 0
+        self.running = True
+
+        self.meta = {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "timestamp_dtype": TIMESTAMP_DTYPE.str,
+            "value_dtype": VALUE_DTYPE.str,
+            "seq_dtype": SEQ_DTYPE.str,
+            "channels": channels,
+            "index_stride": INDEX_STRIDE,
+            "samples": 0,
+        }
+        self.saveMeta()
+
+        self.timestampsFile = open(os.path.join(self.path, TIMESTAMPS_FILE), "ab")
+        self.seqFile = open(os.path.join(self.path, SEQ_FILE), "ab")
+        self.valuesFiles = [open(os.path.join(self.path, VALUES_FILE.format(c)), "ab") for c in range(channels)]
+        self.indexFile = open(os.path.join(self.path, INDEX_FILE), "ab")
+
+    def saveMeta(self):
+        with open(os.path.join(self.path, META_FILE), "w") as f:
+            json.dump(self.meta, f, indent=4)
+
+    # Queues a batch of samples (and their sequence numbers, if any) to be written (called from the
+    # acquisition thread)
+    def write(self, timestamps, values, seq=None):
+        try:
+            self.pending.put_nowait((timestamps, values, seq))
+        except queue.Full:
+            self.dropped += len(timestamps)
+
+    def run(self):
+        last_flush = time.monotonic()
+        while self.running or not self.pending.empty():
+            try:
+                timestamps, values, seq = self.pending.get(timeout=FLUSH_INTERVAL)
+                self.append(timestamps, values, seq)
+            except queue.Empty:
+                pass
+
+            if time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                self.flush()
+                last_flush = time.monotonic()
+
+        self.flush()
+        for f in self.files():
+            f.close()
+        self.meta["samples"] = self.samples
+        self.meta["dropped"] = self.dropped
+        self.saveMeta()
+
+    def append(self, timestamps, values, seq=None):
+        timestamps = np.asarray(timestamps, dtype=TIMESTAMP_DTYPE)
+        values = np.asarray(values, dtype=VALUE_DTYPE).reshape(len(timestamps), -1)
+        if not len(timestamps):
+            return
+        if seq is None:
+            seq = self.next_seq + np.arange(len(timestamps))
+        seq = np.asarray(seq).astype(SEQ_DTYPE)
+        self.next_seq = (int(seq[-1]) + 1) & 0xFF
+
+        # Undo the restarts of the Arduino clock so the stored timestamps keep increasing
+        if self.last_timestamp is not None and timestamps[0] + self.offset < self.last_timestamp:
+            self.offset = self.last_timestamp - timestamps[0]
+        restarts = np.flatnonzero(np.diff(timestamps) < 0)
+        if len(restarts):
+            jumps = np.zeros(len(timestamps))
+            jumps[restarts + 1] = timestamps[restarts] - timestamps[restarts + 1]
+            timestamps = timestamps + np.cumsum(jumps)
+        timestamps = timestamps + self.offset
+        self.last_timestamp = timestamps[-1]
+
+        # Index entries for every multiple of INDEX_STRIDE inside this batch
+        first = self.samples
+        marks = np.arange(-(-first // INDEX_STRIDE) * INDEX_STRIDE, first + len(timestamps), INDEX_STRIDE)
+        if len(marks):
+            index = np.empty(len(marks), dtype=INDEX_DTYPE)
+            index['sample'] = marks
+            index['timestamp'] = timestamps[marks - first]
+            index.tofile(self.indexFile)
+
+        timestamps.tofile(self.timestampsFile)
+        seq.tofile(self.seqFile)
+        for channel, f in enumerate(self.valuesFiles):
+            np.ascontiguousarray(values[:, channel]).tofile(f)
+        self.samples += len(timestamps)
+
+    def files(self):
+        return [self.timestampsFile, self.seqFile, self.indexFile] + self.valuesFiles
+
+    def flush(self):
+        for f in self.files():
+            f.flush()
+            os.fsync(f.fileno())
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+# Recording of several devices acquired together (see multidevice.py): one regular session per device,
+# in DEVICE_FOLDER sub-folders, whose timestamps are all on the same (host) timeline, plus a
+# session.json listing the devices. Each device session can be opened on its own with SessionReader.
+# With a single device the session is a regular one (no sub-folder), so it can be replayed directly.
+class MultiSessionWriter:
+    def __init__(self, devices, path=None):
+        if path is None:
+            path = os.path.join(RECORDINGS_DIR, time.strftime("session_%Y%m%d_%H%M%S"))
+        self.path = path
+        # devices: list of (port, channels)
+        if len(devices) == 1:
+            self.writers = [SessionWriter(path, devices[0][1])]
+            self.meta = self.writers[0].meta
+            return
+        self.writers = [SessionWriter(os.path.join(path, DEVICE_FOLDER.format(d)), channels)
+                        for d, (_, channels) in enumerate(devices)]
+        self.meta = {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "timeline": "host",
+            "devices": [{"port": str(port), "channels": channels, "folder": DEVICE_FOLDER.format(d)}
+                        for d, (port, channels) in enumerate(devices)],
+        }
+        with open(os.path.join(path, META_FILE), "w") as f:
+            json.dump(self.meta, f, indent=4)
+
+    @property
+    def samples(self):
+        return sum(writer.samples for writer in self.writers)
+
+    def start(self):
+        for writer in self.writers:
+            writer.start()
+
+    # Queues a batch of samples of one device (called from that device's reader thread)
+    def write(self, device, timestamps, values, seq=None):
+        self.writers[device].write(timestamps, values, seq)
+
+    def stop(self):
+        for writer in self.writers:
+            writer.stop()
+
+# -----------------------------------------------------------------------------------------------------
+# ------------------------------------------- Reader --------------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Read access to a recorded session. The columns are memory-mapped, so only the pages of the
+# requested time window (and channels) are actually read from disk; the sparse index narrows the search
+# down to INDEX_STRIDE samples before looking at the timestamps themselves.
+class SessionReader:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+
+        self.channels = self.meta.get("channels", 1)
+        self.timestamps = self.mapColumn(TIMESTAMPS_FILE, np.dtype(self.meta["timestamp_dtype"]))
+        names = [VALUES_FILE.format(c) for c in range(self.channels)]
+        if not os.path.exists(os.path.join(path, names[0])):
+            names = [LEGACY_VALUES_FILE]
+        # One memory-mapped array per channel
+        self.values = [self.mapColumn(name, np.dtype(self.meta["value_dtype"])) for name in names]
+        # Sessions recorded before the sequence numbers were stored have none
+        self.seq = None
+        if os.path.exists(os.path.join(path, SEQ_FILE)):
+            self.seq = self.mapColumn(SEQ_FILE, np.dtype(self.meta.get("seq_dtype", SEQ_DTYPE.str)))
+        # A session that was not closed properly may have one column slightly longer than the others
+        columns = [self.timestamps] + self.values + ([self.seq] if self.seq is not None else [])
+        self.samples = min(len(column) for column in columns)
+        self.timestamps = self.timestamps[:self.samples]
+        self.values = [column[:self.samples] for column in self.values]
+        if self.seq is not None:
+            self.seq = self.seq[:self.samples]
+        self.index = np.fromfile(os.path.join(path, INDEX_FILE), dtype=INDEX_DTYPE)
+        self.index = self.index[self.index['sample'] < self.samples]
+
+    def mapColumn(self, name, dtype):
+        filename = os.path.join(self.path, name)
+        if os.path.getsize(filename) < dtype.itemsize:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode="r", shape=(os.path.getsize(filename) // dtype.itemsize,))
+
+    def __len__(self):
+        return self.samples
+
+    # Returns the sample number of the first sample with timestamp >= t
+    def locate(self, t):
+        # Last block that starts before t: a block starting at t may follow samples of the same timestamp
+        block = np.searchsorted(self.index['timestamp'], t, side='left') - 1
+        if block < 0:
+            return 0
+        start = int(self.index['sample'][block])
+        end = min(start + INDEX_STRIDE, self.samples)
+        return start + int(np.searchsorted(self.timestamps[start:end], t, side='left'))
+
+    # Returns (timestamps, values[n, channels]) of the samples with numbers first <= n < last
+    def read(self, first, last, channels=None):
+        channels = range(self.channels) if channels is None else channels
+        values = np.column_stack([self.values[c][first:last] for c in channels]) if len(channels) else None
+        return np.array(self.timestamps[first:last]), values
+
+    # Returns the sequence numbers of the samples with numbers first <= n < last (the sample numbers, wrapped
+    # like sequence numbers, for the sessions that have none stored: gaps cannot be told then)
+    def sequence(self, first, last):
+        if self.seq is None:
+            return np.arange(first, last) & 0xFF
+        return np.array(self.seq[first:last])
+
+    # Returns (timestamps, values[n, channels]) of every sample with start <= timestamp < end
+    def window(self, start, end, channels=None):
+        return self.read(self.locate(start), self.locate(end), channels)
+
+# -----------------------------------------------------------------------------------------------------
+# ------------------------------------------- Replay --------------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Serial-port stand-in that plays a recorded session back, so it goes through exactly the same
+# reader, parsing and plotting path as live data (use it as AcquisitionEngine(ser=ReplayPort(...))).
+# It answers GET/STOP (play/pause), CLEAR (rewind) and SET_MODE (ASCII or binary encoding) and always
+# sends every channel of the session (SET_CHANNELS is ignored); the original timestamps and sequence
+# numbers are kept (so dropped samples show up again) and the samples are released at `speed` times the
+# recorded pace (speed=None or 0 releases them as fast as they are read).
+# A session of aggregate records is sent as aggregate records with its own window (SET_AGGREGATE is ignored).
+class ReplayPort:
+    def __init__(self, path, speed=1.0, timeout=0.1):
+        self.session = SessionReader(path)
+        aggregate = self.session.meta.get("aggregate")
+        # Analog channels and samples per record of the session
+        self.channels = aggregate["channels"] if aggregate else self.session.channels
+        self.window = aggregate["window"] if aggregate else 1
+        self.speed = speed or None
+        self.timeout = timeout
+        self.is_open = True
+        self.mode = ASCII_MODE
+        self.playing = False
+        self.position = 0
+        self.pending = b''
+        self.commands = b''
+        # Commands come from the GUI thread while the reader thread reads
+        self.lock = threading.Lock()
+
+        # Session time that corresponds to `clock_start` on the host clock, while playing
+        self.session_start = 0.0
+        self.clock_start = 0.0
+        # Replay statistics (the achieved rate is only counted while playing)
+        self.replayed = 0
+        self.play_time = 0.0
+        # Last timestamp of each released chunk and the host time at which it was released
+        self.chunk_timestamps = []
+        self.chunk_times = []
+
+    # -------------------------------------------- Commands -----------------------------------------------
+
+    def write(self, data):
+        with self.lock:
+            self.commands += bytes(data)
+            while b'\n' in self.commands:
+                line, self.commands = self.commands.split(b'\n', 1)
+                self.handle(line.decode('utf-8', 'replace').strip())
+        return len(data)
+
+    def handle(self, command):
+        if command == "GET" and not self.playing:
+            self.playing = True
+            self.session_start = self.session.timestamps[self.position] if self.position < len(self.session) else 0.0
+            self.clock_start = time.perf_counter()
+        elif command == "STOP" and self.playing:
+            self.playing = False
+            self.play_time += time.perf_counter() - self.clock_start
+        elif command == "CLEAR":
+            if self.playing:
+                self.play_time += time.perf_counter() - self.clock_start
+            self.playing = False
+            self.position = 0
+            self.pending = b''
+        elif command.startswith("SET_MODE"):
+            mode = command.replace("SET_MODE", "").strip()
+            if mode in (ASCII_MODE, BINARY_MODE):
+                self.mode = mode
+
+    # ---------------------------------------------- Data -------------------------------------------------
+
+    # Encodes the samples that are due (according to the replay speed) into the pending bytes
+    def fill(self):
+        if not self.playing or self.position >= len(self.session) or len(self.pending) >= 65536:
+            return
+        if self.speed is None:
+            end = len(self.session)
+        else:
+            now = self.session_start + (time.perf_counter() - self.clock_start) * 1000 * self.speed
+            end = self.session.locate(np.nextafter(now, np.inf))
+        end = min(end, self.position + REPLAY_CHUNK)
+        if end <= self.position:
+            return
+
+        timestamps, values = self.session.read(self.position, end)
+        # The protocol carries whole milliseconds: fractional timestamps (host timeline of a multi-device
+        # session) are rounded to the nearest one
+        timestamps = np.rint(timestamps).astype(np.int64)
+        seq = self.session.sequence(self.position, end)
+        if self.window > 1 and self.mode == BINARY_MODE:
+            self.pending += encodeAggregates(seq, timestamps, values)
+        elif self.window > 1:
+            self.pending += encodeAggregateLines(timestamps, values)
+        elif self.mode == BINARY_MODE:
+            self.pending += encodeFrames(seq, timestamps, values.round().astype(np.int64))
+        else:
+            self.pending += encodeLines(timestamps, values.round().astype(np.int64))
+
+        self.replayed += end - self.position
+        self.position = end
+        self.chunk_timestamps.append(int(timestamps[-1]))
+        self.chunk_times.append(time.perf_counter())
+
+    @property
+    def in_waiting(self):
+        with self.lock:
+            self.fill()
+            return len(self.pending)
+
+    # Returns up to `size` bytes, waiting up to the timeout for the next sample to be due
+    def read(self, size=1):
+        deadline = time.perf_counter() + self.timeout
+        while True:
+            with self.lock:
+                self.fill()
+                if self.pending or time.perf_counter() >= deadline:
+                    data, self.pending = self.pending[:size], self.pending[size:]
+                    return data
+            time.sleep(0.001)
+
+    def reset_input_buffer(self):
+        with self.lock:
+            self.pending = b''
+
+    def close(self):
+        self.is_open = False
+
+    # True once the whole session has been released
+    @property
+    def finished(self):
+        return self.position >= len(self.session) and not self.pending
+
+    # Achieved replay rate (samples per second of playing time)
+    def rate(self):
+        elapsed = self.play_time + (time.perf_counter() - self.clock_start if self.playing else 0.0)
+        return self.replayed / elapsed if elapsed > 0 else 0.0
+
+    # Returns the host time (time.perf_counter) at which the samples with the given timestamps were released
+    def writeTimes(self, timestamps):
+        if not self.chunk_times:
+            return np.full(len(timestamps), np.nan)
+        k = np.searchsorted(self.chunk_timestamps, timestamps, side='left')
+        return np.array(self.chunk_times)[np.minimum(k, len(self.chunk_times) - 1)]
@@ -0,0 +1,274 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+# Default name of the shared-memory segments (the device number is appended: iad2025_0, iad2025_1, ...)
+SHARED_NAME = "iad2025"
+# Samples kept in each segment
+SHARED_CAPACITY = 262144
+# Value columns reserved for each sample (enough for 6 channels of aggregate records)
+MAX_COLUMNS = 19
+# Bytes reserved for the JSON description of the stream (port, channels, columns, ...)
+META_SIZE = 4096
+
+MAGIC = 0x49414432
+VERSION = 1
+
+# Header at the start of every segment (64 bytes). `generation` is a sequence lock for the format:
+# odd while the producer changes it (or clears the ring). `reserved` and `committed` are the number
+# of samples written so far: `reserved` is raised before a batch is copied in, `committed` after it.
+HEADER_DTYPE = np.dtype([
+    ('magic', '<u4'),
+    ('version', '<u4'),
+    ('capacity', '<u8'),
+    ('max_columns', '<u8'),
+    ('columns', '<u8'),
+    ('generation', '<u8'),
+    ('reserved', '<u8'),
+    ('committed', '<u8'),
+    ('meta_size', '<u8'),
+])
+HEADER_SIZE = 64
+
+# Name of the segment of one device
+def segmentName(name=SHARED_NAME, device=0):
+    return f"{name}_{device}"
+
+# Header, JSON description, timestamps and values arrays mapped on a shared-memory buffer
+def _layout(buf, capacity, max_columns):
+    header = np.ndarray((), dtype=HEADER_DTYPE, buffer=buf)
+    meta = np.ndarray(META_SIZE, dtype=np.uint8, buffer=buf, offset=HEADER_SIZE)
+    offset = HEADER_SIZE + META_SIZE
+    timestamps = np.ndarray(capacity, dtype=np.float64, buffer=buf, offset=offset)
+    offset += 8 * capacity
+    values = np.ndarray((capacity, max_columns), dtype=np.float32, buffer=buf, offset=offset)
+    return header, meta, timestamps, values
+
+def _segmentSize(capacity, max_columns):
+    return HEADER_SIZE + META_SIZE + 8 * capacity + 4 * capacity * max_columns
+
+# -----------------------------------------------------------------------------------------------------
+# ---------------------------------------------- Producer ---------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Publishes a stream of (timestamps, values) batches in a named shared-memory ring buffer, for any
+# number of readers in other processes (see SharedRingReader). Writing never waits for the readers:
+# a reader that falls more than `capacity` samples behind loses the oldest ones (and knows how many).
+# Batches are written by the reader thread (through a callback) while the format may be changed or the ring
+# cleared from the GUI thread: a lock keeps them from interleaving, so the header is never seen half-updated.
+class SharedRingWriter:
+    def __init__(self, name=segmentName(), capacity=SHARED_CAPACITY, max_columns=MAX_COLUMNS):
+        self.capacity = int(capacity)
+        self.max_columns = int(max_columns)
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=_segmentSize(self.capacity, self.max_columns))
+        except FileExistsError:
+            # Left behind by a producer that did not exit cleanly
+            old = shared_memory.SharedMemory(name)
+            old.close()
+            old.unlink()
+            self.shm = shared_memory.SharedMemory(name, create=True, size=_segmentSize(self.capacity, self.max_columns))
+        self.name = name
+        self.lock = threading.Lock()
+        self.header, self.meta, self.timestamps, self.values = _layout(self.shm.buf, self.capacity, self.max_columns)
+        self.header['magic'] = MAGIC
+        self.header['version'] = VERSION
+        self.header['capacity'] = self.capacity
+        self.header['max_columns'] = self.max_columns
+        self.header['generation'] = 0
+        self.setFormat(1)
+
+    # Sets the number of value columns and the description of the stream, and empties the ring
+    def setFormat(self, columns, meta=None):
+        if columns > self.max_columns:
+            raise ValueError(f"At most {self.max_columns} columns can be shared")
+        text = json.dumps(meta or {}).encode("utf-8")[:META_SIZE]
+        with self.lock:
+            self.header['generation'] += 1
+            self.header['columns'] = columns
+            self.meta[:] = 0
+            self.meta[:len(text)] = np.frombuffer(text, dtype=np.uint8)
+            self.header['meta_size'] = len(text)
+            self.header['reserved'] = 0
+            self.header['committed'] = 0
+            self.header['generation'] += 1
+
+    # Empties the ring (readers start over from the next sample)
+    def clear(self):
+        with self.lock:
+            self.header['generation'] += 1
+            self.header['reserved'] = 0
+            self.header['committed'] = 0
+            self.header['generation'] += 1
+
+    # Appends a batch (values with `columns` columns; batches in another format are ignored)
+    def write(self, timestamps, values):
+        with self.lock:
+            # Batches still arriving after close() are dropped
+            if self.header is not None:
+                self.append(timestamps, values)
+
+    # Copies a batch into the ring (called with the lock held)
+    def append(self, timestamps, values):
+        n = len(timestamps)
+        values = np.asarray(values).reshape(n, -1)
+        if not n or values.shape[1] != self.header['columns']:
+            return
+        start = int(self.header['committed'])
+        # Only the last `capacity` samples of a batch can be kept
+        if n > self.capacity:
+            start += n - self.capacity
+            timestamps, values = timestamps[-self.capacity:], values[-self.capacity:]
+            n = self.capacity
+        # Readers drop whatever they copied from the slots about to be overwritten
+        self.header['reserved'] = start + n
+        first = start % self.capacity
+        split = min(n, self.capacity - first)
+        columns = values.shape[1]
+        self.timestamps[first:first + split] = timestamps[:split]
+        self.values[first:first + split, :columns] = values[:split]
+        self.timestamps[:n - split] = timestamps[split:]
+        self.values[:n - split, :columns] = values[split:]
+        self.header['committed'] = start + n
+
+    # Removes the segment (the readers still attached keep their mapping until they close it)
+    def close(self):
+        with self.lock:
+            self.header = self.meta = self.timestamps = self.values = None
+        self.shm.close()
+        self.shm.unlink()
+
+# -----------------------------------------------------------------------------------------------------
+# ---------------------------------------------- Consumer ---------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Attaches to the ring published by a SharedRingWriter (read only, lock-free: the producer is never slowed down).
+# read() returns the samples committed since the previous call. The copy is validated afterwards: samples
+# whose slots the producer started overwriting meanwhile (they are older than `reserved` - capacity) are
+# dropped and counted in `lost`, and a format change or clear in the middle of the copy discards it.
+class SharedRingReader:
+    def __init__(self, name=segmentName(), latest=True):
+        # The segment belongs to the producer: it must not be removed when this process exits, so it is kept
+        # out of the resource tracker (a reader in the producer's own process makes the tracker complain about
+        # it at exit before Python 3.13, which is harmless)
+        if sys.version_info >= (3, 13):
+            self.shm = shared_memory.SharedMemory(name, track=False)
+        else:
+            self.shm = shared_memory.SharedMemory(name)
+            if os.name == "posix":
+                # The tracker knows POSIX segments by their full name, with the leading slash
+                resource_tracker.unregister("/" + self.shm.name.lstrip("/"), "shared_memory")
+        self.name = name
+        header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.shm.buf)
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            self.shm.close()
+            raise ValueError(f"{name} is not a sample ring (or was written by another version)")
+        self.capacity = int(header['capacity'])
+        self.header, self.metaBytes, self.timestamps, self.values = _layout(self.shm.buf, self.capacity,
+                                                                             int(header['max_columns']))
+        # latest=True starts from the next sample published, False from the oldest one still kept
+        self.latest = latest
+        self.generation = None
+        self.position = 0
+        self.lost = 0
+        self.columns = 0
+        self.meta = {}
+
+    # Re-reads the format after the producer changed it (returns False while it is being changed)
+    def sync(self):
+        generation = int(self.header['generation'])
+        if generation % 2:
+            return False
+        if generation != self.generation:
+            self.columns = int(self.header['columns'])
+            size = int(self.header['meta_size'])
+            try:
+                self.meta = json.loads(self.metaBytes[:size].tobytes().decode("utf-8") or "{}")
+            except ValueError:
+                return False
+            committed = int(self.header['committed'])
+            self.position = committed if self.latest else max(committed - self.capacity, 0)
+            if int(self.header['generation']) != generation:
+                return False
+            self.generation = generation
+        return True
+
+    # Returns (timestamps, values[n, columns]) of the samples published since the last call
+    def read(self):
+        empty = np.empty(0), np.empty((0, self.columns), dtype=np.float32)
+        if not self.sync():
+            return empty
+        generation = self.generation
+        committed = int(self.header['committed'])
+        start = max(self.position, committed - self.capacity)
+        self.lost += start - self.position
+        n = committed - start
+        if n <= 0:
+            return empty
+
+        first = start % self.capacity
+        split = min(n, self.capacity - first)
+        timestamps = np.concatenate((self.timestamps[first:first + split], self.timestamps[:n - split]))
+        values = np.concatenate((self.values[first:first + split, :self.columns], self.values[:n - split, :self.columns]))
+
+        # Validation: the copy is only good if the format did not change and its slots were not reused
+        if int(self.header['generation']) != generation:
+            return empty
+        overwritten = min(max(int(self.header['reserved']) - self.capacity - start, 0), n)
+        self.lost += overwritten
+        self.position = committed
+        return timestamps[overwritten:], values[overwritten:]
+
+    # Blocking iteration over the published batches (polling every `interval` seconds)
+    def __iter__(self, interval=0.01):
+        while True:
+            timestamps, values = self.read()
+            if len(timestamps):
+                yield timestamps, values
+            else:
+                time.sleep(interval)
+
+    def close(self):
+        self.header = self.metaBytes = self.timestamps = self.values = None
+        self.shm.close()
+
+# -----------------------------------------------------------------------------------------------------
+# --------------------------------------------- Main --------------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Example consumer: prints the rate and the latest values of a published stream until Ctrl+C, e.g.
+#   python gui.py --publish         then         python sharedring.py
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Reads the samples published by gui.py/acquisition.py")
+    parser.add_argument("--name", default=SHARED_NAME, help="name the producer publishes under")
+    parser.add_argument("--device", type=int, default=0, help="device number (with several ports)")
+    parser.add_argument("--interval", type=float, default=1.0, help="report interval (s)")
+    args = parser.parse_args()
+
+    reader = SharedRingReader(segmentName(args.name, args.device))
+    reader.sync()
+    print(f"Attached to {reader.name}: {reader.meta}")
+    received = 0
+    last = time.monotonic()
+    try:
+        for timestamps, values in reader:
+            received += len(timestamps)
+            now = time.monotonic()
+            if now - last >= args.interval:
+                print(f"{received / (now - last):8.0f} samples/s  lost {reader.lost}  last {timestamps[-1]:.0f} ms: "
+                      + ", ".join(f"{v:.1f}" for v in values[-1]))
+                received = 0
+                last = now
+    except KeyboardInterrupt:
+        reader.close()
@@ -0,0 +1,340 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import os
+import tty
+import time
+import argparse
+import threading
+import numpy as np
+
+from acquisition import encodeFrames, encodeLines, encodeAggregates, encodeAggregateLines, aggregateColumns
+from acquisition import BAUDRATE, MAX_CHANNELS, MAX_WINDOW, DELAY_TIMING, TIMER_TIMING
+
+# Period (s) of the simulator's generation loop
+TICK = 0.001
+# Samples held by the firmware's burst buffer in TIMER timing
+BURST_SIZE = 16
+
+# -----------------------------------------------------------------------------------------------------
+# ------------------------------------------- Simulator -----------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Software stand-in for data.ino on a pseudo-terminal (Linux/macOS only).
+# It answers the same commands (GET, STOP, SET_INTERVAL, SET_MODE, SET_CHANNELS, SET_TIMING, SET_AGGREGATE, CLEAR) and
+# streams noisy sine waves (one per channel, phase shifted), in ASCII or binary, on `self.port`, which can
+# be opened like the Arduino's serial port.
+# As on the Arduino, DELAY timing adds the time spent sending each sample to the period, and slows down
+# when the link is full, while TIMER timing keeps the period and drops the samples that overflow the
+# burst buffer (their sequence numbers are skipped, so the host can count them).
+#   rate:     samples per second (overrides SET_INTERVAL, so rates above 1 kHz can be simulated)
+#   baudrate: emulated link speed in baud (None for unlimited), sampling slows down when the link is full
+#   noise:    probability of each byte sent being corrupted, to test resynchronization
+#   skew:     relative error of the simulated millis() clock (e.g. 1e-3 runs 0.1% fast), to test clock alignment
+class DeviceSimulator(threading.Thread):
+    def __init__(self, rate=None, baudrate=BAUDRATE, noise=0.0, seed=0, skew=0.0):
+        super().__init__(daemon=True)
+        self.master, self.slave = os.openpty()
+        # Raw mode, so the terminal does not echo or translate anything
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self.rate = rate
+        self.baudrate = baudrate
+        self.noise = noise
+        self.skew = skew
+        self.rng = np.random.default_rng(seed)
+
+        # State of the firmware
+        self.active = False
+        self.interval = 50
+        self.binary = False
+        self.channels = 1
+        self.timing = DELAY_TIMING
+        # Samples per aggregate record, the samples of the record being built (timestamps, values) and
+        # the sequence number of the next record
+        self.window = 1
+        self.partial = None
+        self.record_sequence = 0
+        self.sequence = 0
+        # Time (ms since the last CLEAR) at which the next sample is due, while acquiring
+        self.clock = None
+        # Samples (seq, timestamps, values) waiting in the burst buffer for room on the link
+        self.burst = None
+        self.reset_time = time.monotonic()
+
+        # Statistics: samples and bytes sent, and the host time at which each chunk was written
+        # (chunk_timestamps[k] is the last timestamp of chunk k, written at chunk_times[k])
+        self.sent = 0
+        self.dropped = 0
+        self.bytes_sent = 0
+        self.chunk_timestamps = []
+        self.chunk_times = []
+        self.last_chunk_size = 0
+        self.lock = threading.Lock()
+        self.running = True
+
+    def run(self):
+        commands = b''
+        last = time.monotonic()
+        budget = 0.0
+        os.set_blocking(self.master, False)
+        while self.running:
+            # Commands from the host
+            try:
+                commands += os.read(self.master, 1024)
+            except (BlockingIOError, OSError):
+                pass
+            while b'\n' in commands:
+                line, commands = commands.split(b'\n', 1)
+                self.handle(line.decode('utf-8', 'replace').strip())
+
+            now = time.monotonic()
+            elapsed = now - last
+            last = now
+            if self.baudrate:
+                # One start and one stop bit per byte; never accumulate more than ten ticks of idle link
+                # (or two samples/records, if they are longer)
+                budget = min(budget + elapsed * self.baudrate / 10,
+                             max(self.baudrate / 10 * TICK * 10, 2 * self.recordSize()))
+
+            if self.active:
+                # Samples whose time on the sampling clock has come
+                now_ms = self.millis(now)
+                period = 1000.0 / self.sampleRate()
+                if self.clock is None:
+                    self.clock = now_ms
+                if now_ms >= self.clock:
+                    self.send(int((now_ms - self.clock) // period) + 1, period, budget)
+                    if self.baudrate:
+                        budget = max(budget - self.last_chunk_size, 0)
+            else:
+                self.clock = None
+                self.burst = None
+
+            time.sleep(TICK)
+
+    def handle(self, command):
+        if command == "STOP":
+            self.active = False
+            # The record being built is sent with the samples it has
+            if self.partial is not None and len(self.partial[0]):
+                timestamps, values = self.partial
+                self.write(self.encode(np.array([self.record_sequence & 0xFF]), timestamps[:1],
+                                       self.aggregate(values[None])))
+                self.record_sequence += 1
+            self.partial = None
+        elif command == "GET":
+            self.active = True
+        elif command.startswith("SET_INTERVAL"):
+            value = command.replace("SET_INTERVAL", "").strip()
+            if value.isdigit() and int(value) > 0:
+                self.interval = int(value)
+        elif command.startswith("SET_MODE"):
+            mode = command.replace("SET_MODE", "").strip()
+            if mode == "BINARY":
+                self.binary = True
+                self.sequence = 0
+            elif mode == "ASCII":
+                self.binary = False
+            else:
+                self.write(b"ERROR\r\n")
+        elif command.startswith("SET_CHANNELS"):
+            value = command.replace("SET_CHANNELS", "").strip()
+            if value.isdigit() and 1 <= int(value) <= MAX_CHANNELS:
+                self.channels = int(value)
+                self.partial = None
+            else:
+                self.write(b"ERROR\r\n")
+        elif command.startswith("SET_TIMING"):
+            timing = command.replace("SET_TIMING", "").strip()
+            if timing in (DELAY_TIMING, TIMER_TIMING):
+                self.timing = timing
+            else:
+                self.write(b"ERROR\r\n")
+        elif command.startswith("SET_AGGREGATE"):
+            value = command.replace("SET_AGGREGATE", "").strip()
+            if value.isdigit() and 1 <= int(value) <= MAX_WINDOW:
+                self.window = int(value)
+                self.partial = None
+                self.record_sequence = 0
+            else:
+                self.write(b"ERROR\r\n")
+        elif command == "CLEAR":
+            self.partial = None
+            self.record_sequence = 0
+            self.active = False
+            self.reset_time = time.monotonic()
+            self.sequence = 0
+        elif command:
+            self.write(b"ERROR\r\n")
+
+    # Simulated millis() (not rounded) at host time `now` (time.monotonic)
+    def millis(self, now):
+        return (now - self.reset_time) * 1000 * (1 + self.skew)
+
+    # Samples per second actually taken: with DELAY timing the period also includes the time spent sending
+    def sampleRate(self):
+        if self.rate:
+            return self.rate
+        # While aggregating, the samples of a record are taken within one interval
+        period = self.interval / self.window
+        if self.timing == DELAY_TIMING and self.baudrate:
+            # Only one sample in `window` is followed by a record
+            period += 1000.0 * 10 * self.recordSize() / self.baudrate / self.window
+        return 1000.0 / period
+
+    # Bytes of one sample (or aggregate record) in the current format
+    def recordSize(self):
+        columns = aggregateColumns(self.channels) if self.window > 1 else self.channels
+        return len(self.encode(np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64), np.full((1, columns), 512)))
+
+    # Generates and sends the next n samples, `period` ms apart (fewer if the emulated link cannot take them)
+    def send(self, n, period, budget):
+        self.last_chunk_size = 0
+        # Sampling times in millis() resolution
+        timestamps = (self.clock + np.arange(n) * period).astype(np.int64)
+        self.clock += n * period
+        phase = 2 * np.pi * (timestamps[:, None] / 1000.0) + np.arange(self.channels) * np.pi / 3
+        values = 512 + 400 * np.sin(phase) + self.rng.normal(0, 10, phase.shape)
+        values = np.clip(values, 0, 1023).astype(np.int64)
+        seq = (self.sequence + np.arange(n)) & 0xFF
+        self.sequence = (self.sequence + n) & 0xFF
+        if self.window > 1:
+            seq, timestamps, values = self.aggregateWindows(timestamps, values)
+            if not len(timestamps):
+                return
+
+        if self.timing == TIMER_TIMING and self.burst is not None:
+            # Samples left in the burst buffer go first
+            seq, timestamps, values = (np.concatenate((held, new))
+                                       for held, new in zip(self.burst, (seq, timestamps, values)))
+            self.burst = None
+
+        data = self.encode(seq, timestamps, values)
+        if self.baudrate and len(data) > budget:
+            fit = int(budget // (len(data) / len(timestamps)))
+            if self.timing == TIMER_TIMING:
+                # Sampling keeps its period: what does not fit waits in the burst buffer, and the
+                # samples taken while it is full are lost (their sequence numbers are skipped)
+                kept = slice(fit, fit + BURST_SIZE)
+                self.burst = (seq[kept], timestamps[kept], values[kept])
+                self.dropped += max(len(timestamps) - fit - BURST_SIZE, 0)
+            else:
+                # The firmware blocks on Serial: only the samples that fit are taken, and the next one
+                # is taken once the link is free
+                if self.window > 1:
+                    self.record_sequence -= len(timestamps) - fit
+                else:
+                    self.sequence = (self.sequence - (len(timestamps) - fit)) & 0xFF
+                self.clock = self.millis(time.monotonic())
+            if fit == 0:
+                return
+            seq, timestamps, values = seq[:fit], timestamps[:fit], values[:fit]
+            data = self.encode(seq, timestamps, values)
+        n = len(timestamps)
+
+        if self.noise:
+            raw = np.frombuffer(data, dtype=np.uint8).copy()
+            corrupted = self.rng.random(len(raw)) < self.noise
+            raw[corrupted] = self.rng.integers(0, 256, int(corrupted.sum()))
+            data = raw.tobytes()
+
+        self.write(data)
+        self.last_chunk_size = len(data)
+        with self.lock:
+            self.sent += n
+            self.chunk_timestamps.append(int(timestamps[-1]))
+            self.chunk_times.append(time.perf_counter())
+
+    # Adds raw samples to the record being built and returns the records completed, as (seq, timestamps, values)
+    def aggregateWindows(self, timestamps, values):
+        if self.partial is not None:
+            timestamps = np.concatenate((self.partial[0], timestamps))
+            values = np.concatenate((self.partial[1], values))
+        complete = len(timestamps) // self.window * self.window
+        self.partial = (timestamps[complete:], values[complete:])
+        records = complete // self.window
+        seq = (self.record_sequence + np.arange(records)) & 0xFF
+        self.record_sequence += records
+        windows = values[:complete].reshape(records, self.window, values.shape[1])
+        return seq, timestamps[:complete:self.window], self.aggregate(windows)
+
+    # Aggregate records (mean, min, max, count) of windows[records, samples, channels]
+    def aggregate(self, windows):
+        # The firmware sends the mean in 1/64 of an ADC unit
+        means = np.rint(windows.mean(axis=1) * 64) / 64
+        counts = np.full((len(windows), 1), windows.shape[1])
+        return np.column_stack((means, windows.min(axis=1), windows.max(axis=1), counts))
+
+    def encode(self, seq, timestamps, values):
+        if self.window > 1:
+            if self.binary:
+                return encodeAggregates(seq, timestamps, values)
+            return encodeAggregateLines(timestamps, values)
+        if self.binary:
+            return encodeFrames(seq, timestamps, values)
+        return encodeLines(timestamps, values)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view and self.running:
+            try:
+                written = os.write(self.master, view)
+                view = view[written:]
+                self.bytes_sent += written
+            except BlockingIOError:
+                # The host is not reading fast enough: the pty buffer is full
+                time.sleep(TICK)
+
+    # Returns the host time (time.perf_counter) at which the samples with the given timestamps were written
+    def writeTimes(self, timestamps):
+        with self.lock:
+            chunk_timestamps = np.array(self.chunk_timestamps)
+            chunk_times = np.array(self.chunk_times)
+        if not len(chunk_times):
+            return np.full(len(timestamps), np.nan)
+        k = np.minimum(np.searchsorted(chunk_timestamps, timestamps, side='left'), len(chunk_times) - 1)
+        return chunk_times[k]
+
+    def stop(self):
+        self.running = False
+        self.join(timeout=2)
+        os.close(self.master)
+        os.close(self.slave)
+
+# -----------------------------------------------------------------------------------------------------
+# --------------------------------------------- Main --------------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Runs the simulator until Ctrl+C, so gui.py can be used without an Arduino:
+#   python simulator.py --rate 2000         then         python gui.py --port <printed port>
+# With --devices N, N simulated Arduinos are started (each one with its own clock error), to be read with
+#   python gui.py --port <port 1> <port 2> ...
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulated data.ino on a pseudo-terminal")
+    parser.add_argument("--rate", type=float, help="samples per second (default: follow SET_INTERVAL)")
+    parser.add_argument("--baudrate", type=int, default=BAUDRATE, help="emulated baud rate (0 for unlimited)")
+    parser.add_argument("--noise", type=float, default=0.0, help="probability of corrupting each byte")
+    parser.add_argument("--devices", type=int, default=1, help="number of simulated Arduinos")
+    parser.add_argument("--skew", type=float, default=0.0, help="clock error of the first device (e.g. 1e-3)")
+    args = parser.parse_args()
+
+    # The clock error alternates in sign and grows from one device to the next
+    simulators = [DeviceSimulator(args.rate, args.baudrate or None, args.noise, seed=d,
+                                  skew=args.skew * (d + 1) * (-1) ** d)
+                  for d in range(args.devices)]
+    for simulator in simulators:
+        simulator.start()
+        print(f"Simulated Arduino on {simulator.port}")
+    print("Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for simulator in simulators:
+            simulator.stop()
+            print(f"{simulator.port}: sent {simulator.sent} samples ({simulator.bytes_sent} bytes)")
@@ -0,0 +1,11 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import os
+import sys
+
+# The modules of the project import each other by name, as when they are run from its folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,165 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import time
+import numpy as np
+
+from acquisition import (encodeLines, parseLines, encodeFrames, decodeFrames, encodeAggregateLines,
+                         parseAggregateLines, encodeAggregates, decodeAggregates, aggregateColumn, frameDtype,
+                         TimingStats, AcquisitionEngine)
+
+def samples(n=50, channels=2):
+    rng = np.random.default_rng(1)
+    return np.arange(n) * 2 + 1000, rng.integers(0, 1024, (n, channels))
+
+# Aggregate records of `channels` channels: means, minima, maxima and count
+def records(n=20, channels=2, window=8):
+    rng = np.random.default_rng(2)
+    lows = rng.integers(0, 500, (n, channels))
+    highs = lows + rng.integers(0, 500, (n, channels))
+    means = lows + np.round((highs - lows) * rng.random((n, channels)) * 64) / 64
+    return np.arange(n) * 16, np.column_stack((means, lows, highs, np.full(n, window)))
+
+# ---- ASCII lines ----
+
+def test_lines_round_trip():
+    ts, values = samples()
+    out_ts, out_values, errors, remainder = parseLines(encodeLines(ts, values), 2)
+    assert np.array_equal(out_ts, ts)
+    assert np.array_equal(out_values, values)
+    assert errors == 0 and remainder == b''
+
+def test_lines_keep_the_incomplete_last_line():
+    ts, values = samples(10)
+    data = encodeLines(ts, values)
+    cut = len(data) - 5
+    out_ts, _, _, remainder = parseLines(data[:cut], 2)
+    assert len(out_ts) == 9
+    out_ts, out_values, _, _ = parseLines(remainder + data[cut:], 2)
+    assert out_ts.tolist() == [ts[-1]]
+    assert np.array_equal(out_values[0], values[-1])
+
+def test_lines_skip_corrupted_lines_and_count_errors():
+    data = b"1, 2, 10\r\nERROR\r\n3, x4, 12\r\n5, 6\r\n7, 8, 14\r\n"
+    ts, values, errors, _ = parseLines(data, 2)
+    assert ts.tolist() == [10, 14]
+    assert values.tolist() == [[1, 2], [7, 8]]
+    assert errors == 1
+
+def test_aggregate_lines_round_trip():
+    ts, values = records()
+    out_ts, out_values, _, _ = parseAggregateLines(encodeAggregateLines(ts, values), 2)
+    assert np.array_equal(out_ts, ts)
+    assert np.allclose(out_values, values, atol=0.005)
+
+# ---- Binary frames ----
+
+def test_frames_round_trip():
+    ts, values = samples()
+    seq, out_ts, out_values, skipped, remainder = decodeFrames(encodeFrames(np.arange(len(ts)), ts, values), 2)
+    assert np.array_equal(seq, np.arange(len(ts)) & 0xFF)
+    assert np.array_equal(out_ts, ts)
+    assert np.array_equal(out_values, values)
+    assert skipped == 0 and remainder == b''
+
+def test_frames_keep_a_partial_frame_for_the_next_chunk():
+    ts, values = samples(4)
+    data = encodeFrames(np.arange(4), ts, values)
+    cut = len(data) - 3
+    _, out_ts, _, _, remainder = decodeFrames(data[:cut], 2)
+    assert out_ts.tolist() == ts[:3].tolist()
+    _, out_ts, _, skipped, _ = decodeFrames(remainder + data[cut:], 2)
+    assert out_ts.tolist() == [ts[3]] and skipped == 0
+
+def test_frames_resynchronize_after_noise():
+    ts, values = samples(6)
+    data = encodeFrames(np.arange(6), ts, values)
+    size = frameDtype(2).itemsize
+    noisy = b"garbage" + data[:2 * size] + b"\x5a\xa5\x01" + data[2 * size:]
+    _, out_ts, _, skipped, remainder = decodeFrames(noisy, 2)
+    assert out_ts.tolist() == ts.tolist()
+    assert skipped == 10 and remainder == b''
+
+def test_frames_with_a_bad_checksum_are_dropped():
+    ts, values = samples(5)
+    data = bytearray(encodeFrames(np.arange(5), ts, values))
+    size = frameDtype(2).itemsize
+    # One value byte of the third frame changed: only its checksum can tell
+    data[2 * size + 3] ^= 0x01
+    _, out_ts, _, skipped, _ = decodeFrames(bytes(data), 2)
+    assert out_ts.tolist() == np.delete(ts, 2).tolist()
+    assert skipped == size
+
+def test_aggregates_round_trip():
+    ts, values = records()
+    seq, out_ts, out_values, skipped, _ = decodeAggregates(encodeAggregates(np.arange(len(ts)), ts, values), 2)
+    assert np.array_equal(out_ts, ts)
+    assert np.array_equal(out_values, values)
+    assert skipped == 0
+    assert np.all(out_values[:, aggregateColumn(2, "count")] == 8)
+
+def test_aggregates_are_not_taken_for_frames():
+    ts, values = records(5)
+    _, out_ts, _, skipped, _ = decodeFrames(encodeAggregates(np.arange(5), ts, values), 2)
+    assert len(out_ts) == 0 and skipped > 0
+
+# ---- Timing statistics ----
+
+def test_sequence_gaps_are_counted_across_batches_and_wraps():
+    timing = TimingStats(interval=2)
+    seq = np.arange(250, 270) & 0xFF
+    kept = np.ones(20, dtype=bool)
+    kept[[3, 4, 12]] = False
+    ts = np.arange(20) * 2.0
+    timing.update(ts[kept][:8], seq[kept][:8])
+    timing.update(ts[kept][8:], seq[kept][8:])
+    stats = timing.stats()
+    assert (stats["samples"], stats["dropped"], stats["gaps"], stats["duplicates"]) == (17, 3, 2, 0)
+    assert stats["jitter_ms"] == 0.0
+
+def test_a_repeated_frame_is_a_duplicate_not_a_wrap():
+    timing = TimingStats(interval=2)
+    timing.update(np.array([0.0, 2.0, 2.0, 4.0]), np.array([7, 8, 8, 9]))
+    stats = timing.stats()
+    assert (stats["dropped"], stats["gaps"], stats["duplicates"]) == (0, 0, 1)
+    assert stats["jitter_ms"] == 0.0
+
+def test_timestamp_gaps_count_in_ascii_mode():
+    timing = TimingStats(interval=10, timed=True)
+    timing.update(np.array([0.0, 10.0, 40.0, 50.0, 60.0]))
+    assert (timing.dropped, timing.gaps) == (2, 1)
+
+# ---- Acquisition engine ----
+
+# Serial port that never sends anything (the batches are put in the reader's queue by the test)
+class SilentPort:
+    is_open = True
+    in_waiting = 0
+
+    def read(self, size=1):
+        time.sleep(0.01)
+        return b''
+
+    def write(self, data):
+        return len(data)
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+def test_batches_of_a_previous_format_are_dropped():
+    with AcquisitionEngine(capacity=100, ser=SilentPort()) as engine:
+        # Parsed before setChannels, but still queued
+        engine.reader.batches.put(((1, 1), np.arange(3.0), np.zeros((3, 1))))
+        engine.setChannels(2)
+        engine.reader.batches.put(((1, 1), np.arange(3.0), np.zeros((3, 1))))
+        engine.reader.batches.put(((2, 1), np.arange(3.0), np.ones((3, 2))))
+        batches = engine.poll()
+    assert len(batches) == 1 and batches[0][1].shape == (3, 2)
+    assert engine.buffer.total == 3
+
@@ -0,0 +1,57 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import numpy as np
+
+from buffers import RingBuffer
+
+# Feeds `n` samples to the buffer (and pyramid, see test_decimation) in batches of irregular sizes, and returns all of them
+def feed(buffer, n, pyramid=None, seed=0):
+    rng = np.random.default_rng(seed)
+    ts = np.arange(n, dtype=np.float64)
+    values = rng.normal(size=n)
+    i = 0
+    while i < n:
+        j = min(i + int(rng.integers(1, 700)), n)
+        buffer.extend(ts[i:j], values[i:j])
+        if pyramid is not None:
+            pyramid.extend(ts[i:j], values[i:j])
+        i = j
+    return ts, values
+
+# ---- Ring buffer ----
+
+def test_ring_keeps_the_last_samples_in_order():
+    buffer = RingBuffer(1000)
+    ts, values = feed(buffer, 3500)
+    out_ts, out_values = buffer.data()
+    assert len(buffer) == 1000 and buffer.total == 3500 and buffer.first() == 2500
+    assert np.array_equal(out_ts, ts[-1000:])
+    assert np.array_equal(out_values, values[-1000:])
+
+def test_ring_append_matches_extend():
+    one, many = RingBuffer(7), RingBuffer(7)
+    for i in range(20):
+        one.append(i, -i)
+    many.extend(np.arange(20), -np.arange(20))
+    assert np.array_equal(one.data()[0], many.data()[0])
+    assert np.array_equal(one.data()[1], many.data()[1])
+
+def test_ring_batch_larger_than_capacity():
+    buffer = RingBuffer(10)
+    buffer.extend(np.arange(3), np.arange(3))
+    buffer.extend(np.arange(3, 28), np.arange(3, 28))
+    assert buffer.data()[0].tolist() == list(range(18, 28))
+    assert buffer.total == 28
+
+def test_ring_slice_and_channels():
+    buffer = RingBuffer(100, shape=(2,))
+    ts = np.arange(250.0)
+    buffer.extend(ts, np.column_stack((ts, -ts)))
+    out_ts, column = buffer.slice(180, 190, channel=1)
+    assert out_ts.tolist() == list(range(180, 190))
+    assert column.tolist() == [-t for t in range(180, 190)]
+    assert np.array_equal(buffer.data(0)[1], ts[150:])
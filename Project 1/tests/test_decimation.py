@@ -0,0 +1,51 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import numpy as np
+
+from buffers import RingBuffer
+from decimation import MinMaxPyramid
+from test_buffers import feed
+
+# ---- Min/max pyramid ----
+
+def test_pyramid_levels_are_the_min_max_of_their_buckets():
+    buffer = RingBuffer(4096)
+    pyramid = MinMaxPyramid(buffer)
+    ts, values = feed(buffer, 20000, pyramid)
+    assert len(pyramid.levels) == 2
+    size = 1
+    for level in pyramid.levels:
+        size *= pyramid.factor
+        bucket_ts, bounds = level.data()
+        first = level.first()
+        for k, (t, (lo, hi)) in enumerate(zip(bucket_ts, bounds), first):
+            group = values[k * size:(k + 1) * size]
+            assert t == ts[k * size]
+            assert lo == group.min() and hi == group.max()
+
+def test_pyramid_envelope_keeps_every_extreme():
+    buffer = RingBuffer(4096)
+    pyramid = MinMaxPyramid(buffer)
+    ts, values = feed(buffer, 10000, pyramid)
+    kept_ts, kept = buffer.data()
+    for start, end, pixels in ((6000, 9999, 100), (6100, 9000, 50), (9000, 9990, 10), (9900, 9950, 100)):
+        x, y = pyramid.envelope(start, end, pixels)
+        inside = (kept_ts >= start) & (kept_ts <= end)
+        assert y.min() <= kept[inside].min() and y.max() >= kept[inside].max()
+        # Never more than a few points per pixel, and never outside the samples around the window
+        assert len(x) <= max(2 * pixels * pyramid.factor + 4, np.count_nonzero(inside) + 2)
+        assert x.min() >= start - 1 - 4 ** len(pyramid.levels) and x.max() <= end + 1
+
+def test_pyramid_bounds_of_aggregate_records():
+    buffer = RingBuffer(64, shape=(3,))
+    pyramid = MinMaxPyramid(buffer, channel=0, bounds=(1, 2))
+    ts = np.arange(10.0)
+    buffer.extend(ts, np.column_stack((ts, ts - 1, ts + 1)))
+    pyramid.extend(ts, ts - 1, ts + 1)
+    x, y = pyramid.envelope(0, 9, 100)
+    assert np.array_equal(x, np.repeat(ts, 2))
+    assert np.array_equal(y, np.column_stack((ts - 1, ts + 1)).reshape(-1))
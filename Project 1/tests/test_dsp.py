@@ -0,0 +1,44 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import numpy as np
+
+from buffers import RingBuffer
+from dsp import RollingStats
+from test_buffers import feed
+
+# ---- Rolling statistics ----
+
+def test_rolling_stats_match_the_window():
+    buffer = RingBuffer(5000)
+    stats = RollingStats(buffer, window=1000)
+    rng = np.random.default_rng(3)
+    values = []
+    for _ in range(40):
+        batch = rng.normal(2.0, 1.5, int(rng.integers(1, 400)))
+        buffer.extend(np.arange(len(batch)), batch)
+        values.extend(batch)
+        stats.update()
+        window = np.array(values[-1000:])
+        result = stats.stats()
+        assert result["samples"] == len(window)
+        assert np.isclose(result["mean"], window.mean())
+        assert np.isclose(result["rms"], np.sqrt(np.mean(window ** 2)))
+        assert np.isclose(result["std"], window.std())
+        assert result["min"] == window.min() and result["max"] == window.max()
+
+def test_rolling_stats_after_falling_behind_and_clearing():
+    buffer = RingBuffer(500)
+    stats = RollingStats(buffer, window=200)
+    assert stats.stats() is None
+    _, values = feed(buffer, 2000)
+    stats.update()
+    assert np.isclose(stats.stats()["mean"], values[-200:].mean())
+    assert stats.stats()["max"] == values[-200:].max()
+    buffer.clear()
+    buffer.extend([0.0, 1.0], [5.0, 7.0])
+    stats.update()
+    assert stats.stats() == {"samples": 2, "mean": 6.0, "rms": np.sqrt(37.0), "std": 1.0, "min": 5.0, "max": 7.0}
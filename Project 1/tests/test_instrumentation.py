@@ -0,0 +1,44 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import json
+import logging
+
+from instrumentation import Instrumentation, StageStats, RateLimitFilter
+
+def test_quantiles_come_from_the_histogram():
+    stage = StageStats()
+    for _ in range(99):
+        stage.record(1e-5)
+    stage.record(1e-2)
+    assert stage.quantile(0.5) >= 1e-5 and stage.quantile(0.5) < 2e-5
+    assert stage.quantile(1.0) == 1e-2 and stage.max == 1e-2
+
+def test_snapshots_count_since_the_previous_one(tmp_path):
+    instruments = Instrumentation()
+    instruments.record("parse", 1e-4, items=10, nbytes=100)
+    instruments.gauge("backlog", 5)
+    instruments.gauge("backlog", 2)
+    first = instruments.export(str(tmp_path / "metrics.jsonl"))
+    assert first["stages"]["parse"]["items"] == 10
+    assert first["gauges"]["backlog"] == {"last": 2, "max": 5}
+    second = instruments.snapshot()
+    assert second["stages"]["parse"]["items_per_s"] == 0
+    assert second["gauges"]["backlog"] == {"last": 2, "max": 2}
+    assert json.loads((tmp_path / "metrics.jsonl").read_text())["stages"]["parse"]["calls"] == 1
+
+def test_disabled_instrumentation_records_nothing():
+    instruments = Instrumentation(enabled=False)
+    instruments.record("read", 1e-3)
+    instruments.gauge("backlog", 1)
+    assert instruments.snapshot()["stages"] == {} and instruments.snapshot()["gauges"] == {}
+
+def test_repeated_log_messages_are_rate_limited():
+    limiter = RateLimitFilter(interval=60)
+    record = lambda: logging.LogRecord("acquisition", logging.WARNING, "", 0, "Invalid line", None, None)
+    assert limiter.filter(record())
+    assert not limiter.filter(record())
+    assert not limiter.filter(record())
@@ -0,0 +1,73 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import time
+import numpy as np
+
+from multidevice import ClockAligner, MultiAcquisition
+from recording import ReplayPort
+from test_recording import record, collect
+
+# Batches of a device whose clock runs `skew` fast and starts `start` ms after the host epoch, read by the
+# host after a random delay: (host time (s), device timestamps (ms), true host time of each sample (ms))
+def device(seconds=120, skew=100e-6, start=500.0, seed=6):
+    rng = np.random.default_rng(seed)
+    for batch in range(int(seconds * 20)):
+        host = start + batch * 50.0 + np.arange(0, 50, 2.0)
+        delay = rng.exponential(3.0) + 1.0
+        yield (host[-1] + delay) / 1000, np.floor(host * (1 + skew)), host
+
+# ---- Clock alignment ----
+
+def test_aligner_follows_the_device_clock():
+    aligner = ClockAligner(epoch=0.0)
+    errors = []
+    last = -np.inf
+    for host_time, timestamps, host in device():
+        aligner.update(host_time, timestamps)
+        aligned = aligner.align(timestamps)
+        assert aligned[0] >= last and np.all(np.diff(aligned) >= 0)
+        last = aligned[-1]
+        errors.append(aligned - host)
+    errors = np.concatenate(errors[len(errors) // 2:])
+    # Only the delay of the fastest batches is left (the fit is a lower envelope of the offsets)
+    assert np.all(np.abs(errors) < 3.0)
+    assert abs(aligner.skew + 100e-6) < 20e-6
+
+def test_aligner_starts_over_when_the_device_restarts():
+    aligner = ClockAligner(epoch=0.0)
+    batches = list(device(seconds=10))
+    for host_time, timestamps, _ in batches:
+        aligner.update(host_time, timestamps)
+    before = aligner.align(batches[-1][1])[-1]
+    # CLEAR: millis() starts again from 0, 10 s later on the host
+    aligner.update(20.0, np.arange(0, 50, 2.0))
+    assert aligner.points[0][0] == 48 and len(aligner.points) == 1
+    aligned = aligner.align(np.arange(0, 50, 2.0))
+    assert aligned[-1] >= before and abs(aligned[-1] - 20000) < 1.0
+
+# ---- Acquisition ----
+
+def test_multidevice_replay_keeps_the_recorded_timestamps(tmp_path):
+    ts, values = record(tmp_path, np.arange(0, 20000, 2.0), channels=1)
+    port = ReplayPort(str(tmp_path), speed=0)
+    with MultiAcquisition(["replay"], capacity=len(ts), sers=[port]) as acquisition:
+        acquisition.start()
+        out_ts, out_values = collect(acquisition, lambda: acquisition.buffers[0], len(ts))
+    assert np.array_equal(out_ts, ts)
+    assert np.array_equal(out_values, values)
+
+def test_unqueued_batches_only_go_to_the_callbacks(tmp_path):
+    ts, _ = record(tmp_path, np.arange(0, 4000, 2.0), channels=1)
+    received = []
+    with MultiAcquisition(["replay"], sers=[ReplayPort(str(tmp_path), speed=0)], queued=False) as acquisition:
+        acquisition.addCallback(lambda device, timestamps, values, seq: received.append(timestamps))
+        acquisition.start()
+        deadline = time.monotonic() + 5
+        while sum(map(len, received)) < len(ts) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert acquisition.poll() == [] and acquisition.batches.empty()
+    assert np.array_equal(np.concatenate(received), ts)
@@ -0,0 +1,159 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import time
+import numpy as np
+import pytest
+
+from acquisition import AcquisitionEngine, ASCII_MODE, BINARY_MODE, aggregateMeta, aggregateColumns
+from recording import SessionWriter, SessionReader, ReplayPort, INDEX_STRIDE
+
+# Records a session of integer samples (as the ADC gives them) and returns its timestamps and values
+def record(path, timestamps, channels=2, meta=None):
+    values = np.random.default_rng(4).integers(0, 1024, (len(timestamps), channels)).astype(np.float32)
+    writer = SessionWriter(str(path), channels)
+    if meta is not None:
+        writer.meta["aggregate"] = meta
+        writer.saveMeta()
+    writer.start()
+    for i in range(0, len(timestamps), 1000):
+        writer.write(timestamps[i:i + 1000], values[i:i + 1000])
+    writer.stop()
+    return np.asarray(timestamps, dtype=np.float64), values
+
+# Polls `acquisition` until `count` samples are in its buffer (or a few seconds went by)
+def collect(acquisition, buffer, count):
+    deadline = time.monotonic() + 5
+    while buffer().total < count and time.monotonic() < deadline:
+        acquisition.poll()
+        time.sleep(0.01)
+    return buffer().data()
+
+# The reader empties the port after setChannels/setAggregate: a replay at full speed must start after it
+def settle(engine):
+    deadline = time.monotonic() + 1
+    while engine.reader.clearRequested.is_set() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+# ---- Writer and reader ----
+
+def test_session_round_trip(tmp_path):
+    ts, values = record(tmp_path, np.arange(0, 30000, 2.0))
+    reader = SessionReader(str(tmp_path))
+    assert len(reader) == len(ts) and reader.channels == 2
+    out_ts, out_values = reader.read(0, len(reader))
+    assert np.array_equal(out_ts, ts)
+    assert np.array_equal(out_values, values)
+    out_ts, out_values = reader.window(9000, 9100, channels=[1])
+    assert out_ts.tolist() == list(range(9000, 9100, 2))
+    assert np.array_equal(out_values[:, 0], values[4500:4550, 1])
+
+def test_clock_restarts_keep_timestamps_increasing(tmp_path):
+    ts = np.concatenate((np.arange(0, 100.0), np.arange(0, 50.0)))
+    record(tmp_path, ts, channels=1)
+    stored = SessionReader(str(tmp_path)).timestamps
+    assert np.all(np.diff(stored) >= 0)
+    assert stored[-1] == 99 + 49
+
+def test_locate_on_duplicate_timestamps(tmp_path):
+    # Every timestamp twice (2 samples per millisecond), with pairs split across the index blocks
+    ts = (np.arange(3 * INDEX_STRIDE + 1) + 1) // 2
+    record(tmp_path, ts, channels=1)
+    reader = SessionReader(str(tmp_path))
+    for t in np.unique(ts):
+        assert reader.locate(t) == np.searchsorted(ts, t, side='left')
+    assert reader.locate(-1) == 0
+    assert reader.locate(ts[-1] + 1) == len(ts)
+    assert reader.locate(INDEX_STRIDE // 2) == INDEX_STRIDE - 1
+    assert reader.locate(INDEX_STRIDE // 2 + 0.5) == INDEX_STRIDE + 1
+
+# ---- Replay ----
+
+@pytest.mark.parametrize("mode", [ASCII_MODE, BINARY_MODE])
+def test_replay_round_trip(tmp_path, mode):
+    ts, values = record(tmp_path, np.arange(1000, 11000, 2.0))
+    port = ReplayPort(str(tmp_path), speed=0)
+    with AcquisitionEngine(capacity=len(ts), ser=port) as engine:
+        engine.setMode(mode)
+        engine.setChannels(port.channels)
+        settle(engine)
+        engine.start()
+        out_ts, out_values = collect(engine, lambda: engine.buffer, len(ts))
+    assert np.array_equal(out_ts, ts)
+    assert np.array_equal(out_values, values)
+
+@pytest.mark.parametrize("mode", [ASCII_MODE, BINARY_MODE])
+def test_replay_of_aggregate_records(tmp_path, mode):
+    meta = aggregateMeta(2, 8)
+    n = 500
+    lows = np.random.default_rng(5).integers(0, 500, (n, 2))
+    rows = np.column_stack((lows + 0.5, lows, lows + 1, np.full(n, 8))).astype(np.float32)
+    ts = np.arange(n) * 16.0
+    writer = SessionWriter(str(tmp_path), aggregateColumns(2))
+    writer.meta["aggregate"] = meta
+    writer.saveMeta()
+    writer.start()
+    writer.write(ts, rows)
+    writer.stop()
+
+    port = ReplayPort(str(tmp_path), speed=0)
+    assert (port.channels, port.window) == (2, 8)
+    with AcquisitionEngine(capacity=n, ser=port) as engine:
+        engine.setMode(mode)
+        engine.setChannels(port.channels)
+        engine.setAggregate(port.window)
+        settle(engine)
+        engine.start()
+        out_ts, out_values = collect(engine, lambda: engine.buffer, n)
+    assert np.array_equal(out_ts, ts)
+    assert np.allclose(out_values, rows, atol=0.01)
+
+# The recorded sequence numbers go back on the wire, so the samples lost while recording are counted again
+def test_replay_keeps_the_gaps_of_the_sequence_numbers(tmp_path):
+    n = 600
+    ts = np.arange(n) * 5.0
+    seq = np.arange(n) & 0xFF
+    kept = np.ones(n, dtype=bool)
+    kept[[100, 101, 102, 400]] = False
+    writer = SessionWriter(str(tmp_path), 1)
+    writer.start()
+    writer.write(ts[kept], np.zeros((kept.sum(), 1)), seq[kept])
+    writer.stop()
+    assert np.array_equal(SessionReader(str(tmp_path)).sequence(0, kept.sum()), seq[kept])
+
+    port = ReplayPort(str(tmp_path), speed=0)
+    with AcquisitionEngine(capacity=n, ser=port) as engine:
+        engine.setMode(BINARY_MODE)
+        engine.setChannels(port.channels)
+        settle(engine)
+        engine.start()
+        collect(engine, lambda: engine.buffer, kept.sum())
+        assert engine.timingStats()["dropped"] == 4
+
+# The protocol carries whole milliseconds: host-timeline timestamps are rounded, not truncated
+def test_replay_rounds_fractional_timestamps(tmp_path):
+    ts = np.arange(200) * 2.0 + 0.75
+    record(tmp_path, ts, channels=1)
+    port = ReplayPort(str(tmp_path), speed=0)
+    with AcquisitionEngine(capacity=len(ts), ser=port) as engine:
+        engine.setMode(BINARY_MODE)
+        engine.setChannels(port.channels)
+        settle(engine)
+        engine.start()
+        out_ts, _ = collect(engine, lambda: engine.buffer, len(ts))
+    assert np.array_equal(out_ts, np.rint(ts))
+
+def test_replay_paced_at_the_recorded_rate(tmp_path):
+    record(tmp_path, np.arange(0, 2000, 2.0))
+    port = ReplayPort(str(tmp_path), speed=4)
+    port.write(b"GET\n")
+    time.sleep(0.1)
+    port.in_waiting
+    # 100 ms at 4 times the pace: about 400 ms of the session (200 samples), far from all of them
+    assert 50 <= port.replayed <= 600
+    port.write(b"STOP\n")
+    port.write(b"CLEAR\n")
+    assert port.position == 0 and port.in_waiting == 0
@@ -0,0 +1,41 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import os
+import numpy as np
+
+from sharedring import SharedRingWriter, SharedRingReader
+
+def test_shared_ring_round_trip():
+    name = f"iad2025_test_{os.getpid()}"
+    writer = SharedRingWriter(name, capacity=100)
+    try:
+        writer.setFormat(3, {"channels": 3})
+        reader = SharedRingReader(name, latest=False)
+        ts = np.arange(40.0)
+        writer.write(ts, np.column_stack((ts, 2 * ts, 3 * ts)))
+        out_ts, out_values = reader.read()
+        assert reader.meta == {"channels": 3}
+        assert np.array_equal(out_ts, ts) and np.array_equal(out_values[:, 2], 3 * ts)
+        assert len(reader.read()[0]) == 0
+
+        # A reader that falls behind loses the oldest samples, and knows how many
+        ts = np.arange(40.0, 290.0)
+        for i in range(0, len(ts), 50):
+            writer.write(ts[i:i + 50], np.tile(ts[i:i + 50, None], 3))
+        out_ts, _ = reader.read()
+        assert np.array_equal(out_ts, ts[-100:]) and reader.lost == 150
+
+        # Batches in another format are ignored, and a new format starts the ring over
+        writer.write(ts[:5], np.zeros((5, 2)))
+        assert len(reader.read()[0]) == 0
+        writer.setFormat(1)
+        writer.write(ts[:5], ts[:5])
+        out_ts, out_values = reader.read()
+        assert reader.columns == 1 and out_values.shape == (5, 1)
+        reader.close()
+    finally:
+        writer.close()
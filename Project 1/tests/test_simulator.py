@@ -0,0 +1,49 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import time
+import numpy as np
+import serial
+
+from acquisition import parseLines, decodeAggregates, aggregateColumn
+from simulator import DeviceSimulator
+
+# Starts a simulator with no link limit, sends it `commands` and returns what it sent in `duration` seconds
+def stream(commands, duration=0.5, **kwargs):
+    simulator = DeviceSimulator(baudrate=None, **kwargs)
+    simulator.start()
+    port = serial.Serial(simulator.port, timeout=0.1)
+    try:
+        port.write(b''.join(c.encode() + b'\n' for c in commands))
+        data = b''
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            data += port.read(4096)
+        return data
+    finally:
+        port.close()
+        simulator.stop()
+
+def test_simulator_streams_lines_at_the_interval():
+    timestamps, values, errors, _ = parseLines(stream(["SET_INTERVAL 10", "SET_CHANNELS 2", "GET"]), 2)
+    assert errors == 0
+    assert len(timestamps) > 10
+    assert values.shape == (len(timestamps), 2)
+    assert np.all((values >= 0) & (values <= 1023))
+    assert np.all(np.diff(timestamps) == 10)
+
+def test_simulator_rejects_unknown_commands():
+    data = stream(["SET_TIMING FAST", "SET_AGGREGATE 0", "FOO"], duration=0.2)
+    assert data == b"ERROR\r\n" * 3
+
+# While aggregating, the records keep the pace of the interval: the samples are taken `window` times faster
+def test_aggregate_records_are_one_interval_apart():
+    data = stream(["SET_MODE BINARY", "SET_AGGREGATE 4", "SET_INTERVAL 20", "GET"])
+    seq, timestamps, values, skipped, _ = decodeAggregates(data)
+    assert skipped == 0
+    assert len(timestamps) > 5
+    assert np.all(np.diff(timestamps) == 20)
+    assert np.all(values[:, aggregateColumn(1, "count")] == 4)
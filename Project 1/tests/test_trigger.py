@@ -0,0 +1,77 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import threading
+import numpy as np
+
+from trigger import Trigger, RISING, FALLING, BOTH
+
+# Square wave between 0 and 100 (period of 200 samples, rising at 100, 300, ...), in batches of `size`
+def batches(n=2000, size=37, start=0):
+    ts = np.arange(start, start + n, dtype=np.float64)
+    values = np.where((ts // 100) % 2 == 1, 100.0, 0.0)[:, None]
+    return [(ts[i:i + size], values[i:i + size]) for i in range(0, n, size)]
+
+def test_captures_around_each_edge():
+    trigger = Trigger(50, RISING, pre=20, post=30)
+    captured = []
+    trigger.addCallback(lambda timestamps, values, position: captured.append((timestamps, values, position)))
+    for timestamps, values in batches():
+        trigger.process(timestamps, values)
+    assert trigger.count == 10 and len(trigger.poll()) == 10
+    for k, (timestamps, values, position) in enumerate(captured):
+        assert position == 20 and len(timestamps) == 50
+        assert timestamps[position] == 100 + 200 * k
+        assert np.array_equal(timestamps, np.arange(80, 130) + 200 * k)
+        assert values[position - 1, 0] == 0 and values[position, 0] == 100
+
+def test_holdoff_edges_and_single_capture():
+    trigger = Trigger(50, BOTH, pre=5, post=5, holdoff=250)
+    for timestamps, values in batches():
+        trigger.process(timestamps, values)
+    # Both edges every 100 samples, but only one trigger every 250 ms is accepted
+    assert trigger.settings()["times"][:4] == [100.0, 400.0, 700.0, 1000.0]
+
+    trigger = Trigger(50, FALLING, pre=5, post=5, rearm=False)
+    for timestamps, values in batches():
+        trigger.process(timestamps, values)
+    assert trigger.count == 1 and not trigger.armed
+    trigger.arm()
+    for timestamps, values in batches(start=2000):
+        trigger.process(timestamps, values)
+    assert trigger.settings()["times"] == [200.0, 2000.0]
+
+def test_hysteresis_ignores_noise_around_the_level():
+    trigger = Trigger(50, RISING, pre=0, post=1, hysteresis=20)
+    noise = np.array([0, 55, 45, 55, 45, 55, 0, 60], dtype=np.float64)
+    trigger.process(np.arange(len(noise)), noise[:, None])
+    assert trigger.settings()["times"] == [1.0, 7.0]
+
+def test_reset_while_processing_never_tears_a_capture():
+    trigger = Trigger(50, RISING, pre=20, post=30)
+    captured = []
+    trigger.addCallback(lambda timestamps, values, position: captured.append((timestamps, position)))
+    errors = []
+
+    def reader():
+        try:
+            for _ in range(20):
+                # Each pass starts the clock again, as a CLEAR does
+                for timestamps, values in batches(size=7):
+                    trigger.process(timestamps, values)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    while thread.is_alive():
+        trigger.reset()
+    thread.join()
+    assert not errors and captured
+    # A reset may shorten the pretrigger of the next capture, never mix two of them
+    for timestamps, position in captured:
+        assert position <= 20 and len(timestamps) - position == 30
+        assert np.all(np.diff(timestamps) == 1) and timestamps[position] % 200 == 100
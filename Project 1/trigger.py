@@ -0,0 +1,225 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 1 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import queue
+import threading
+import numpy as np
+
+from buffers import RingBuffer
+
+# Trigger edges
+RISING = "RISING"
+FALLING = "FALLING"
+BOTH = "BOTH"
+EDGES = (RISING, FALLING, BOTH)
+
+# Default number of samples kept before and after the trigger sample (the trigger sample is the first "post" one)
+PRETRIGGER = 200
+POSTTRIGGER = 800
+
+# -----------------------------------------------------------------------------------------------------
+# ---------------------------------------------- Trigger ----------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Oscilloscope-style trigger on one channel of a stream of batches (the same batches the reader thread
+# hands to its callbacks, so process() can be added as one).
+# The last `pre` samples are always kept in a small ring buffer; when `channel` crosses `level` on the
+# chosen edge, they are copied into a capture together with the next `post` samples, and the capture is
+# queued for poll() and handed to every callback(timestamps, values, position) added with addCallback,
+# where timestamps[position] is the trigger sample. Everything outside the captures is discarded.
+#   hysteresis: the signal must first go this far to the other side of the level (filters out noise)
+#   holdoff:    time (ms, from the trigger sample) during which no new trigger is accepted
+#   rearm:      False for a single capture (arm() must be called for the next one)
+# A new trigger is only accepted once the previous capture is complete, and its pretrigger never reaches
+# back into the previous capture, so consecutive captures never overlap and can be stored one after another.
+# process() runs in the reader thread while reset() may be called from the GUI thread: a lock keeps a reset
+# from tearing a capture in progress. The callbacks are called once it is released.
+class Trigger:
+    def __init__(self, level, edge=RISING, pre=PRETRIGGER, post=POSTTRIGGER, channel=0, hysteresis=0.0,
+                 holdoff=0.0, rearm=True):
+        if edge not in EDGES:
+            raise ValueError(f"Unknown trigger edge: {edge}")
+        self.level = float(level)
+        self.edge = edge
+        self.pre = int(pre)
+        self.post = max(int(post), 1)
+        self.channel = channel
+        self.hysteresis = abs(float(hysteresis))
+        self.holdoff = float(holdoff)
+        self.rearm = rearm
+        self.callbacks = []
+        self.captures = queue.Queue()
+        # Captures completed by the batch being processed, for the callbacks
+        self.completed = []
+        self.channels = None
+        self.lock = threading.Lock()
+        self.reset()
+
+    # Forgets the pretrigger samples and any capture in progress, and arms the trigger again
+    def reset(self):
+        with self.lock:
+            self.restart()
+
+    # Same as reset() (called with the lock held)
+    def restart(self):
+        self.history = None
+        self.seen = 0
+        self.capture = None
+        self.capture_end = 0
+        self.holdoff_until = -np.inf
+        self.armed = True
+        # Side of the level (+1 above, -1 below, 0 unknown) at the end of the last batch, for each edge
+        self.state = {RISING: 0, FALLING: 0}
+        self.count = 0
+        self.times = []
+
+    def arm(self):
+        self.armed = True
+
+    def addCallback(self, callback):
+        self.callbacks.append(callback)
+
+    def removeCallback(self, callback):
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+
+    # Returns the captures completed since the last call, as (timestamps, values, position)
+    def poll(self):
+        captures = []
+        while True:
+            try:
+                captures.append(self.captures.get_nowait())
+            except queue.Empty:
+                return captures
+
+    # Settings of the trigger and number of captures (and their trigger times), e.g. for a session's metadata
+    def settings(self):
+        with self.lock:
+            times = list(self.times)
+        return {
+            "level": self.level,
+            "edge": self.edge,
+            "channel": self.channel,
+            "pre": self.pre,
+            "post": self.post,
+            "hysteresis": self.hysteresis,
+            "holdoff_ms": self.holdoff,
+            "rearm": self.rearm,
+            "captures": self.count,
+            "times": times,
+        }
+
+    # Indices of the samples of `signal` where it crosses `level` upwards, and the side it ends on.
+    # Above the level is +1, below level - hysteresis is -1, and in between the previous side is kept
+    # (forward-filled with a running maximum of indices, so the whole batch is done without a Python loop).
+    def rising(self, signal, level, state):
+        marks = np.zeros(len(signal), dtype=np.int8)
+        marks[signal >= level] = 1
+        marks[signal < level - self.hysteresis] = -1
+        last = np.where(marks != 0, np.arange(len(signal)), -1)
+        np.maximum.accumulate(last, out=last)
+        side = np.where(last >= 0, marks[last], state)
+        previous = np.empty_like(side)
+        previous[0] = state
+        previous[1:] = side[:-1]
+        return np.flatnonzero((side == 1) & (previous == -1)), int(side[-1])
+
+    def crossings(self, signal):
+        signal = signal.astype(np.float64)
+        found = []
+        if self.edge in (RISING, BOTH):
+            indices, self.state[RISING] = self.rising(signal, self.level, self.state[RISING])
+            found.append(indices)
+        if self.edge in (FALLING, BOTH):
+            # A falling edge is a rising edge of the inverted signal
+            indices, self.state[FALLING] = self.rising(-signal, -self.level, self.state[FALLING])
+            found.append(indices)
+        return np.unique(np.concatenate(found)) if len(found) > 1 else found[0]
+
+    # Processes a batch of samples (timestamps in ms, values with one column per channel)
+    def process(self, timestamps, values):
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        n = len(timestamps)
+        if not n:
+            return
+        values = np.asarray(values).reshape(n, -1)
+        with self.lock:
+            self.search(timestamps, values)
+            completed, self.completed = self.completed, []
+        for capture in completed:
+            for callback in list(self.callbacks):
+                callback(*capture)
+
+    # Looks for triggers in a batch and fills the captures (called with the lock held)
+    def search(self, timestamps, values):
+        n = len(timestamps)
+        if values.shape[1] != self.channels:
+            # New number of channels: start over
+            self.channels = values.shape[1]
+            self.restart()
+        if self.channel >= self.channels:
+            return
+        if self.history is None:
+            self.history = RingBuffer(max(self.pre, 1), dtype=np.float32, shape=(self.channels,))
+        if self.history.total and timestamps[0] < self.history.data()[0][-1]:
+            # The device clock was restarted (CLEAR)
+            self.restart()
+            self.history = RingBuffer(max(self.pre, 1), dtype=np.float32, shape=(self.channels,))
+
+        position = 0
+        if self.capture is not None:
+            position = self.fill(timestamps, values, 0)
+        for i in self.crossings(values[:, self.channel]):
+            if i < position or self.capture is not None:
+                continue
+            if not self.armed or timestamps[i] < self.holdoff_until:
+                continue
+            self.begin(timestamps, values, i)
+            position = self.fill(timestamps, values, i)
+
+        self.history.extend(timestamps, values)
+        self.seen += n
+
+    # Starts a capture at sample i of the batch, with the pretrigger samples that precede it
+    def begin(self, timestamps, values, i):
+        trigger = self.seen + int(i)
+        # Oldest sample of the pretrigger: at most `pre` back, not before the end of the previous capture
+        # and not before the oldest sample still kept
+        start = max(trigger - self.pre, self.capture_end, self.history.first())
+        size = trigger - start + self.post
+        capture_timestamps = np.empty(size, dtype=np.float64)
+        capture_values = np.empty((size, self.channels), dtype=np.float32)
+
+        # Part of the pretrigger from the previous batches, then from this one
+        kept = max(self.seen - start, 0)
+        if kept:
+            capture_timestamps[:kept], capture_values[:kept] = self.history.slice(start, self.seen)
+        from_batch = trigger - start - kept
+        capture_timestamps[kept:trigger - start] = timestamps[i - from_batch:i]
+        capture_values[kept:trigger - start] = values[i - from_batch:i]
+
+        self.capture = (capture_timestamps, capture_values, trigger - start)
+        self.filled = trigger - start
+        self.holdoff_until = timestamps[i] + self.holdoff
+
+    # Copies the samples of the batch from index i into the capture in progress. Returns the index just
+    # after the last sample used.
+    def fill(self, timestamps, values, i):
+        capture_timestamps, capture_values, position = self.capture
+        taken = min(len(capture_timestamps) - self.filled, len(timestamps) - i)
+        capture_timestamps[self.filled:self.filled + taken] = timestamps[i:i + taken]
+        capture_values[self.filled:self.filled + taken] = values[i:i + taken]
+        self.filled += taken
+        if self.filled == len(capture_timestamps):
+            self.capture = None
+            self.capture_end = self.seen + i + taken
+            self.count += 1
+            self.times.append(float(capture_timestamps[position]))
+            if not self.rearm:
+                self.armed = False
+            self.captures.put((capture_timestamps, capture_values, position))
+            self.completed.append((capture_timestamps, capture_values, position))
+        return i + taken
@@ -1,5 +1,4 @@
 #include <Servo.h>
-#include <avr/wdt.h>
 
 
 // Create servo objects for each motor
@@ -20,6 +19,26 @@ ServoCommand currentCommand = {0, 0, false};
 unsigned long lastMoveTime = 0;                
 const int moveInterval = 15;                   
 
+// Position of every servo between jobs (the arm goes back to it after each box)
+const int homePositions[][2] = {{3, 90}, {4, 90}, {5, 90}, {6, 0}};
+
+// Jobs received from the host and not started yet: "JOB <id> <sector>" lines. Each job is acknowledged
+// with "QUEUED <id>" when it is received, "BUSY <id>" when it starts and "DONE <id>" when the arm is back
+// home ("ERR <id> <reason>" if it is rejected), so the host can send the next ones while the servos move.
+struct Job {
+  long id;
+  int sector;
+};
+const int jobCapacity = 8;
+Job jobs[jobCapacity];
+int jobFirst = 0, jobCount = 0;
+bool jobRunning = false;
+
+// Serial line being received (read without blocking, so the servos never wait for the host)
+char line[48];
+int lineLength = 0;
+void pollSerial();
+
 // Function to return the corresponding servo object based on the pin number
 Servo* getServo(int pin) {
   switch (pin) {
@@ -42,13 +61,13 @@ int* getServoPosition(int pin) {
   }
 }
 
-// Function to move a servo to position 0 (reset to 0 degrees)
-void moveToZero(int pin) {
+// Function to move a servo to an absolute position (degrees)
+void moveTo(int pin, int position) {
   int* currentPosition = getServoPosition(pin);
   if (currentPosition) {
-    currentCommand = {pin, 0, true};  
+    currentCommand = {pin, constrain(position, 0, 180), true};  
   } else {
-    Serial.print("Error: Invalid pin in moveToZero: ");
+    Serial.print("Error: Invalid pin in moveTo: ");
     Serial.println(pin);
   }
 }
@@ -96,21 +115,27 @@ void processMovement() {
   }
 }
 
-// Function to reset all servos to position 0
-void resetPosition() {
-  moveToZero(3);
-  delay(200);
-  moveToZero(4);
-  delay(200);
-  moveToZero(5);
-  delay(200);
-  moveToZero(6);
-  delay(200);
-};
+// Function to finish the current movement, still receiving the commands sent meanwhile
+void waitMovement() {
+  while (currentCommand.active) {
+    processMovement();
+    pollSerial();
+  }
+}
 
-void softwareReset() {
-  wdt_enable(WDTO_15MS); // Set watchdog timer to reset in 15 ms
-  while (1) {}           // Wait for reset
+// Function to wait for the specified time (ms), still receiving the commands sent meanwhile
+void pause(unsigned long ms) {
+  unsigned long start = millis();
+  while (millis() - start < ms) pollSerial();
+}
+
+// Function to move every servo back to its home position, one after the other. This replaces the
+// software reset that used to end every box, so the session (and the jobs queued) survive between boxes.
+void homePosition() {
+  for (unsigned int i = 0; i < sizeof(homePositions) / sizeof(homePositions[0]); i++) {
+    moveTo(homePositions[i][0], homePositions[i][1]);
+    waitMovement();
+  }
 }
 
 
@@ -119,56 +144,55 @@ void softwareReset() {
 // Function to move Box 1 down
 void MoveDown1() {
   moveServo(3, 50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(6, 60);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(5, -50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(6, 50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(5, -80);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(6, 60);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(5, -50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(6, 50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(5, -80);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(3, -50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
 }
 
 // Function to move Box 1 up
 void MoveUp() {
   moveServo(6, -35);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(5, 50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(6, -30);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(5, 30);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(5, 50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(6, -30);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(6, -50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(4, 2);
-  while (currentCommand.active) processMovement();
+  waitMovement();
 }
 
 // Function to move Box 1 by executing specific moves
 void moveBox1() {
   moveServo(4, -2);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   MoveDown1();
-  delay(1000);
+  pause(1000);
   MoveUp();
-  moveServo(4, 2);
-  softwareReset();
+  homePosition();
 }
 
 // -------------------------------------------------- BOX 2 -------------------------------------------------
@@ -176,30 +200,29 @@ void moveBox1() {
 // Function to move Box 2 down
 void MoveDown2() {
   moveServo(3, 50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(6, 60);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(5, -50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(6, 30);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(5, -50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(6, 50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(3, -50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
 }
 
 // Function to move Box 2 by executing specific moves
 void moveBox2() {
   moveServo(4, 23);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   MoveDown2();
-  delay(1000);
+  pause(1000);
   MoveUp();
-  moveServo(4, -23);
-  softwareReset();
+  homePosition();
 }
 
 // -------------------------------------------------- BOX 3 -------------------------------------------------
@@ -207,65 +230,181 @@ void moveBox2() {
 // Function to move Box 3 down
 void MoveDown3() {
   moveServo(3, 50);
-  while (currentCommand.active) processMovement();
-  delay(200);
+  waitMovement();
+  pause(200);
 
   moveServo(6, 90);
-  while (currentCommand.active) processMovement();
-  delay(200);
+  waitMovement();
+  pause(200);
 
   moveServo(5, -60);
-  while (currentCommand.active) processMovement();
-  delay(200);
+  waitMovement();
+  pause(200);
 
   moveServo(6, 30);
-  while (currentCommand.active) processMovement();
-  delay(200);
+  waitMovement();
+  pause(200);
 
   moveServo(5, -10);
-  while (currentCommand.active) processMovement();
-  delay(200);
+  waitMovement();
+  pause(200);
 
   moveServo(6, 40);
-  while (currentCommand.active) processMovement();
-  delay(200);
+  waitMovement();
+  pause(200);
 
   moveServo(3, -50);
-  while (currentCommand.active) processMovement();
-  delay(200);
+  waitMovement();
+  pause(200);
 }
 
 // Function to move Box 3 up
 void MoveUp3() {
   moveServo(6, -60);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(5, 50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(6, -30);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(5, 30);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(5, 50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(6, -30);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(6, -50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(4, 2);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   moveServo(3, 50);
-  while (currentCommand.active) processMovement();
+  waitMovement();
 }
 
 // Function to move Box 3 by executing specific moves
 void moveBox3() {
   moveServo(4, 41);
-  while (currentCommand.active) processMovement();
+  waitMovement();
   MoveDown3();
-  delay(1000);
+  pause(1000);
   MoveUp();
-  moveServo(4, -41);
-  softwareReset();
+  homePosition();
+}
+
+// -------------------------------------------------- JOBS --------------------------------------------------
+
+// Function to queue a box job for the specified sector of the camera image
+void queueJob(long id, int sector) {
+  if (sector < 0 || sector > 2) {
+    Serial.print("ERR ");
+    Serial.print(id);
+    Serial.println(" SECTOR");
+  } else if (jobCount == jobCapacity) {
+    Serial.print("ERR ");
+    Serial.print(id);
+    Serial.println(" FULL");
+  } else {
+    jobs[(jobFirst + jobCount) % jobCapacity] = {id, sector};
+    jobCount++;
+    Serial.print("QUEUED ");
+    Serial.println(id);
+  }
+}
+
+// Function to run the oldest job queued (the image is mirrored: sector 0 is box 3 and sector 2 is box 1)
+void runNextJob() {
+  Job job = jobs[jobFirst];
+  jobFirst = (jobFirst + 1) % jobCapacity;
+  jobCount--;
+  jobRunning = true;
+  Serial.print("BUSY ");
+  Serial.println(job.id);
+  switch (job.sector) {
+    case 0: moveBox3(); break;
+    case 1: moveBox2(); break;
+    case 2: moveBox1(); break;
+  }
+  jobRunning = false;
+  Serial.print("DONE ");
+  Serial.println(job.id);
+}
+
+// Function to handle one command line from the host
+void handleCommand(String command) {
+  command.trim();
+  if (command.length() == 0) return;
+
+  // Handle JOB <id> <sector>
+  if (command.startsWith("JOB ")) {
+    int space = command.indexOf(' ', 4);
+    if (space == -1) {
+      Serial.println("ERR 0 MALFORMED");
+      return;
+    }
+    queueJob(command.substring(4, space).toInt(), command.substring(space + 1).toInt());
+
+  // Handle move(pin, angle) (only between jobs, the arm is moved by the jobs otherwise)
+  } else if (command.startsWith("move(") && command.endsWith(")")) {
+    int firstComma = command.indexOf(',');
+    if (jobRunning || currentCommand.active) {
+      Serial.println("Busy: wait for the current movement to end.");
+    } else if (firstComma != -1) {
+      int pin = command.substring(5, firstComma).toInt();
+      int angle = command.substring(firstComma + 1, command.length() - 1).toInt();
+
+      if (pin >= 3 && pin <= 6) {
+        moveServo(pin, angle);
+        Serial.print("Moving servo on pin ");
+        Serial.print(pin);
+        Serial.print(" by ");
+        Serial.print(angle);
+        Serial.println(" degrees.");
+      } else {
+        Serial.println("Invalid pin! Use pin 3, 4, 5, or 6.");
+      }
+    } else {
+      Serial.println("Malformed move command. Use move(pin, angle)");
+    }
+
+  // Handle named commands (queued as jobs with id 0)
+  } else if (command.equals("moveBox1")) {
+    queueJob(0, 2);
+  } else if (command.equals("moveBox2")) {
+    queueJob(0, 1);
+  } else if (command.equals("moveBox3")) {
+    queueJob(0, 0);
+
+  // Handle numeric string or comma-separated list of sectors (queued as jobs with id 0)
+  } else {
+    int fromIndex = 0;
+    while (fromIndex < command.length()) {
+      int commaIndex = command.indexOf(',', fromIndex);
+      String numStr;
+      if (commaIndex == -1) {
+        numStr = command.substring(fromIndex);
+        fromIndex = command.length(); 
+      } else {
+        numStr = command.substring(fromIndex, commaIndex);
+        fromIndex = commaIndex + 1;
+      }
+
+      numStr.trim();
+      queueJob(0, numStr.toInt());
+    }
+  }
+}
+
+// Function to read the bytes received so far and handle every complete line (never waits)
+void pollSerial() {
+  while (Serial.available()) {
+    char c = Serial.read();
+    if (c == '\n') {
+      line[lineLength] = '\0';
+      lineLength = 0;
+      handleCommand(String(line));
+    } else if (lineLength < (int)sizeof(line) - 1) {
+      line[lineLength++] = c;
+    }
+  }
 }
 
 // Setup function to initialize the servos and communication
@@ -278,91 +417,18 @@ void setup() {
   servo5.attach(5);
   servo6.attach(6);
 
-  resetPosition();
+  homePosition();
 
-  Serial.println("Servos initialized. Use move(pin, angle) to move.");
+  // The host sends jobs once it has seen this line
+  Serial.println("READY");
 }
 
-// Main loop function to process movement commands from Serial input
+// Main loop function: receives commands and runs the queued jobs one after the other, without resetting
 void loop() {
   processMovement();
+  pollSerial();
 
-  if (Serial.available()) {
-    String command = Serial.readStringUntil('\n');
-    Serial.print("Raw input: ");
-    Serial.println(command);
-    command.trim();
-    Serial.print("Received: ");
-    Serial.println(command);
-
-    // Handle move(pin, angle)
-    if (command.startsWith("move(") && command.endsWith(")")) {
-      int firstComma = command.indexOf(',');
-      if (firstComma != -1) {
-        int pin = command.substring(5, firstComma).toInt();
-        int angle = command.substring(firstComma + 1, command.length() - 1).toInt();
-
-        if (pin >= 3 && pin <= 6) {
-          moveServo(pin, angle);
-          Serial.print("Moving servo on pin ");
-          Serial.print(pin);
-          Serial.print(" by ");
-          Serial.print(angle);
-          Serial.println(" degrees.");
-        } else {
-          Serial.println("Invalid pin! Use pin 3, 4, 5, or 6.");
-        }
-      } else {
-        Serial.println("Malformed move command. Use move(pin, angle)");
-      }
-
-    // Handle named commands
-    } else if (command.equals("moveBox1")) {
-      Serial.println("Executing moveBox1()");
-      moveBox1();
-    } else if (command.equals("moveBox2")) {
-      Serial.println("Executing moveBox2()");
-      moveBox2();
-    } else if (command.equals("moveBox3")) {
-      Serial.println("Executing moveBox3()");
-      moveBox3();
-
-    // Handle numeric string or comma-separated list
-    } else {
-      int fromIndex = 0;
-      while (fromIndex < command.length()) {
-        int commaIndex = command.indexOf(',', fromIndex);
-        String numStr;
-        if (commaIndex == -1) {
-          numStr = command.substring(fromIndex);
-          fromIndex = command.length(); 
-        } else {
-          numStr = command.substring(fromIndex, commaIndex);
-          fromIndex = commaIndex + 1;
-        }
-
-        numStr.trim();
-        int num = numStr.toInt();
-
-        switch (num) {
-          case 0:
-            Serial.println("Executing moveBox1()");
-            moveBox3();
-            break;
-          case 1:
-            Serial.println("Executing moveBox2()");
-            moveBox2();
-            break;
-          case 2:
-            Serial.println("Executing moveBox3()");
-            moveBox1();
-            break;
-          default:
-            Serial.print("Unknown box number: ");
-            Serial.println(num);
-            break;
-        }
-      }
-    }
+  if (!currentCommand.active && jobCount > 0) {
+    runNextJob();
   }
 }
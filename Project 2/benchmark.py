@@ -0,0 +1,197 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 2 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import json
+import time
+import argparse
+import resource
+import tracemalloc
+import cv2
+import numpy as np
+
+from vision import ColorClassifier, SectorDetector, loadZones, DETECTION_LEVELS
+from processing import FrameProcessor
+from sources import openSource, saveFrames
+
+# Default HSV ranges of the colors (same as main.py), used when no calibration file is given
+COLOR_RANGES = {
+    "Red": ([0, 120, 70], [10, 255, 255], (0, 0, 255)),
+    "Green": ([36, 50, 70], [89, 255, 255], (0, 255, 0)),
+    "Blue": ([94, 80, 2], [126, 255, 255], (255, 0, 0)),
+    "Yellow": ([15, 150, 150], [35, 255, 255], (0, 255, 255))
+}
+# Frames processed before the measurements start (buffers allocated, caches filled)
+WARMUP = 5
+
+# -----------------------------------------------------------------------------------------------------
+# -------------------------------------------- Helpers ------------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Color ranges of a calibration.json written by main.py (the defaults for the colors it does not have)
+def loadRanges(path):
+    ranges = dict(COLOR_RANGES)
+    if path:
+        with open(path, "r") as f:
+            for color, values in json.load(f).items():
+                ranges[color] = (values["lower"], values["upper"], ranges.get(color, (0, 0, (255, 255, 255)))[2])
+    return ranges
+
+# Frames of a source, read in a fresh copy of it so every benchmark gets the same ones. The time spent
+# making or decoding them is not part of any measurement.
+def readFrames(spec, count):
+    with openSource(spec, live=False, count=count) as source:
+        frames = []
+        while len(frames) < count and not source.finished:
+            frame = source.read()
+            if frame is not None:
+                frames.append(frame)
+    if not frames:
+        raise ValueError(f"No frames could be read from {spec}")
+    return frames
+
+def percentiles(times):
+    p50, p95, p99 = np.percentile(times, [50, 95, 99])
+    return {"p50": p50, "p95": p95, "p99": p99, "max": float(np.max(times))}
+
+# Bytes of the arrays an object keeps (directly, or in lists and dicts of arrays)
+def bufferBytes(obj):
+    total = 0
+    for value in vars(obj).values():
+        values = value.values() if isinstance(value, dict) else value if isinstance(value, list) else [value]
+        total += sum(v.nbytes for v in values if isinstance(v, np.ndarray))
+    return total
+
+# Peak resident memory of the process (MB)
+def maxRss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# -----------------------------------------------------------------------------------------------------
+# ------------------------------------------- Benchmarks ----------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Every stage of the detection of one frame, run one after the other in this thread (each stage for all
+# the colors), so the time of each one can be told apart: pyramid reduction, HSV conversion, lookup-table
+# classification, color masks, morphology (opening and closing), and connected components with the zones
+# and sectors of every color
+def benchStages(frames, ranges, levels, zones):
+    classifier = ColorClassifier(ranges)
+    detector = SectorDetector(levels, zones=zones)
+    colors = list(ranges)
+    stages = ["reduce", "hsv", "classify", "mask", "morphology", "regions"]
+    times = {stage: [] for stage in stages}
+    for i, frame in enumerate(frames[:WARMUP] + frames):
+        t = [time.perf_counter()]
+        small = detector.reduce(frame)
+        t.append(time.perf_counter())
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        t.append(time.perf_counter())
+        labels = classifier.classify(hsv)
+        t.append(time.perf_counter())
+        masks = [classifier.mask(labels, color) for color in colors]
+        t.append(time.perf_counter())
+        masks = [detector.clean(mask) for mask in masks]
+        t.append(time.perf_counter())
+        for mask in masks:
+            detector.measure(mask, frame.shape)
+        t.append(time.perf_counter())
+        if i >= WARMUP:
+            for stage, start, end in zip(stages, t, t[1:]):
+                times[stage].append(end - start)
+
+    result = {f"{stage}_ms": 1e3 * float(np.mean(times[stage])) for stage in stages}
+    total = np.sum([times[stage] for stage in stages], axis=0)
+    result["total"] = {k: 1e3 * v for k, v in percentiles(total).items()}
+    result["fps"] = len(total) / float(np.sum(total))
+    result["frame_size"] = f"{frames[0].shape[1]}x{frames[0].shape[0]}"
+    result["working_size"] = "{1}x{0}".format(*detector.workingShape(frames[0].shape))
+    return result
+
+# The detection as the GUI runs it (processing.FrameProcessor: one job per color in a thread pool, the
+# buffers reused from frame to frame), segmenting every frame completely or only what changed
+def benchProcessor(frames, ranges, levels, zones, incremental):
+    classifier = ColorClassifier(ranges)
+    processor = FrameProcessor(classifier, SectorDetector(levels, zones=zones), ranges, incremental)
+    for frame_id, frame in enumerate(frames[:WARMUP]):
+        processor.process(frame, frame_id)
+    processor.counts = dict.fromkeys(processor.counts, 0)
+
+    times = []
+    start, cpu = time.perf_counter(), time.process_time()
+    for frame_id, frame in enumerate(frames):
+        begin = time.perf_counter()
+        processor.process(frame, frame_id)
+        times.append(time.perf_counter() - begin)
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    modes = dict(processor.counts)
+
+    # Memory allocated while processing (the buffers are already there): a second pass, traced
+    tracemalloc.start()
+    for frame_id, frame in enumerate(frames):
+        processor.process(frame, frame_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    processor.close()
+
+    return {
+        "frames": len(frames),
+        "fps": len(frames) / elapsed,
+        "latency_ms": {k: 1e3 * v for k, v in percentiles(times).items()},
+        "cpu_percent": 100 * cpu / elapsed,
+        "modes": modes,
+        "buffers_mb": bufferBytes(processor) / 2**20,
+        "peak_alloc_mb": peak / 2**20,
+    }
+
+# -----------------------------------------------------------------------------------------------------
+# --------------------------------------------- Main --------------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+def show(name, result):
+    print(f"\n{name}")
+    for key, value in result.items():
+        if isinstance(value, dict):
+            value = ", ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in value.items())
+        elif isinstance(value, float):
+            value = f"{value:,.2f}"
+        print(f"  {key:<20} {value}")
+
+# Runs the whole detection headless, e.g.
+#   python benchmark.py                                  generated frames
+#   python benchmark.py --source recording/              images saved with --record (or any directory)
+#   python benchmark.py --source v4l --record recording/ saves 300 camera frames first
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Speed benchmark of the color/sector detection")
+    parser.add_argument("--source", default="synthetic",
+                        help="synthetic, a directory of images, a video file, picamera, camera[:N] or v4l[:N]")
+    parser.add_argument("--frames", type=int, default=300, help="frames processed by each benchmark")
+    parser.add_argument("--record", help="first save the frames of the source as images in this directory")
+    parser.add_argument("--calibration", help="calibration.json with the color ranges (default ranges otherwise)")
+    parser.add_argument("--zones", default="zones.json", help="zones file (3 columns if it does not exist)")
+    parser.add_argument("--levels", type=int, default=DETECTION_LEVELS, help="pyramid levels the frames are reduced by")
+    parser.add_argument("--json", help="also save the results to this file")
+    args = parser.parse_args()
+
+    source = args.source
+    if args.record:
+        with openSource(args.source, live=False, count=args.frames) as recording:
+            print(f"Saved {saveFrames(recording, args.record, args.frames)} frames in {args.record}")
+        source = args.record
+
+    ranges = loadRanges(args.calibration)
+    zones = loadZones(args.zones)
+    frames = readFrames(source, args.frames)
+    results = {
+        "stages": benchStages(frames, ranges, args.levels, zones),
+        "full": benchProcessor(frames, ranges, args.levels, zones, incremental=False),
+        "incremental": benchProcessor(frames, ranges, args.levels, zones, incremental=True),
+    }
+    results["memory"] = {"frames_mb": sum(frame.nbytes for frame in frames) / 2**20, "max_rss_mb": maxRss()}
+    for name, result in results.items():
+        show(name, result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4, default=float)
@@ -4,7 +4,9 @@
 # ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
 # -----------------------------------------------------------------------------------------------------
 
+import os
 import sys
+import argparse
 import serial
 import time
 import json
@@ -14,16 +16,22 @@ from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 
-from picamera2 import Picamera2
-from libcamera import Transform
+# The vision modules are shared by the linux and windows versions
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from vision import ColorClassifier, SectorDetector, loadZones, loadBoxes, drawZones
+from processing import FrameProcessor
+from pipeline import LatestQueue, CaptureThread, DISPLAY_FPS
+from sources import openSource
+from servo import ServoDispatcher
 
 # -----------------------------------------------------------------------------------------------------
 # --------------------------------------------- UI ----------------------------------------------------
 # -----------------------------------------------------------------------------------------------------
 
 class MainWindow(QWidget):
-    def __init__(self):
+    def __init__(self, source="picamera"):
         super().__init__()
+        self.source = source
         self.setWindowTitle("Camera Feed with Color Calibration")
 
         # Initialize serial communication and GUI layout
@@ -46,8 +54,8 @@ class MainWindow(QWidget):
         self.saveButton.clicked.connect(self.saveCalibration)
         self.layout.addWidget(self.saveButton)
 
-        # Checkbox to toggle vertical line markers
-        self.toggleMarkersCheckbox = QCheckBox("Show vertical markers (1/3 and 2/3)")
+        # Checkbox to toggle the detection zone markers
+        self.toggleMarkersCheckbox = QCheckBox("Show detection zones")
         self.toggleMarkersCheckbox.stateChanged.connect(self.toggleMarkers)
         self.layout.addWidget(self.toggleMarkersCheckbox)
 
@@ -86,7 +94,7 @@ class MainWindow(QWidget):
         self.layout.addLayout(button_layout)
 
         # Launch worker thread for image processing
-        self.Worker1 = Worker1(self)
+        self.Worker1 = Worker1(self, source=self.source)
         self.Worker1.ImageUpdate.connect(self.ImageUpdateSlot)
         self.Worker1.start()
 
@@ -118,18 +126,23 @@ class MainWindow(QWidget):
             return
         lower = [self.sliders["H Lower"].value(), self.sliders["S Lower"].value(), self.sliders["V Lower"].value()]
         upper = [self.sliders["H Upper"].value(), self.sliders["S Upper"].value(), self.sliders["V Upper"].value()]
-        self.Worker1.color_ranges[current_color] = (lower, upper, self.Worker1.color_ranges[current_color][2])
+        self.Worker1.setColorRange(current_color, lower, upper)
 
     def ImageUpdateSlot(self, Image):
         # Display updated camera image in the GUI
         self.FeedLabel.setPixmap(QPixmap.fromImage(Image))
+        # The pixmap is a copy: the worker may reuse the buffer behind the image
+        self.Worker1.imageShown()
 
     def printSectors(self, color):
-        # Determine sectors where the specified color is detected and send via serial
+        # Determine sectors where the specified color is detected and queue one job per box they map to
+        # (sent and followed by the dispatcher's thread, the GUI never waits for the servos)
         sections = self.Worker1.checkColorPresence(color)
-        sections_str = ','.join(map(str, sections))
-        self.ser.write(sections_str.encode('utf-8'))
-        print(f"{color} detected in sections: {sections}")
+        # Zones are mapped to the boxes of the arm (several zones may share a box, which is sent once)
+        boxes = sorted({self.Worker1.boxes[section] for section in sections})
+        for box in boxes:
+            self.dispatcher.submit(box)
+        print(f"{color} detected in sections: {sections} (boxes {boxes})")
 
     def saveCalibration(self):
         # Save current HSV settings to JSON
@@ -137,7 +150,7 @@ class MainWindow(QWidget):
         print("Calibration saved.")
 
     def toggleMarkers(self, state):
-        # Toggle the display of vertical line markers based on checkbox state
+        # Toggle the display of the detection zones based on checkbox state
         self.Worker1.show_markers = (state == Qt.Checked)
 
     def keyPressEvent(self, event):
@@ -146,18 +159,24 @@ class MainWindow(QWidget):
             self.close()
     
     def initSerial(self):
-        # Initialize serial connection to external device (e.g. Arduino)
+        # Initialize serial connection to external device (e.g. Arduino); jobs are only sent once it
+        # has restarted and said READY, so there is no need to wait for it here
         try:
-            self.ser = serial.Serial('/dev/ttyACM0', 9600, timeout=1)
-            time.sleep(2)
+            self.dispatcher = ServoDispatcher('/dev/ttyACM0').open()
+            self.dispatcher.addCallback(self.jobUpdated)
         except serial.SerialException:
             QMessageBox.critical(self, 'Connection Error', 'Failed to open serial port.')
             sys.exit()
 
+    def jobUpdated(self, job):
+        # Report finished and failed box jobs (called from the dispatcher's thread)
+        if job.done:
+            print(f"Box job {job.id} (section {job.sector}): {job.state}{f' ({job.error})' if job.error else ''}")
+
     def closeEvent(self, event):
         # Graceful shutdown: close serial and stop worker
-        if hasattr(self, 'ser') and self.ser.is_open:
-            self.ser.close()
+        if hasattr(self, 'dispatcher'):
+            self.dispatcher.close()
         self.Worker1.stop()
         event.accept()
 
@@ -168,15 +187,13 @@ class MainWindow(QWidget):
 class Worker1(QThread):
     ImageUpdate = pyqtSignal(QImage)
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, display_fps=DISPLAY_FPS, incremental=True, source="picamera"):
         super().__init__(parent)
         self.parent_widget = parent
 
-        # Initialize PiCamera with specified resolution and format
-        self.picam2 = Picamera2()
-        config = self.picam2.create_preview_configuration(main={"size": (640, 480), "format": "RGB888"})
-        self.picam2.configure(config)
-        self.picam2.start()
+        # Open the frame source: the PiCamera (640x480) by default, or a camera, video, image directory or
+        # generated frames (see sources.openSource)
+        self.source = openSource(source)
 
         # Define default HSV color ranges and BGR display colors
         self.color_ranges = {
@@ -190,6 +207,29 @@ class Worker1(QThread):
         self.loadCalibration()
         self.show_markers = False
 
+        # Regions and sectors are found on frames reduced to the detector's working resolution
+        # (the zones are read from zones.json, see vision.loadZones)
+        self.detector = SectorDetector(zones=loadZones("zones.json"))
+        # Box of the arm each zone is sorted into (the "boxes" of zones.json, see vision.loadBoxes)
+        self.boxes = loadBoxes("zones.json", self.detector.zones)
+        # Detection of every color, one job per color at the same time (OpenCV releases the GIL). In incremental
+        # mode only the parts of the frame that changed are segmented again (see processing.FrameProcessor)
+        self.processor = FrameProcessor(self.classifier, self.detector, self.color_ranges, incremental)
+        # Display buffers (allocated for the first frame)
+        self.frame_shape = None
+        self.display_buffers = []
+        # Images emitted to and shown by the GUI (see displayBuffer), at most display_fps per second
+        self.emitted = 0
+        self.shown = 0
+        self.display_fps = display_fps
+
+        # Capture stage: its own thread hands the newest frame over to run() (older ones are dropped)
+        self.frames = LatestQueue()
+        self.capture_thread = CaptureThread(self.source.read, self.frames)
+        # Time from capture to detection of the last frame processed (s), and its detection (see vision.Detection)
+        self.latency = 0.0
+        self.detection = None
+
     def loadCalibration(self):
         # Load HSV color bounds from JSON file
         try:
@@ -199,6 +239,13 @@ class Worker1(QThread):
                     self.color_ranges[color] = (values["lower"], values["upper"], self.color_ranges[color][2])
         except FileNotFoundError:
             pass
+        # Every pixel is labeled with all the colors at once by a lookup table built from the ranges
+        self.classifier = ColorClassifier(self.color_ranges)
+
+    def setColorRange(self, color, lower, upper):
+        # Change the HSV range of one color (from the calibration sliders) and rebuild the lookup table
+        self.color_ranges[color] = (lower, upper, self.color_ranges[color][2])
+        self.classifier.build(self.color_ranges)
 
     def saveCalibration(self):
         # Save HSV bounds to JSON file for persistence
@@ -211,84 +258,103 @@ class Worker1(QThread):
         with open("calibration.json", "w") as f:
             json.dump(data, f, indent=4)
 
+    def allocateBuffers(self, shape):
+        # Display buffers (only reallocated if the frame size changes; the processor has its own)
+        self.frame_shape = shape
+        height, width = shape[:2]
+        # Mask of the color being calibrated at the size of the frame
+        self.display_mask = np.empty((height, width), np.uint8)
+        # Images still waiting to be shown may wrap the previous display buffers, which are kept until then
+        self.retired_buffers = self.display_buffers
+        self.display_buffers = [np.empty((height, width, 3), np.uint8) for _ in range(2)]
+
+    def displayBuffer(self):
+        # RGB buffer to draw the next image in, or None if both are still in use. The QImage emitted for a
+        # frame wraps its buffer without copying it, so a buffer is only reused once the GUI has shown the
+        # image made from it two frames ago (imageShown is called from the GUI thread).
+        if self.emitted - self.shown >= len(self.display_buffers):
+            return None
+        return self.display_buffers[self.emitted % len(self.display_buffers)]
+
+    def imageShown(self):
+        self.shown += 1
+
     def run(self):
-        # Main video capture and processing loop
+        # Processing stage: takes the newest captured frame, detects every color (one job per color) and,
+        # at most display_fps times per second, draws the result and emits it to the GUI
         self.ThreadActive = True
+        self.capture_thread.start()
+        next_display = 0.0
         while self.ThreadActive:
-            frame = self.picam2.capture_array()
-            if frame is None:
+            item = self.frames.get(timeout=0.1)
+            if item is None:
                 continue
+            frame_id, captured, frame = item
 
-            self.frame = frame.copy()
-            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+            if self.frame_shape != frame.shape:
+                self.allocateBuffers(frame.shape)
             color_being_calibrated = self.parent_widget.colorSelector.currentText()
 
+            # Every color is detected (also while calibrating, so the sectors are always those of the last frame)
+            self.detection = self.processor.process(frame, frame_id, captured)
+            self.latency = time.perf_counter() - captured
+
+            # Display stage: only when it is time for a new image and the GUI has shown the last ones
+            now = time.perf_counter()
+            if now < next_display:
+                continue
+            display_img = self.displayBuffer()
+            if display_img is None:
+                continue
+            next_display = now + 1.0 / self.display_fps
+
             if color_being_calibrated != "Not Calibrating":
-                lower, upper, _ = self.color_ranges[color_being_calibrated]
-                mask = cv2.inRange(hsv, np.array(lower, np.uint8), np.array(upper, np.uint8))
-                display_img = cv2.cvtColor(mask, cv2.COLOR_GRAY2RGB)
+                mask = self.processor.colorMask(color_being_calibrated)
+                cv2.resize(mask, (frame.shape[1], frame.shape[0]), dst=self.display_mask, interpolation=cv2.INTER_NEAREST)
+                cv2.cvtColor(self.display_mask, cv2.COLOR_GRAY2RGB, dst=display_img)
             else:
-                display_img = frame.copy()
-                for color in self.color_ranges:
-                    lower, upper, bgr = self.color_ranges[color]
-                    mask = cv2.inRange(hsv, np.array(lower, np.uint8), np.array(upper, np.uint8))
-                    kernel = np.ones((5, 5), "uint8")
-                    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-                    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-                    contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-                    for contour in contours:
-                        if cv2.contourArea(contour) > 800:
-                            x, y, w, h = cv2.boundingRect(contour)
-                            cv2.rectangle(display_img, (x, y), (x + w, y + h), bgr, 2)
-            
+                # Drawn directly in RGB (the rectangle colors are given in BGR)
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=display_img)
+                for color, found in self.detection.blobs.items():
+                    bgr = self.color_ranges[color][2]
+                    for x, y, w, h, area in found:
+                        if area > 800:
+                            cv2.rectangle(display_img, (x, y), (x + w, y + h), bgr[::-1], 2)
+
             if self.show_markers:
-                height, width = display_img.shape[:2]
-                cv2.line(display_img, (width // 3, 0), (width // 3, height), (0, 255, 0), 2)
-                cv2.line(display_img, (2 * width // 3, 0), (2 * width // 3, height), (0, 255, 0), 2)
+                drawZones(display_img, self.detector.zoneRects(frame.shape)[0])
 
-            rgb_image = cv2.cvtColor(display_img, cv2.COLOR_BGR2RGB)
-            qt_img = QImage(rgb_image.data, rgb_image.shape[1], rgb_image.shape[0], rgb_image.strides[0], QImage.Format_RGB888)
+            qt_img = QImage(display_img.data, display_img.shape[1], display_img.shape[0], display_img.strides[0], QImage.Format_RGB888)
+            self.emitted += 1
             self.ImageUpdate.emit(qt_img)
 
     def stop(self):
-        # Graceful thread stop
+        # Graceful thread stop (the capture stage first, so the camera is no longer used)
         self.ThreadActive = False
+        self.capture_thread.stop()
         self.quit()
         self.wait()
-        self.picam2.stop()
+        self.processor.close()
+        self.source.close()
 
     def checkColorPresence(self, color):
-        # Analyze which screen sectors contain the specified color
-        lower, upper, _ = self.color_ranges[color]
-        mask = cv2.inRange(cv2.cvtColor(self.frame, cv2.COLOR_BGR2HSV), np.array(lower, np.uint8), np.array(upper, np.uint8))
-        kernel = np.ones((5, 5), "uint8")
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-
-        sections = [[], [], []]
-        height, width = mask.shape
-        section_width = width // 3
-        contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-
-        for contour in contours:
-            if cv2.contourArea(contour) > 300:
-                x, y, w, h = cv2.boundingRect(contour)
-                center_x = x + w // 2
-                if center_x < section_width:
-                    sections[0].append(contour)
-                elif center_x < 2 * section_width:
-                    sections[1].append(contour)
-                else:
-                    sections[2].append(contour)
-
-        return [idx for idx, section in enumerate(sections) if section]
+        # Sectors the specified color was detected in, in the last frame processed (no work on the GUI thread)
+        detection = self.detection
+        if detection is None:
+            return []
+        return list(detection.sectors[color])
 
 # -----------------------------------------------------------------------------------------------------
 # --------------------------------------------- Main --------------------------------------------------
 # -----------------------------------------------------------------------------------------------------
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = MainWindow()
+    parser = argparse.ArgumentParser(description="Camera feed with color calibration and sector detection")
+    parser.add_argument("--source", default="picamera",
+                        help="picamera (the PiCamera), camera[:N], v4l[:N], synthetic, a directory of images or a video file")
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = MainWindow(args.source)
     window.show()
     sys.exit(app.exec_())
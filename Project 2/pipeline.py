@@ -0,0 +1,76 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 2 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import time
+import threading
+import collections
+
+# Frames captured that wait for the processing stage (older ones are dropped)
+FRAME_QUEUE = 1
+# Default rate of the images sent to the GUI (frames are still processed at the camera's rate)
+DISPLAY_FPS = 15
+
+# -----------------------------------------------------------------------------------------------------
+# ---------------------------------------------- Queues -----------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Bounded queue between two stages that never blocks the producer: when it is full, the oldest item is
+# dropped to make room for the new one (and counted), so the consumer always gets the most recent data.
+class LatestQueue:
+    def __init__(self, maxsize=FRAME_QUEUE):
+        self.items = collections.deque(maxlen=maxsize)
+        self.condition = threading.Condition()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        with self.condition:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+
+    # Oldest item still queued, waiting at most `timeout` seconds for one (None if there is none)
+    def get(self, timeout=None):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.items, timeout):
+                return None
+            return self.items.popleft()
+
+    def clear(self):
+        with self.condition:
+            self.items.clear()
+
+# -----------------------------------------------------------------------------------------------------
+# ---------------------------------------------- Capture ----------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Capture stage: calls grab() (which returns a frame, or None if there is none) as fast as the camera
+# delivers and puts (frame id, capture time, frame) in `frames`. The camera is never kept waiting for the
+# processing, which always gets the newest frame.
+class CaptureThread(threading.Thread):
+    def __init__(self, grab, frames):
+        super().__init__(daemon=True)
+        self.grab = grab
+        self.frames = frames
+        self.active = False
+        self.count = 0
+
+    def run(self):
+        self.active = True
+        while self.active:
+            frame = self.grab()
+            if frame is None:
+                continue
+            self.count += 1
+            self.frames.put((self.count, time.perf_counter(), frame))
+
+    def stop(self):
+        self.active = False
+        if self.is_alive():
+            self.join(timeout=1)
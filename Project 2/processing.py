@@ -0,0 +1,199 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 2 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from vision import makeDetection
+
+# Incremental detection: side (pixels of the working resolution) of the cells compared between frames
+CHANGE_CELL = 8
+# Change of the mean of a cell (0-255, in any BGR channel) above which it is segmented again
+CHANGE_THRESHOLD = 12
+# Fraction of changed cells above which the whole frame is segmented again
+FULL_FRACTION = 0.5
+# Distance (full-resolution pixels) the center of a blob may move between two frames and keep its track
+TRACK_DISTANCE = 40
+
+# How the last frame was processed
+FULL = "full"
+PARTIAL = "partial"
+REUSED = "reused"
+
+# -----------------------------------------------------------------------------------------------------
+# ---------------------------------------------- Tracking ---------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Gives the blobs of one color a track number that stays the same from frame to frame: every blob takes
+# the track of the nearest blob of the previous frame (closest pairs first) if it is within `distance`
+# pixels, the others start new tracks.
+class BlobTracker:
+    def __init__(self, distance=TRACK_DISTANCE):
+        self.distance = distance
+        self.centers = np.empty((0, 2))
+        self.tracks = []
+        self.next_track = 0
+
+    def reset(self):
+        self.centers = np.empty((0, 2))
+        self.tracks = []
+
+    # Track numbers of `blobs` ((x, y, w, h, area), ...)
+    def update(self, blobs):
+        centers = np.array([(x + w / 2, y + h / 2) for x, y, w, h, area in blobs], dtype=np.float64).reshape(-1, 2)
+        tracks = [None] * len(centers)
+        if len(centers) and len(self.centers):
+            distances = np.linalg.norm(centers[:, None] - self.centers[None], axis=2)
+            taken = set()
+            for i, j in zip(*np.unravel_index(np.argsort(distances, axis=None), distances.shape)):
+                if distances[i, j] > self.distance:
+                    break
+                if tracks[i] is None and j not in taken:
+                    tracks[i] = self.tracks[j]
+                    taken.add(j)
+        for i, track in enumerate(tracks):
+            if track is None:
+                tracks[i] = self.next_track
+                self.next_track += 1
+        self.centers = centers
+        self.tracks = tracks
+        return tracks
+
+# -----------------------------------------------------------------------------------------------------
+# --------------------------------------------- Processing --------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Detection of every color in a stream of frames (vision.Detection), with the buffers, the thread pool
+# (one job per color) and the state kept between frames. Used from a single thread.
+# In incremental mode the frame at the working resolution is reduced again to cells of CHANGE_CELL pixels,
+# which are compared with the cells of the frames last segmented:
+#   - no cell changed: the previous detection is reused (with the new frame id and time);
+#   - a few cells changed: only the regions around them (plus the margin the mask cleanup needs) are
+#     classified and cleaned again, into the masks kept from the previous frames, before the regions and
+#     zones of every color are measured;
+#   - more than FULL_FRACTION of the cells changed (or the color ranges did): the whole frame is segmented.
+# The blobs are given track numbers (BlobTracker) in all cases.
+class FrameProcessor:
+    def __init__(self, classifier, detector, colors, incremental=True, workers=None):
+        self.classifier = classifier
+        self.detector = detector
+        self.colors = list(colors)
+        self.incremental = incremental
+        self.pool = ThreadPoolExecutor(max_workers=workers or len(self.colors))
+        self.trackers = {color: BlobTracker() for color in self.colors}
+        self.shape = None
+        self.detection = None
+        # How the last frame was processed, and the number of frames processed each way
+        self.mode = None
+        self.counts = {FULL: 0, PARTIAL: 0, REUSED: 0}
+
+    # Buffers reused by every frame (only reallocated if the frame size or the type of the labels change).
+    # The frame is reduced level by level, and is classified and segmented at the working resolution.
+    def allocate(self, shape):
+        self.shape = shape
+        self.pyramid = [np.empty(level_shape, np.uint8) for level_shape in self.detector.pyramidShapes(shape)]
+        height, width = self.detector.workingShape(shape)[:2]
+        dtype = self.classifier.dtype
+        self.hsv = np.empty((height, width, 3), np.uint8)
+        self.bits = np.empty((height, width, 3), dtype)
+        self.plane = np.empty((height, width), dtype)
+        self.labels = np.empty((height, width), dtype)
+        # Mask of the color being calibrated
+        self.mask = np.empty((height, width), np.uint8)
+        # Clean mask (kept between frames), scratch, region labels and integral image of each color
+        self.masks = {color: np.empty((height, width), np.uint8) for color in self.colors}
+        self.scratch = {color: np.empty((height, width), dtype) for color in self.colors}
+        self.components = {color: np.empty((height, width), np.int32) for color in self.colors}
+        self.integrals = {color: np.empty((height + 1, width + 1), np.int32) for color in self.colors}
+        # Cells of the current frame and of the frames they were last segmented in
+        cells = (-(-height // CHANGE_CELL), -(-width // CHANGE_CELL), 3)
+        self.cells = np.empty(cells, np.uint8)
+        self.reference = np.empty(cells, np.uint8)
+        self.difference = np.empty(cells, np.uint8)
+        self.detection = None
+        self.table = None
+        for tracker in self.trackers.values():
+            tracker.reset()
+
+    def close(self):
+        self.pool.shutdown()
+
+    # Detection of a frame (BGR, full resolution)
+    def process(self, frame, frame_id=0, timestamp=0.0):
+        if self.shape != frame.shape or self.labels.dtype != self.classifier.dtype:
+            self.allocate(frame.shape)
+        small = self.detector.reduce(frame, self.pyramid)
+
+        regions = None
+        if self.incremental:
+            cv2.resize(small, self.cells.shape[1::-1], dst=self.cells, interpolation=cv2.INTER_AREA)
+            if self.detection is not None and self.table is self.classifier.table:
+                cv2.absdiff(self.cells, self.reference, dst=self.difference)
+                changed = (self.difference.max(axis=2) > CHANGE_THRESHOLD).astype(np.uint8)
+                if not changed.any():
+                    self.mode = REUSED
+                    self.counts[REUSED] += 1
+                    self.detection = self.detection._replace(frame_id=frame_id, timestamp=timestamp)
+                    return self.detection
+                # The neighbours of a changed cell are segmented as well (the object may be across the edge)
+                dirty = cv2.dilate(changed, np.ones((3, 3), np.uint8))
+                if dirty.mean() <= FULL_FRACTION:
+                    regions = self.dirtyRegions(dirty)
+                    np.copyto(self.reference, self.cells, where=dirty[..., None].astype(bool))
+            if regions is None:
+                np.copyto(self.reference, self.cells)
+        self.table = self.classifier.table
+
+        if regions is None:
+            self.mode = FULL
+            cv2.cvtColor(small, cv2.COLOR_BGR2HSV, dst=self.hsv)
+            self.classifier.classify(self.hsv, self.labels, self.bits, self.plane)
+            jobs = {color: self.pool.submit(self.detectColor, color) for color in self.colors}
+        else:
+            self.mode = PARTIAL
+            for inner, (x0, y0, x1, y1) in regions:
+                hsv = cv2.cvtColor(small[y0:y1, x0:x1], cv2.COLOR_BGR2HSV)
+                self.labels[y0:y1, x0:x1] = self.classifier.classify(hsv)
+            jobs = {color: self.pool.submit(self.updateColor, color, regions) for color in self.colors}
+        self.counts[self.mode] += 1
+
+        results = {color: job.result() for color, job in jobs.items()}
+        tracks = {color: self.trackers[color].update(result[0]) for color, result in results.items()}
+        self.detection = makeDetection(frame_id, timestamp, results, tracks)
+        return self.detection
+
+    # Regions of the frame at the working resolution to segment again, from the cells marked in `dirty`:
+    # (inner, padded) rectangles (x0, y0, x1, y1), where the mask is only replaced inside `inner` and
+    # `padded` adds the margin the cleanup needs around it
+    def dirtyRegions(self, dirty):
+        height, width = self.labels.shape
+        margin = self.detector.margin
+        _, _, stats, _ = cv2.connectedComponentsWithStats(dirty, connectivity=8, ltype=cv2.CV_32S)
+        regions = []
+        for x, y, w, h, _ in stats[1:].tolist():
+            inner = (x * CHANGE_CELL, y * CHANGE_CELL, min((x + w) * CHANGE_CELL, width), min((y + h) * CHANGE_CELL, height))
+            padded = (max(inner[0] - margin, 0), max(inner[1] - margin, 0),
+                      min(inner[2] + margin, width), min(inner[3] + margin, height))
+            regions.append((inner, padded))
+        return regions
+
+    # Job of one color on a whole frame: its mask, cleaned, the regions large enough to count and its zones
+    def detectColor(self, color):
+        mask = self.classifier.mask(self.labels, color, self.masks[color], self.scratch[color])
+        return self.detector.detect(mask, self.shape, self.components[color], self.integrals[color])
+
+    # Job of one color on the changed regions of a frame: the kept mask is updated inside them, and measured
+    def updateColor(self, color, regions):
+        mask = self.masks[color]
+        for (x0, y0, x1, y1), (px0, py0, px1, py1) in regions:
+            piece = self.detector.clean(self.classifier.mask(self.labels[py0:py1, px0:px1], color))
+            mask[y0:y1, x0:x1] = piece[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+        return self.detector.measure(mask, self.shape, self.components[color], self.integrals[color])
+
+    # Mask (working resolution) of one color in the last frame processed, e.g. to show while calibrating it
+    def colorMask(self, color):
+        return self.classifier.mask(self.labels, color, self.mask, self.plane)
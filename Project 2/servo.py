@@ -0,0 +1,267 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 2 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import copy
+import time
+import argparse
+import threading
+import collections
+import serial
+
+# Serial settings of arduino.ino
+BAUDRATE = 9600
+# Jobs sent to the Arduino and not finished yet (it queues up to 8)
+PIPELINE = 4
+# Time (s) the Arduino has to acknowledge a job (QUEUED), and to finish it once started (BUSY to DONE)
+ACK_TIMEOUT = 2.0
+JOB_TIMEOUT = 60.0
+# Time (s) to wait for READY after the port is opened (opening it resets the board) before sending anyway
+READY_TIMEOUT = 5.0
+
+# States of a job
+PENDING = "PENDING"
+QUEUED = "QUEUED"
+BUSY = "BUSY"
+DONE = "DONE"
+FAILED = "FAILED"
+
+# -----------------------------------------------------------------------------------------------------
+# ----------------------------------------------- Jobs ------------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# One box moved by the arm: the sector of the image an object was seen in, the state of the job and
+# the time (time.monotonic()) it was submitted, sent, started and finished. `error` says why it failed.
+class ServoJob:
+    def __init__(self, job_id, sector):
+        self.id = job_id
+        self.sector = sector
+        self.state = PENDING
+        self.error = None
+        self.submitted = time.monotonic()
+        self.sent = self.started = self.finished = None
+        # Time by which it must reach its next state (None while it is not sent)
+        self.deadline = None
+
+    @property
+    def done(self):
+        return self.state in (DONE, FAILED)
+
+    def __repr__(self):
+        return f"ServoJob({self.id}, sector={self.sector}, {self.state}{f': {self.error}' if self.error else ''})"
+
+# -----------------------------------------------------------------------------------------------------
+# --------------------------------------------- Dispatcher --------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Sends box jobs to arduino.ino without ever blocking the caller (the GUI thread). submit() only queues the
+# job; a reader thread sends it as "JOB <id> <sector>\n" and follows the acknowledgements of the Arduino:
+#   QUEUED <id>        received (within ACK_TIMEOUT of being sent); it must start and finish within
+#                      JOB_TIMEOUT for itself and for every job queued ahead of it
+#   BUSY <id>          the arm started moving it (it must be DONE within JOB_TIMEOUT)
+#   DONE <id>          the arm is back home, ready for the next box
+#   ERR <id> <reason>  rejected
+#   READY              the board (re)started: jobs it had are lost
+# Up to `pipeline` jobs are sent ahead, so the Arduino starts the next box as soon as one is done. Every
+# change of state is passed to the callbacks (added with addCallback(callback(job))), from the reader thread
+# and with a copy of the job as it was then. They are called with no lock held, so they may submit jobs.
+class ServoDispatcher:
+    def __init__(self, port, baudrate=BAUDRATE, pipeline=PIPELINE, ser=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.pipeline = pipeline
+        # An already open serial-like object can be given instead of a port name
+        self.ser = ser
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        # Jobs sent and not finished, by id
+        self.sent = {}
+        self.jobs = []
+        self.next_id = 1
+        self.callbacks = []
+        # Copies of the jobs that changed state, for the callbacks (called once the lock is released)
+        self.changes = []
+        self.ready = threading.Event()
+        self.opened = None
+        self.thread = None
+        self.running = False
+
+    # Raises serial.SerialException if the port cannot be opened
+    def open(self):
+        if self.ser is None:
+            self.ser = serial.Serial(self.port, self.baudrate, timeout=0.1)
+        self.opened = time.monotonic()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+        if self.ser is not None and self.ser.is_open:
+            self.ser.close()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def addCallback(self, callback):
+        self.callbacks.append(callback)
+
+    # Queues a box job for `sector` and returns it at once (its state changes as the Arduino acknowledges it)
+    def submit(self, sector):
+        with self.lock:
+            job = ServoJob(self.next_id, int(sector))
+            self.next_id += 1
+            self.pending.append(job)
+            self.jobs.append(job)
+            self.send()
+        return job
+
+    # Jobs submitted and not finished yet
+    def outstanding(self):
+        with self.lock:
+            return len(self.pending) + len(self.sent)
+
+    # Waits until every job submitted is finished (or `timeout` seconds); True if they all are
+    def wait(self, timeout=None):
+        end = None if timeout is None else time.monotonic() + timeout
+        while self.outstanding():
+            if end is not None and time.monotonic() > end:
+                return False
+            time.sleep(0.05)
+        return True
+
+    # Jobs done and failed, boxes per minute and mean time of a box (s), over the jobs finished so far
+    def stats(self):
+        with self.lock:
+            done = [job for job in self.jobs if job.state == DONE]
+            failed = sum(job.state == FAILED for job in self.jobs)
+        result = {"done": len(done), "failed": failed, "per_minute": None, "mean_job_s": None}
+        if done:
+            span = done[-1].finished - min(job.submitted for job in done)
+            result["per_minute"] = 60 * len(done) / span if span > 0 else None
+            durations = [job.finished - job.started for job in done if job.started is not None]
+            result["mean_job_s"] = sum(durations) / len(durations) if durations else None
+        return result
+
+    # Sends pending jobs while there is room in the pipeline (called with the lock held)
+    def send(self):
+        if not self.ready.is_set() or self.ser is None:
+            return
+        while self.pending and len(self.sent) < self.pipeline:
+            job = self.pending.popleft()
+            try:
+                self.ser.write(f"JOB {job.id} {job.sector}\n".encode("ascii"))
+            except serial.SerialException as e:
+                self.pending.appendleft(job)
+                print("Failed to send a servo job:", e)
+                return
+            job.sent = time.monotonic()
+            job.deadline = job.sent + ACK_TIMEOUT
+            self.sent[job.id] = job
+
+    # Moves a job to a new state, with the deadline of the next one, and keeps a copy of it for the
+    # callbacks (called with the lock held)
+    def update(self, job, state, error=None):
+        job.state = state
+        job.error = error
+        now = time.monotonic()
+        if state == QUEUED:
+            ahead = sum(other.id < job.id for other in self.sent.values())
+            job.deadline = now + (ahead + 1) * JOB_TIMEOUT
+        elif state == BUSY:
+            job.started = now
+            job.deadline = now + JOB_TIMEOUT
+        elif job.done:
+            job.finished = now
+            job.deadline = None
+            self.sent.pop(job.id, None)
+        self.changes.append(copy.copy(job))
+
+    # Passes the changes of state to the callbacks (called without the lock)
+    def notify(self):
+        with self.lock:
+            changes, self.changes = self.changes, []
+        for job in changes:
+            for callback in list(self.callbacks):
+                callback(job)
+
+    # Reader thread: parses the lines of the Arduino, checks the timeouts and keeps the pipeline full
+    def run(self):
+        remainder = b''
+        while self.running:
+            try:
+                data = self.ser.read(max(1, self.ser.in_waiting))
+            except serial.SerialException as e:
+                if not self.running:
+                    break
+                print("Error reading the servo controller:", e)
+                time.sleep(0.1)
+                continue
+            lines = (remainder + data).split(b'\n')
+            remainder = lines.pop()
+            with self.lock:
+                for line in lines:
+                    self.handleLine(line.decode("ascii", "replace").strip())
+                self.checkTimeouts()
+                self.send()
+            self.notify()
+
+    # Handles one line of the Arduino (lines that are not acknowledgements are ignored)
+    def handleLine(self, line):
+        words = line.split()
+        if not words:
+            return
+        if words[0] == "READY":
+            for job in list(self.sent.values()):
+                self.update(job, FAILED, "controller restarted")
+            self.ready.set()
+            return
+        if words[0] not in (QUEUED, BUSY, DONE, "ERR") or len(words) < 2 or not words[1].isdigit():
+            return
+        job = self.sent.get(int(words[1]))
+        if job is None:
+            return
+        if words[0] == "ERR":
+            self.update(job, FAILED, " ".join(words[2:]) or "rejected")
+        elif words[0] == QUEUED and job.state != QUEUED:
+            self.update(job, QUEUED)
+        elif words[0] in (BUSY, DONE):
+            self.update(job, words[0])
+
+    # Fails the jobs the Arduino did not acknowledge, start or finish in time (called with the lock held)
+    def checkTimeouts(self):
+        now = time.monotonic()
+        # Old firmware (or a board that does not reset when the port opens) never says READY
+        if not self.ready.is_set() and now - self.opened > READY_TIMEOUT:
+            self.ready.set()
+        for job in list(self.sent.values()):
+            if now > job.deadline:
+                self.update(job, FAILED, "not acknowledged" if job.state == PENDING else "timed out")
+
+# -----------------------------------------------------------------------------------------------------
+# --------------------------------------------- Main --------------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Sends box jobs from the terminal and prints their acknowledgements, e.g.
+#   python servo.py --port /dev/ttyACM0 0 2 1
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sends box jobs to the servo controller (arduino.ino)")
+    parser.add_argument("sectors", type=int, nargs="+", help="boxes (0-2) to move the objects to, in order")
+    parser.add_argument("--port", default="/dev/ttyACM0", help="serial port of the Arduino")
+    parser.add_argument("--pipeline", type=int, default=PIPELINE, help="jobs sent ahead of the one moving")
+    args = parser.parse_args()
+
+    with ServoDispatcher(args.port, pipeline=args.pipeline) as dispatcher:
+        dispatcher.addCallback(lambda job: print(job))
+        for sector in args.sectors:
+            dispatcher.submit(sector)
+        dispatcher.wait()
+        print(dispatcher.stats())
@@ -0,0 +1,243 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 2 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import os
+import time
+import cv2
+import numpy as np
+
+# Size (width, height) of the camera frames, and of the generated ones
+FRAME_SIZE = (640, 480)
+# Rate of the recorded and generated frames when they are shown live (s^-1)
+SOURCE_FPS = 30
+# Files read by ImageSource
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+# Consecutive frames a camera may fail to give before the source is finished, and the wait (s) after each one
+MAX_FAILURES = 100
+FAILURE_WAIT = 0.01
+# Colors (BGR) of the objects of the synthetic frames, inside the default ranges of red, green, blue and yellow
+SYNTHETIC_COLORS = ((0, 0, 255), (0, 255, 0), (255, 0, 0), (0, 255, 255))
+
+# -----------------------------------------------------------------------------------------------------
+# ---------------------------------------------- Sources ----------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Where the frames (BGR, uint8) come from. read() returns the next frame, or None if there is none yet
+# (or any more: `finished` is then True). With `fps`, read() waits so frames are returned at that rate, as
+# a camera would; without it, as fast as they can be made (for the benchmarks). Every frame is a new array,
+# so it may be handed over to another thread. A backend that keeps failing (MAX_FAILURES frames in a row,
+# e.g. a camera unplugged) finishes the source.
+class FrameSource:
+    def __init__(self, fps=None):
+        self.fps = fps
+        self.finished = False
+        self.next_frame = 0.0
+        self.failures = 0
+
+    def read(self):
+        if self.finished:
+            # Nothing else will come: a capture thread polling the source must not spin
+            time.sleep(0.01)
+            return None
+        frame = self.grab()
+        if frame is None:
+            if self.finished:
+                return None
+            self.failures += 1
+            if self.failures >= MAX_FAILURES:
+                print(f"{type(self).__name__}: no frame in {self.failures} attempts, giving up")
+                self.finished = True
+            time.sleep(FAILURE_WAIT)
+            return None
+        self.failures = 0
+        if self.fps:
+            now = time.perf_counter()
+            if now < self.next_frame:
+                time.sleep(self.next_frame - now)
+            self.next_frame = max(self.next_frame + 1.0 / self.fps, now)
+        return frame
+
+    # Next frame of the backend (None if there is none)
+    def grab(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# Raspberry Pi camera (picamera2 is only imported here, so the other sources work without it)
+class PicameraSource(FrameSource):
+    def __init__(self, size=FRAME_SIZE):
+        super().__init__()
+        from picamera2 import Picamera2
+        self.picam2 = Picamera2()
+        # RGB888 frames are stored B, G, R, as OpenCV expects
+        config = self.picam2.create_preview_configuration(main={"size": tuple(size), "format": "RGB888"})
+        self.picam2.configure(config)
+        self.picam2.start()
+
+    def grab(self):
+        return self.picam2.capture_array()
+
+    def close(self):
+        self.picam2.stop()
+
+# Camera read through OpenCV (a webcam on Windows; `backend` cv2.CAP_V4L2 reads /dev/video<index> on Linux)
+class CameraSource(FrameSource):
+    def __init__(self, index=0, size=None, backend=cv2.CAP_ANY):
+        super().__init__()
+        self.capture = cv2.VideoCapture(index, backend)
+        if not self.capture.isOpened():
+            raise ValueError(f"Cannot open camera {index}")
+        if size is not None:
+            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, size[0])
+            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, size[1])
+
+    def grab(self):
+        ret, frame = self.capture.read()
+        return frame if ret else None
+
+    def close(self):
+        self.capture.release()
+
+# Frames of a video file, played once or in a loop
+class VideoSource(FrameSource):
+    def __init__(self, path, loop=False, fps=None):
+        super().__init__(fps)
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise ValueError(f"Cannot open the video {path}")
+        self.path = path
+        self.loop = loop
+
+    # Rate the video was recorded at (0 if the file does not say)
+    @property
+    def recordedFps(self):
+        return self.capture.get(cv2.CAP_PROP_FPS)
+
+    def grab(self):
+        ret, frame = self.capture.read()
+        if not ret and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.capture.read()
+        if not ret:
+            self.finished = True
+            return None
+        return frame
+
+    def close(self):
+        self.capture.release()
+
+# Images of a directory (in name order), played once or in a loop. They are decoded once, when the source
+# is created, so reading them costs no more than a camera would.
+class ImageSource(FrameSource):
+    def __init__(self, directory, loop=False, fps=None):
+        super().__init__(fps)
+        names = sorted(name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+        self.images = [image for image in (cv2.imread(os.path.join(directory, name)) for name in names)
+                       if image is not None]
+        if not self.images:
+            raise ValueError(f"No images in {directory}")
+        self.directory = directory
+        self.loop = loop
+        self.position = 0
+
+    def __len__(self):
+        return len(self.images)
+
+    def grab(self):
+        if self.position == len(self.images):
+            if not self.loop:
+                self.finished = True
+                return None
+            self.position = 0
+        self.position += 1
+        return self.images[self.position - 1].copy()
+
+# Generated frames: colored rectangles on a textured gray background. The first `moving` objects move for
+# `period` frames and then stay still for as many, so the sequence has both moving and static scenes.
+# The same seed always gives the same frames.
+class SyntheticSource(FrameSource):
+    def __init__(self, size=FRAME_SIZE, objects=6, moving=2, period=30, count=None, seed=0, fps=None,
+                 colors=SYNTHETIC_COLORS):
+        super().__init__(fps)
+        width, height = size
+        rng = np.random.default_rng(seed)
+        # Camera-like noise, blurred so it is not classified as any color
+        self.background = cv2.GaussianBlur(rng.integers(90, 110, (height, width, 3)).astype(np.uint8), (0, 0), 3)
+        side = max(min(width, height) // 10, 4)
+        self.objects = [(int(rng.integers(0, width - side)), int(rng.integers(0, height - side)), side,
+                         colors[i % len(colors)], int(rng.integers(-6, 7)), int(rng.integers(-4, 5)))
+                        for i in range(objects)]
+        self.moving = moving
+        self.period = period
+        # Frames made before the source is finished (None: endless)
+        self.count = count
+        self.position = 0
+
+    def grab(self):
+        if self.count is not None and self.position >= self.count:
+            self.finished = True
+            return None
+        t = self.position
+        self.position += 1
+        frame = self.background.copy()
+        step = t % self.period if (t // self.period) % 2 == 0 else 0
+        for i, (x, y, side, color, vx, vy) in enumerate(self.objects):
+            if i < self.moving:
+                x += vx * step
+                y += vy * step
+            cv2.rectangle(frame, (x, y), (x + side, y + side), color, -1)
+        return frame
+
+# -----------------------------------------------------------------------------------------------------
+# ---------------------------------------------- Helpers ----------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Opens a source from its description:
+#   picamera             Raspberry Pi camera
+#   camera[:N]           camera N through OpenCV (0 by default)
+#   v4l[:N]              /dev/videoN through Video4Linux
+#   synthetic            generated frames
+#   <directory>          images of a directory
+#   <file>               video file
+# With live=True (the GUIs) the recorded and generated frames are played in a loop at their own rate;
+# with live=False (the benchmarks) they are played once, as fast as they are read.
+def openSource(spec, size=FRAME_SIZE, live=True, count=None):
+    name, _, index = spec.partition(":")
+    if name == "picamera":
+        return PicameraSource(size)
+    if name in ("camera", "v4l"):
+        backend = cv2.CAP_V4L2 if name == "v4l" else cv2.CAP_ANY
+        return CameraSource(int(index or 0), size if name == "v4l" else None, backend)
+    if name == "synthetic":
+        return SyntheticSource(size, count=count, fps=SOURCE_FPS if live else None)
+    if os.path.isdir(spec):
+        return ImageSource(spec, loop=live, fps=SOURCE_FPS if live else None)
+    if os.path.isfile(spec):
+        source = VideoSource(spec, loop=live)
+        if live:
+            source.fps = source.recordedFps or SOURCE_FPS
+        return source
+    raise ValueError(f"Unknown frame source {spec!r} (picamera, camera[:N], v4l[:N], synthetic, a directory or a video)")
+
+# Saves the next `count` frames of `source` as numbered PNG images in `directory` (an ImageSource plays
+# them back), and returns how many were saved
+def saveFrames(source, directory, count):
+    os.makedirs(directory, exist_ok=True)
+    saved = 0
+    while saved < count and not source.finished:
+        frame = source.read()
+        if frame is None:
+            continue
+        cv2.imwrite(os.path.join(directory, f"frame_{saved:05d}.png"), frame)
+        saved += 1
+    return saved
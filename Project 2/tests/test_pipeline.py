@@ -0,0 +1,37 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 2 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import time
+import threading
+
+from pipeline import LatestQueue, CaptureThread
+
+def test_latest_queue_drops_the_oldest_items():
+    frames = LatestQueue(2)
+    for i in range(5):
+        frames.put(i)
+    assert len(frames) == 2 and frames.dropped == 3
+    assert frames.get() == 3 and frames.get() == 4
+    assert frames.get(timeout=0.01) is None
+
+def test_latest_queue_wakes_up_a_waiting_consumer():
+    frames = LatestQueue()
+    threading.Timer(0.05, frames.put, ("frame",)).start()
+    assert frames.get(timeout=2) == "frame"
+
+def test_capture_never_waits_for_the_consumer():
+    grabbed = iter(range(1000))
+    frames = LatestQueue()
+    capture = CaptureThread(lambda: next(grabbed, None), frames)
+    capture.start()
+    deadline = time.monotonic() + 2
+    while capture.count < 1000 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    capture.stop()
+    # Only the newest frame waits, numbered from 1 with its capture time
+    assert capture.count == 1000 and frames.dropped == 999
+    frame_id, timestamp, frame = frames.get()
+    assert (frame_id, frame) == (1000, 999) and timestamp <= time.perf_counter()
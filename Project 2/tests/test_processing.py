@@ -0,0 +1,33 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 2 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import numpy as np
+
+from vision import ColorClassifier, SectorDetector
+from processing import FrameProcessor, FULL, PARTIAL, REUSED
+from sources import SyntheticSource
+from benchmark import COLOR_RANGES
+
+
+def test_incremental_detection_matches_full_detection():
+    classifier = ColorClassifier(COLOR_RANGES)
+    full = FrameProcessor(classifier, SectorDetector(), COLOR_RANGES, incremental=False)
+    incremental = FrameProcessor(classifier, SectorDetector(), COLOR_RANGES, incremental=True)
+    try:
+        source = SyntheticSource(count=120, period=30)
+        for frame_id in range(120):
+            frame = source.read()
+            expected = full.process(frame, frame_id)
+            result = incremental.process(frame, frame_id)
+            assert dict(result.blobs) == dict(expected.blobs)
+            assert dict(result.sectors) == dict(expected.sectors)
+            for color in COLOR_RANGES:
+                assert np.array_equal(incremental.masks[color], full.masks[color])
+        assert incremental.counts[REUSED] > 0 and incremental.counts[PARTIAL] > 0
+        assert full.counts[FULL] == 120
+    finally:
+        full.close()
+        incremental.close()
@@ -0,0 +1,163 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 2 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import time
+import threading
+import pytest
+
+import servo
+from servo import ServoDispatcher, PENDING, QUEUED, BUSY, DONE, FAILED
+
+# Serial-port stand-in that records the lines written to it. With `answer`, it plays arduino.ino: every job
+# is acknowledged and done at once (except the ids in `stuck`, which are only acknowledged).
+class FakePort:
+    def __init__(self, answer=False, stuck=()):
+        self.answer = answer
+        self.stuck = set(stuck)
+        self.is_open = True
+        self.written = []
+        self.incoming = b"READY\n" if answer else b""
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        line = data.decode("ascii").strip()
+        self.written.append(line)
+        if self.answer:
+            job = line.split()[1]
+            reply = f"QUEUED {job}\n" if int(job) in self.stuck else f"QUEUED {job}\nBUSY {job}\nDONE {job}\n"
+            with self.lock:
+                self.incoming += reply.encode("ascii")
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        return len(self.incoming)
+
+    def read(self, size=1):
+        with self.lock:
+            data, self.incoming = self.incoming[:size], self.incoming[size:]
+        if not data:
+            time.sleep(0.01)
+        return data
+
+    def close(self):
+        self.is_open = False
+
+# Dispatcher on a FakePort whose lines are handed over by the test (no reader thread)
+@pytest.fixture
+def dispatcher():
+    dispatcher = ServoDispatcher("fake", pipeline=2, ser=FakePort())
+    dispatcher.opened = time.monotonic()
+    dispatcher.changes_seen = []
+    dispatcher.addCallback(lambda job: dispatcher.changes_seen.append((job.id, job.state)))
+    return dispatcher
+
+def receive(dispatcher, *lines):
+    with dispatcher.lock:
+        for line in lines:
+            dispatcher.handleLine(line)
+        dispatcher.checkTimeouts()
+        dispatcher.send()
+    dispatcher.notify()
+
+# ---- Line parser ----
+
+def test_jobs_wait_for_ready_and_fill_the_pipeline(dispatcher):
+    jobs = [dispatcher.submit(sector) for sector in (0, 2, 1)]
+    assert dispatcher.ser.written == []
+    receive(dispatcher, "READY")
+    assert dispatcher.ser.written == ["JOB 1 0", "JOB 2 2"]
+    assert [job.state for job in jobs] == [PENDING] * 3
+    receive(dispatcher, "QUEUED 1", "QUEUED 2", "BUSY 1", "DONE 1")
+    assert dispatcher.ser.written[-1] == "JOB 3 1"
+    assert [job.state for job in jobs] == [DONE, QUEUED, PENDING]
+    assert dispatcher.changes_seen == [(1, QUEUED), (2, QUEUED), (1, BUSY), (1, DONE)]
+    assert jobs[0].sent <= jobs[0].started <= jobs[0].finished
+
+def test_lines_that_are_not_acknowledgements_are_ignored(dispatcher):
+    job = dispatcher.submit(1)
+    receive(dispatcher, "READY")
+    receive(dispatcher, "", "hello", "BUSY", "BUSY x", "DONE 7", "QUEUED 1", "QUEUED 1")
+    assert job.state == QUEUED
+    assert dispatcher.changes_seen == [(1, QUEUED)]
+
+def test_rejected_jobs_fail_with_the_reason(dispatcher):
+    first, second = dispatcher.submit(5), dispatcher.submit(1)
+    receive(dispatcher, "READY")
+    receive(dispatcher, "ERR 1 bad sector", "ERR 2")
+    assert (first.state, first.error) == (FAILED, "bad sector")
+    assert (second.state, second.error) == (FAILED, "rejected")
+    assert dispatcher.outstanding() == 0
+
+def test_a_restart_fails_the_jobs_sent(dispatcher):
+    first, second, third = (dispatcher.submit(0) for _ in range(3))
+    receive(dispatcher, "READY")
+    receive(dispatcher, "QUEUED 1", "READY")
+    assert (first.state, first.error) == (FAILED, "controller restarted")
+    assert second.state == FAILED
+    # The job that was not sent yet goes to the new controller
+    assert third.state == PENDING and dispatcher.ser.written[-1] == "JOB 3 0"
+
+# ---- Timeouts ----
+
+def test_jobs_not_acknowledged_in_time_fail(dispatcher, monkeypatch):
+    monkeypatch.setattr(servo, "ACK_TIMEOUT", -1.0)
+    job = dispatcher.submit(0)
+    receive(dispatcher, "READY")
+    receive(dispatcher)
+    assert (job.state, job.error) == (FAILED, "not acknowledged")
+
+def test_queued_jobs_have_a_deadline_for_every_job_ahead(dispatcher, monkeypatch):
+    monkeypatch.setattr(servo, "JOB_TIMEOUT", 10.0)
+    first, second = dispatcher.submit(0), dispatcher.submit(1)
+    receive(dispatcher, "READY")
+    receive(dispatcher, "QUEUED 1", "QUEUED 2")
+    assert second.deadline - first.deadline == pytest.approx(10.0, abs=0.5)
+    # Acknowledged, but never started: it fails once its deadline is over
+    first.deadline = time.monotonic() - 1
+    receive(dispatcher)
+    assert (first.state, first.error) == (FAILED, "timed out")
+    assert second.state == QUEUED
+
+def test_busy_jobs_that_never_finish_fail(dispatcher, monkeypatch):
+    monkeypatch.setattr(servo, "JOB_TIMEOUT", -1.0)
+    job = dispatcher.submit(0)
+    receive(dispatcher, "READY")
+    receive(dispatcher, "QUEUED 1", "BUSY 1")
+    receive(dispatcher)
+    assert (job.state, job.error) == (FAILED, "timed out")
+
+def test_old_firmware_without_ready(dispatcher, monkeypatch):
+    monkeypatch.setattr(servo, "READY_TIMEOUT", 0.0)
+    dispatcher.submit(0)
+    time.sleep(0.01)
+    receive(dispatcher)
+    assert dispatcher.ready.is_set() and dispatcher.ser.written == ["JOB 1 0"]
+
+# ---- Reader thread ----
+
+def test_callbacks_may_submit_jobs():
+    port = FakePort(answer=True)
+    states = []
+    with ServoDispatcher("fake", ser=port) as dispatcher:
+        def chain(job):
+            states.append((job.id, job.state))
+            # Every box done brings the next one, up to 5
+            if job.state == DONE and job.id < 5:
+                dispatcher.submit(job.sector)
+        dispatcher.addCallback(chain)
+        dispatcher.submit(2)
+        assert dispatcher.wait(timeout=5)
+    assert [state for state in states if state[1] == DONE] == [(i, DONE) for i in range(1, 6)]
+    assert dispatcher.stats()["done"] == 5 and not port.is_open
+
+def test_a_stuck_job_times_out_without_blocking_the_others(monkeypatch):
+    monkeypatch.setattr(servo, "JOB_TIMEOUT", 0.3)
+    with ServoDispatcher("fake", ser=FakePort(answer=True, stuck=[2])) as dispatcher:
+        jobs = [dispatcher.submit(0) for _ in range(4)]
+        assert dispatcher.wait(timeout=5)
+    assert [job.state for job in jobs] == [DONE, FAILED, DONE, DONE]
+    assert dispatcher.stats()["failed"] == 1
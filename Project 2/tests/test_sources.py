@@ -0,0 +1,45 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 2 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import numpy as np
+
+import sources
+from sources import FrameSource, SyntheticSource, ImageSource, saveFrames
+
+
+def test_synthetic_frames_are_repeatable():
+    first, second = SyntheticSource(count=3, seed=1), SyntheticSource(count=3, seed=1)
+    for _ in range(3):
+        assert np.array_equal(first.read(), second.read())
+    assert first.read() is None and first.finished
+
+def test_saved_frames_play_back(tmp_path):
+    assert saveFrames(SyntheticSource(size=(64, 48), count=4), str(tmp_path), 10) == 4
+    with ImageSource(str(tmp_path)) as source:
+        frames = [source.read() for _ in range(5)]
+    assert len(source) == 4 and frames[0].shape == (48, 64, 3) and frames[4] is None
+
+# Backend that only gives frames after failing `failures` times
+class FlakySource(FrameSource):
+    def __init__(self, failures):
+        super().__init__()
+        self.failures_left = failures
+
+    def grab(self):
+        if self.failures_left:
+            self.failures_left -= 1
+            return None
+        return np.zeros((2, 2, 3), np.uint8)
+
+def test_a_source_that_keeps_failing_is_finished(monkeypatch):
+    monkeypatch.setattr(sources, "FAILURE_WAIT", 0.0)
+    recovering = FlakySource(sources.MAX_FAILURES - 1)
+    frames = [recovering.read() for _ in range(sources.MAX_FAILURES)]
+    assert frames[-1] is not None and not recovering.finished and recovering.failures == 0
+    dead = FlakySource(sources.MAX_FAILURES)
+    for _ in range(sources.MAX_FAILURES):
+        assert dead.read() is None
+    assert dead.finished
@@ -0,0 +1,115 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 2 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import json
+import types
+import cv2
+import numpy as np
+import pytest
+
+from vision import ColorClassifier, SectorDetector, loadZones, loadBoxes, gridZones, makeDetection, CENTERS, MASS
+from benchmark import COLOR_RANGES
+
+# ---- Color classifier ----
+
+@pytest.mark.parametrize("colors", [4, 12])
+def test_classifier_masks_match_in_range(colors):
+    rng = np.random.default_rng(7)
+    ranges = dict(COLOR_RANGES)
+    # Overlapping random ranges beyond 8 colors (16-bit labels)
+    for i in range(colors - len(ranges)):
+        lower = rng.integers(0, 128, 3)
+        ranges[f"Extra{i}"] = (lower.tolist(), (lower + rng.integers(0, 128, 3)).tolist(), (255, 255, 255))
+    classifier = ColorClassifier(ranges)
+    assert classifier.dtype == (np.uint8 if colors <= 8 else np.uint16)
+    hsv = rng.integers(0, 256, (120, 160, 3)).astype(np.uint8)
+    labels = classifier.classify(hsv)
+    for color, (lower, upper, _) in ranges.items():
+        expected = cv2.inRange(hsv, np.array(lower), np.array(upper))
+        assert np.array_equal(classifier.mask(labels, color), expected)
+
+def test_classifier_rejects_too_many_colors():
+    with pytest.raises(ValueError):
+        ColorClassifier({str(i): ([0, 0, 0], [1, 1, 1]) for i in range(17)})
+
+def test_classifier_reuses_the_buffers_given():
+    classifier = ColorClassifier(COLOR_RANGES)
+    hsv = np.random.default_rng(3).integers(0, 256, (60, 80, 3)).astype(np.uint8)
+    labels, bits, plane = np.empty((60, 80), np.uint8), np.empty((60, 80, 3), np.uint8), np.empty((60, 80), np.uint8)
+    mask, scratch = np.empty((60, 80), np.uint8), np.empty((60, 80), np.uint8)
+    assert classifier.classify(hsv, labels, bits, plane) is labels
+    assert classifier.mask(labels, "Red", mask, scratch) is mask
+    assert np.array_equal(mask, classifier.mask(classifier.classify(hsv), "Red"))
+
+# ---- Sector detector ----
+
+# Mask at the working resolution of a 640 x 480 frame (1 level: 320 x 240) with filled rectangles (x, y, w, h)
+def blobMask(*rects):
+    mask = np.zeros((240, 320), np.uint8)
+    for x, y, w, h in rects:
+        mask[y:y + h, x:x + w] = 255
+    return mask
+
+def test_regions_are_found_in_the_sector_of_their_center():
+    detector = SectorDetector()
+    blobs, sectors, mass = detector.detect(blobMask((240, 100, 40, 30), (2, 2, 4, 4)), (480, 640, 3))
+    # Only the large region counts, measured in full-resolution pixels
+    assert blobs == ((480, 200, 80, 60, 4800),)
+    assert sectors == (2,)
+    assert mass == (64, 0, 4800)
+
+def test_a_region_across_two_sectors_counts_in_the_one_of_its_center():
+    centers = SectorDetector(method=CENTERS)
+    masses = SectorDetector(method=MASS)
+    mask = blobMask((80, 50, 60, 60))
+    assert centers.detect(mask.copy(), (480, 640, 3))[1] == (1,)
+    assert masses.detect(mask.copy(), (480, 640, 3))[1] == (0, 1)
+
+# ---- Zones ----
+
+def layout(tmp_path, **contents):
+    path = tmp_path / "zones.json"
+    path.write_text(json.dumps(contents))
+    return str(path)
+
+def test_zones_map_to_the_boxes_of_the_layout(tmp_path):
+    path = layout(tmp_path, rows=2, columns=3, boxes=[0, 0, 1, 1, 2, 2])
+    zones = loadZones(path)
+    assert zones == gridZones(2, 3)
+    assert loadBoxes(path, zones) == [0, 0, 1, 1, 2, 2]
+
+def test_up_to_three_zones_are_their_own_boxes(tmp_path):
+    assert loadBoxes(str(tmp_path / "missing.json"), gridZones()) == [0, 1, 2]
+    path = layout(tmp_path, rows=1, columns=2)
+    assert loadBoxes(path, loadZones(path)) == [0, 1]
+
+@pytest.mark.parametrize("contents", [{"rows": 2, "columns": 3},
+                                      {"rows": 1, "columns": 3, "boxes": [0, 1]},
+                                      {"rows": 1, "columns": 3, "boxes": [0, 1, 3]}])
+def test_zones_that_cannot_be_mapped_to_a_box_are_rejected(tmp_path, contents):
+    path = layout(tmp_path, **contents)
+    with pytest.raises(ValueError):
+        loadBoxes(path, loadZones(path))
+
+def test_zone_pixels_from_the_integral_image_match_a_direct_count():
+    zones = gridZones(3, 4) + [(0.1, 0.2, 0.55, 0.9)]
+    detector = SectorDetector(zones=zones, min_area=0)
+    mask = np.where(np.random.default_rng(2).random((240, 320)) < 0.3, 255, 0).astype(np.uint8)
+    _, _, mass = detector.measure(mask, (480, 640, 3))
+    _, integral_rects = detector.zoneRects((480, 640, 3))
+    for (x0, y0, x1, y1), pixels in zip(integral_rects, mass):
+        assert pixels == np.count_nonzero(mask[y0:y1, x0:x1]) * 4
+
+# ---- Detection ----
+
+def test_detections_cannot_be_changed():
+    detection = makeDetection(7, 1.5, {"Red": (((0, 0, 10, 10, 100),), (1,), (0, 100, 0))})
+    assert detection.sectors["Red"] == (1,) and detection.tracks["Red"] == ()
+    assert isinstance(detection.sectors, types.MappingProxyType)
+    with pytest.raises(TypeError):
+        detection.sectors["Red"] = (2,)
+    with pytest.raises(AttributeError):
+        detection.frame_id = 8
@@ -0,0 +1,264 @@
+# -----------------------------------------------------------------------------------------------------
+# ---------------------- INSTRUMENTATION AND DATA ACQUISITION PROJECT 2 -------------------------------
+# ------------------------ 106661, Joana Vaz - 106643, José Machado -----------------------------------
+# ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+import json
+import types
+import collections
+import cv2
+import numpy as np
+
+# Colors a classifier can label at once (one bit of the label of a pixel each)
+MAX_COLORS = 16
+# Default detection zones: a grid of 1 row and 3 columns, the vertical sectors the boxes are sorted into
+# (0 = left, 1 = center, 2 = right)
+ZONE_ROWS = 1
+ZONE_COLUMNS = 3
+# Boxes the arm sorts the objects into (the sectors 0-2 accepted by arduino.ino)
+BOXES = 3
+# Pyramid levels the frames are reduced by before detection (each one halves the width and the height)
+DETECTION_LEVELS = 1
+# Minimum area (pixels of the full-resolution frame) of a region for it to count in a zone
+MIN_AREA = 300
+# Size (full-resolution pixels) of the square structuring element that cleans the masks
+KERNEL_SIZE = 5
+
+# How a zone is found to hold a color: a region of more than min_area pixels has the center of its
+# bounding box in the zone, or the zone has more than min_area pixels of the color in total
+CENTERS = "CENTERS"
+MASS = "MASS"
+
+# -----------------------------------------------------------------------------------------------------
+# ------------------------------------------ Color classifier -----------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Labels every pixel of an HSV frame with all the calibrated colors it belongs to, in a single pass.
+# A color range is a box in HSV space, so a pixel is inside it when H, S and V are each inside their own
+# bounds. The lookup table holds, for every value (0-255) of each channel, one bit per color that is set
+# when the value is within that color's bounds: cv2.LUT maps the three channels of the frame at once and
+# the AND of the three planes is the label of every pixel (bit i set: inside the range of colors[i]).
+# The cost per frame is the same whatever the number of colors; the table is only rebuilt (with build())
+# when the ranges change.
+class ColorClassifier:
+    def __init__(self, color_ranges):
+        self.build(color_ranges)
+
+    # Rebuilds the table from {color: (lower, upper, ...)}. The worker thread may be classifying a frame
+    # meanwhile: the new table replaces the old one in a single assignment, so it sees one or the other.
+    def build(self, color_ranges):
+        colors = list(color_ranges)
+        if len(colors) > MAX_COLORS:
+            raise ValueError(f"At most {MAX_COLORS} colors can be classified")
+        dtype = np.uint8 if len(colors) <= 8 else np.uint16
+        lut = np.zeros((256, 1, 3), dtype=dtype)
+        values = np.arange(256)
+        for i, color in enumerate(colors):
+            lower, upper = color_ranges[color][:2]
+            for channel in range(3):
+                inside = (values >= lower[channel]) & (values <= upper[channel])
+                lut[inside, 0, channel] |= dtype(1 << i)
+        self.table = (colors, {color: dtype(1 << i) for i, color in enumerate(colors)}, lut)
+
+    @property
+    def colors(self):
+        return self.table[0]
+
+    # Type of the labels (uint8 for up to 8 colors, uint16 above)
+    @property
+    def dtype(self):
+        return self.table[2].dtype
+
+    # Label of every pixel of `hsv`. The result goes to `dst` if given, and `bits` (3 channels) and `plane`
+    # are used as scratch if given (all with the type of the labels), so nothing is allocated per frame.
+    def classify(self, hsv, dst=None, bits=None, plane=None):
+        bits = cv2.LUT(hsv, self.table[2], dst=bits)
+        labels = cv2.extractChannel(bits, 0, dst=dst)
+        plane = cv2.extractChannel(bits, 1, dst=plane)
+        cv2.bitwise_and(labels, plane, dst=labels)
+        plane = cv2.extractChannel(bits, 2, dst=plane)
+        return cv2.bitwise_and(labels, plane, dst=labels)
+
+    # Binary mask (255 inside the range, like cv2.inRange) of one color, from the labels of classify().
+    # `dst` (uint8) and `scratch` (type of the labels) are used if given.
+    def mask(self, labels, color, dst=None, scratch=None):
+        bit = self.table[1][color]
+        scratch = cv2.bitwise_and(labels, int(bit), dst=scratch)
+        return cv2.compare(scratch, 0, cv2.CMP_NE, dst=dst)
+
+# -----------------------------------------------------------------------------------------------------
+# ------------------------------------------------ Zones ----------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Zones (x0, y0, x1, y1), as fractions of the width and height of the image, of a grid of rows x columns,
+# numbered row by row from the top left
+def gridZones(rows=ZONE_ROWS, columns=ZONE_COLUMNS):
+    return [(c / columns, r / rows, (c + 1) / columns, (r + 1) / rows) for r in range(rows) for c in range(columns)]
+
+# Contents of a layout file (empty if it is missing)
+def readLayout(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+# Zones of a layout file: {"rows": 2, "columns": 4} for a grid, or {"zones": [[x0, y0, x1, y1], ...]}
+# for any rectangles (fractions of the image, the first one is zone 0). The default grid if it is missing.
+def loadZones(path):
+    layout = readLayout(path)
+    if "zones" in layout:
+        return [tuple(zone) for zone in layout["zones"]]
+    return gridZones(layout.get("rows", ZONE_ROWS), layout.get("columns", ZONE_COLUMNS))
+
+# Box (0 to BOXES - 1) each of the `zones` is sorted into, from the "boxes" list of a layout file (one box
+# per zone, e.g. "boxes": [0, 0, 1, 1, 2, 2] for a 2 x 3 grid). Without it zone i goes to box i, which only
+# works for up to BOXES zones. Raises ValueError if the zones cannot be mapped.
+def loadBoxes(path, zones):
+    boxes = readLayout(path).get("boxes")
+    if boxes is None:
+        if len(zones) > BOXES:
+            raise ValueError(f"{path}: {len(zones)} zones but only {BOXES} boxes, "
+                             f"add a \"boxes\" list with the box of each zone")
+        return list(range(len(zones)))
+    if len(boxes) != len(zones):
+        raise ValueError(f"{path}: {len(boxes)} boxes for {len(zones)} zones")
+    if any(not isinstance(box, int) or not 0 <= box < BOXES for box in boxes):
+        raise ValueError(f"{path}: the boxes must be numbers from 0 to {BOXES - 1}")
+    return list(boxes)
+
+# Finds the regions of a color and the zones it occupies straight from its mask, without tracing
+# contours: the frame is reduced `levels` times (cv2.pyrDown) before it is classified, the mask is
+# cleaned at that working resolution, and then
+#   - cv2.connectedComponentsWithStats gives the bounding box and area of every region in one scan;
+#   - the integral image of the mask (cv2.integral, computed once) gives the pixels of the color in any
+#     rectangle with 4 lookups, so every zone costs the same however many zones there are.
+# Boxes, areas and pixel counts are returned in full-resolution pixels.
+class SectorDetector:
+    def __init__(self, levels=DETECTION_LEVELS, min_area=MIN_AREA, zones=None, method=CENTERS,
+                 kernel_size=KERNEL_SIZE):
+        if method not in (CENTERS, MASS):
+            raise ValueError(f"Unknown zone method: {method}")
+        self.levels = int(levels)
+        self.scale = 2 ** self.levels
+        self.min_area = min_area
+        self.zones = list(zones) if zones is not None else gridZones()
+        self.method = method
+        size = max(kernel_size // self.scale, 1) | 1
+        self.kernel = np.ones((size, size), np.uint8)
+        # Zone rectangles in pixels, for each frame size
+        self.rects = {}
+
+    # Shapes of a frame of shape `shape` after each level of reduction
+    def pyramidShapes(self, shape):
+        shapes = []
+        height, width = shape[:2]
+        for _ in range(self.levels):
+            height, width = (height + 1) // 2, (width + 1) // 2
+            shapes.append((height, width) + tuple(shape[2:]))
+        return shapes
+
+    # Shape of a frame of shape `shape` at the working resolution
+    def workingShape(self, shape):
+        shapes = self.pyramidShapes(shape)
+        return shapes[-1] if shapes else tuple(shape)
+
+    # Frame reduced to the working resolution (through the buffers in `dst`, one per level, if given)
+    def reduce(self, frame, dst=None):
+        for level in range(self.levels):
+            frame = cv2.pyrDown(frame, dst=dst[level] if dst else None)
+        return frame
+
+    # Rectangles (x0, y0, x1, y1) of the zones in pixels of a frame of shape `shape` (end excluded), and
+    # the same rectangles in the integral image of the mask at the working resolution
+    def zoneRects(self, shape):
+        height, width = shape[:2]
+        if (height, width) not in self.rects:
+            zones = np.array(self.zones, dtype=np.float64).reshape(-1, 4)
+            rects = np.floor(zones * (width, height, width, height)).astype(np.int64)
+            rects = np.clip(rects, 0, (width, height, width, height))
+            small_height, small_width = self.workingShape((height, width))
+            integral = np.empty_like(rects)
+            integral[:, :2] = rects[:, :2] // self.scale
+            integral[:, 2:] = -(-rects[:, 2:] // self.scale)
+            integral = np.clip(integral, 0, (small_width, small_height, small_width, small_height))
+            self.rects[(height, width)] = (rects, integral)
+        return self.rects[(height, width)]
+
+    # Cleans a mask at the working resolution in place (opening then closing, to remove specks and fill holes)
+    def clean(self, mask):
+        cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel, dst=mask)
+        return cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self.kernel, dst=mask)
+
+    # Pixels around a region of a mask that clean() needs to give the same result inside it as on the whole mask
+    @property
+    def margin(self):
+        return 4 * (self.kernel.shape[0] // 2)
+
+    # Regions ((x, y, w, h, area), ...), occupied zones and pixels per zone of one color, from its mask at
+    # the working resolution (cleaned in place). `shape` is the shape of the full-resolution frame;
+    # `components` (int32, size of the mask) and `integral` (int32, one row and column more) are buffers.
+    def detect(self, mask, shape, components=None, integral=None):
+        return self.measure(self.clean(mask), shape, components, integral)
+
+    # Same as detect() for a mask that is already clean
+    def measure(self, mask, shape, components=None, integral=None):
+        rects, integral_rects = self.zoneRects(shape)
+
+        # Regions (label 0 is the background)
+        _, _, stats, _ = cv2.connectedComponentsWithStats(mask, components, connectivity=8, ltype=cv2.CV_32S)
+        stats = stats[1:].astype(np.int64)
+        stats[:, :4] *= self.scale
+        stats[:, 4] *= self.scale ** 2
+        stats = stats[stats[:, 4] > self.min_area]
+        blobs = tuple(tuple(int(v) for v in blob) for blob in stats)
+
+        # Pixels of the color in each zone: sum over a rectangle from 4 corners of the integral image
+        integral = cv2.integral(mask, integral, sdepth=cv2.CV_32S)
+        x0, y0, x1, y1 = integral_rects.T
+        sums = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+        mass = tuple(int(v) * self.scale ** 2 // 255 for v in sums)
+
+        if self.method == CENTERS:
+            centers_x = (stats[:, 0] + stats[:, 2] // 2)[:, None]
+            centers_y = (stats[:, 1] + stats[:, 3] // 2)[:, None]
+            x0, y0, x1, y1 = rects.T
+            inside = (centers_x >= x0) & (centers_x < x1) & (centers_y >= y0) & (centers_y < y1)
+            zones = tuple(int(i) for i in np.flatnonzero(inside.any(axis=0)))
+        else:
+            zones = tuple(i for i, pixels in enumerate(mass) if pixels > self.min_area)
+        return blobs, zones, mass
+
+# Draws the zones (pixel rectangles from SectorDetector.zoneRects) and their numbers on an image.
+# mirrored=True if the image was flipped horizontally after the detection.
+def drawZones(image, rects, color=(0, 255, 0), mirrored=False):
+    width = image.shape[1]
+    for zone, (x0, y0, x1, y1) in enumerate(rects.tolist()):
+        if mirrored:
+            x0, x1 = width - x1, width - x0
+        cv2.rectangle(image, (x0, y0), (x1 - 1, y1 - 1), color, 2)
+        cv2.putText(image, str(zone), (x0 + 6, y0 + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+
+# -----------------------------------------------------------------------------------------------------
+# --------------------------------------------- Detection ---------------------------------------------
+# -----------------------------------------------------------------------------------------------------
+
+# Result of the detection of one frame, published by the processing thread in a single assignment and
+# never changed afterwards, so any thread can read it without locks:
+#   frame_id, timestamp: number of the frame and its capture time (time.perf_counter(), s)
+#   blobs:   {color: ((x, y, w, h, area), ...)}
+#   sectors: {color: (zone, ...)} occupied zones (sectors) of each color
+#   mass:    {color: (pixels, ...)} pixels of each color in every zone
+#   tracks:  {color: (track, ...)} number of the track of each blob (the same while it stays in view)
+Detection = collections.namedtuple("Detection", ["frame_id", "timestamp", "blobs", "sectors", "mass", "tracks"])
+
+# Detection of a frame from {color: (blobs, sectors, mass)} as returned by SectorDetector.detect, and the
+# {color: tracks} of its blobs if they are tracked
+def makeDetection(frame_id, timestamp, results, tracks=None):
+    blobs = {color: result[0] for color, result in results.items()}
+    sectors = {color: result[1] for color, result in results.items()}
+    mass = {color: result[2] for color, result in results.items()}
+    tracks = {color: tuple(tracks[color]) if tracks else () for color in results}
+    return Detection(frame_id, timestamp, types.MappingProxyType(blobs), types.MappingProxyType(sectors),
+                     types.MappingProxyType(mass), types.MappingProxyType(tracks))
@@ -4,7 +4,9 @@
 # ------------------------ 105908, Rita Garcia - 106197, Rui Costa ------------------------------------
 # -----------------------------------------------------------------------------------------------------
 
+import os
 import sys
+import argparse
 import json
 import serial
 import time
@@ -14,14 +16,23 @@ from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 
+# The vision modules are shared by the linux and windows versions
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from vision import ColorClassifier, SectorDetector, loadZones, loadBoxes, drawZones
+from processing import FrameProcessor
+from pipeline import LatestQueue, CaptureThread, DISPLAY_FPS
+from sources import openSource
+from servo import ServoDispatcher
+
 # -----------------------------------------------------------------------------------------------------
 # --------------------------------------------- UI ----------------------------------------------------
 # -----------------------------------------------------------------------------------------------------
 
 # Main application window handling GUI and serial communication
 class MainWindow(QWidget):
-    def __init__(self):
+    def __init__(self, source="camera:0"):
         super().__init__()
+        self.source = source
 
         # Initialize serial communication with Arduino
         self.initSerial()
@@ -44,8 +55,8 @@ class MainWindow(QWidget):
         self.saveButton.clicked.connect(self.saveCalibration)
         self.layout.addWidget(self.saveButton)
 
-        # Checkbox to toggle vertical line markers
-        self.toggleMarkersCheckbox = QCheckBox("Show vertical markers (1/3 and 2/3)")
+        # Checkbox to toggle the detection zone markers
+        self.toggleMarkersCheckbox = QCheckBox("Show detection zones")
         self.toggleMarkersCheckbox.stateChanged.connect(self.toggleMarkers)
         self.layout.addWidget(self.toggleMarkersCheckbox)
 
@@ -83,7 +94,7 @@ class MainWindow(QWidget):
         self.layout.addLayout(button_layout)
 
         # Start worker thread for camera feed and processing
-        self.Worker1 = Worker1(self)
+        self.Worker1 = Worker1(self, source=self.source)
         self.Worker1.ImageUpdate.connect(self.ImageUpdateSlot)
         self.Worker1.start()
 
@@ -115,18 +126,23 @@ class MainWindow(QWidget):
             return
         lower = [self.sliders["H Lower"].value(), self.sliders["S Lower"].value(), self.sliders["V Lower"].value()]
         upper = [self.sliders["H Upper"].value(), self.sliders["S Upper"].value(), self.sliders["V Upper"].value()]
-        self.Worker1.color_ranges[current_color] = (lower, upper, self.Worker1.color_ranges[current_color][2])
+        self.Worker1.setColorRange(current_color, lower, upper)
 
     # Display new image from worker thread
     def ImageUpdateSlot(self, Image):
         self.FeedLabel.setPixmap(QPixmap.fromImage(Image))
+        # The pixmap is a copy: the worker may reuse the buffer behind the image
+        self.Worker1.imageShown()
 
-    # Send section info via serial based on detected contours and print a message for debugging
+    # Queue one job per box the sections the color was detected in map to (sent and followed by the dispatcher's
+    # thread, the GUI never waits for the servos) and print a message for debugging
     def printSectors(self, color):
         sections = self.Worker1.checkColorPresence(color)
-        sections_str = ','.join(map(str, sections))
-        self.ser.write((sections_str).encode('utf-8'))
-        print(repr(sections_str + '\n'))
+        # Zones are mapped to the boxes of the arm (several zones may share a box, which is sent once)
+        boxes = sorted({self.Worker1.boxes[section] for section in sections})
+        for box in boxes:
+            self.dispatcher.submit(box)
+        print(f"{color} detected in sections: {sections} (boxes {boxes})")
 
     # Save current color calibration to file
     def saveCalibration(self):
@@ -134,7 +150,7 @@ class MainWindow(QWidget):
         print("Calibration saved.")
 
     def toggleMarkers(self, state):
-        # Toggle the display of vertical line markers based on checkbox state
+        # Toggle the display of the detection zones based on checkbox state
         self.Worker1.show_markers = (state == Qt.Checked)
 
     # Exit application on pressing Q
@@ -142,19 +158,25 @@ class MainWindow(QWidget):
         if event.key() == Qt.Key_Q:
             self.close()
 
-    # Initialize serial connection to Arduino
+    # Initialize serial connection to Arduino (jobs are only sent once it has restarted and said READY,
+    # so there is no need to wait for it here)
     def initSerial(self):
         try:
-            self.ser = serial.Serial(r'COM4', 9600, timeout=1)
-            time.sleep(2)
+            self.dispatcher = ServoDispatcher(r'COM4').open()
+            self.dispatcher.addCallback(self.jobUpdated)
         except serial.SerialException:
             QMessageBox.critical(self, 'Connection Error', 'Failed to open serial port.')
             sys.exit()
 
+    # Report finished and failed box jobs (called from the dispatcher's thread)
+    def jobUpdated(self, job):
+        if job.done:
+            print(f"Box job {job.id} (section {job.sector}): {job.state}{f' ({job.error})' if job.error else ''}")
+
     # Close serial connection and stop worker thread on exit
     def closeEvent(self, event):
-        if hasattr(self, 'ser') and self.ser.is_open:
-            self.ser.close()
+        if hasattr(self, 'dispatcher'):
+            self.dispatcher.close()
         self.Worker1.stop()
         event.accept()
 
@@ -166,10 +188,13 @@ class MainWindow(QWidget):
 class Worker1(QThread):
     ImageUpdate = pyqtSignal(QImage)
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, display_fps=DISPLAY_FPS, incremental=True, source="camera:0"):
         super().__init__(parent)
         self.parent_widget = parent
-        self.capture = cv2.VideoCapture(0)
+
+        # Open the frame source: the webcam by default, or a video, image directory or generated frames
+        # (see sources.openSource)
+        self.source = openSource(source)
         self.color_ranges = {
             "Red": ([0, 120, 70], [10, 255, 255], (0, 0, 255)),
             "Green": ([36, 50, 70], [89, 255, 255], (0, 255, 0)),
@@ -179,6 +204,32 @@ class Worker1(QThread):
         self.loadCalibration()
         self.show_markers = False
 
+        # Regions and sectors are found on frames reduced to the detector's working resolution
+        # (the zones are read from zones.json, see vision.loadZones)
+        self.detector = SectorDetector(zones=loadZones("zones.json"))
+        # Box of the arm each zone is sorted into (the "boxes" of zones.json, see vision.loadBoxes)
+        self.boxes = loadBoxes("zones.json", self.detector.zones)
+
+        # Detection of every color, one job per color at the same time (OpenCV releases the GIL). In incremental
+        # mode only the parts of the frame that changed are segmented again (see processing.FrameProcessor)
+        self.processor = FrameProcessor(self.classifier, self.detector, self.color_ranges, incremental)
+
+        # Display buffers (allocated for the first frame)
+        self.frame_shape = None
+        self.display_buffers = []
+        # Images emitted to and shown by the GUI (see displayBuffer), at most display_fps per second
+        self.emitted = 0
+        self.shown = 0
+        self.display_fps = display_fps
+
+        # Capture stage: its own thread hands the newest frame over to run() (older ones are dropped)
+        self.frames = LatestQueue()
+        self.capture_thread = CaptureThread(self.source.read, self.frames)
+
+        # Time from capture to detection of the last frame processed (s), and its detection (see vision.Detection)
+        self.latency = 0.0
+        self.detection = None
+
     # Load saved HSV calibration values from file
     def loadCalibration(self):
         try:
@@ -188,6 +239,13 @@ class Worker1(QThread):
                     self.color_ranges[color] = (values["lower"], values["upper"], self.color_ranges[color][2])
         except FileNotFoundError:
             pass
+        # Every pixel is labeled with all the colors at once by a lookup table built from the ranges
+        self.classifier = ColorClassifier(self.color_ranges)
+
+    # Changes the HSV range of one color (from the calibration sliders) and rebuilds the lookup table
+    def setColorRange(self, color, lower, upper):
+        self.color_ranges[color] = (lower, upper, self.color_ranges[color][2])
+        self.classifier.build(self.color_ranges)
 
     # Save current HSV calibration to file
     def saveCalibration(self):
@@ -200,123 +258,113 @@ class Worker1(QThread):
         with open("calibration.json", "w") as f:
             json.dump(data, f, indent=4)
 
-    # Main loop for processing the video stream and applying color detection
+    # Display buffers (only reallocated if the frame size changes; the processor has its own)
+    def allocateBuffers(self, shape):
+        self.frame_shape = shape
+        height, width = shape[:2]
+        self.display_mask = np.empty((height, width), np.uint8)
+        self.rgb = np.empty((height, width, 3), np.uint8)
+        # Images still waiting to be shown may wrap the previous display buffers, which are kept until then
+        self.retired_buffers = self.display_buffers
+        self.display_buffers = [np.empty((height, width, 3), np.uint8) for _ in range(2)]
+
+    # RGB buffer for the next mirrored image, or None if both are still in use. The QImage emitted for a
+    # frame wraps its buffer without copying it, so a buffer is only reused once the GUI has shown the
+    # image made from it two frames ago (imageShown is called from the GUI thread).
+    def displayBuffer(self):
+        if self.emitted - self.shown >= len(self.display_buffers):
+            return None
+        return self.display_buffers[self.emitted % len(self.display_buffers)]
+
+    def imageShown(self):
+        self.shown += 1
+
+    # Processing stage: takes the newest captured frame, detects every color (one job per color) and,
+    # at most display_fps times per second, draws the result and emits it to the GUI
     def run(self):
         self.ThreadActive = True
+        self.capture_thread.start()
+        next_display = 0.0
         while self.ThreadActive:
-            ret, frame = self.capture.read()
-            if not ret:
+            item = self.frames.get(timeout=0.1)
+            if item is None:
                 continue
+            frame_id, captured, frame = item
 
-            # Keep a copy of the current frame for analysis in color detection
-            self.frame = frame.copy()
-
-            # Convert BGR frame to HSV color space for better color segmentation
-            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+            if self.frame_shape != frame.shape:
+                self.allocateBuffers(frame.shape)
 
             # Determine if the user is currently calibrating a specific color
             color_being_calibrated = self.parent_widget.colorSelector.currentText()
 
+            # Detect all defined colors (also while calibrating, so the sectors are always those of the last
+            # frame) and publish the detection of this frame for the color buttons
+            self.detection = self.processor.process(frame, frame_id, captured)
+            self.latency = time.perf_counter() - captured
+
+            # Display stage: only when it is time for a new image and the GUI has shown the last ones
+            now = time.perf_counter()
+            if now < next_display:
+                continue
+            display_img = self.displayBuffer()
+            if display_img is None:
+                continue
+            next_display = now + 1.0 / self.display_fps
+
             if color_being_calibrated != "Not Calibrating":
                 # Apply a binary mask based on the HSV range of the selected color
-                lower, upper, _ = self.color_ranges[color_being_calibrated]
-                mask = cv2.inRange(hsv, np.array(lower), np.array(upper))
+                mask = self.processor.colorMask(color_being_calibrated)
 
-                # Convert grayscale mask back to RGB to display in GUI
-                display_img = cv2.cvtColor(mask, cv2.COLOR_GRAY2RGB)
+                # Scale the mask back to the size of the frame and convert it to RGB to display in GUI
+                cv2.resize(mask, (frame.shape[1], frame.shape[0]), dst=self.display_mask, interpolation=cv2.INTER_NEAREST)
+                cv2.cvtColor(self.display_mask, cv2.COLOR_GRAY2RGB, dst=self.rgb)
             else:
-                # If not calibrating, detect and highlight all defined colors
-                display_img = frame.copy()
-
-                for color in self.color_ranges:
-                    lower, upper, bgr = self.color_ranges[color]
-
-                    # Create binary mask for the current color
-                    mask = cv2.inRange(hsv, np.array(lower), np.array(upper))
-
-                    # Apply morphological operations to reduce noise
-                    kernel = np.ones((5, 5), "uint8")
-                    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-                    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-
-                    # Detect contours in the mask
-                    contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+                # Highlight the detected regions (drawn directly in RGB, the colors are given in BGR)
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.rgb)
+                for color, found in self.detection.blobs.items():
+                    bgr = self.color_ranges[color][2]
+                    for x, y, w, h, area in found:
+                        cv2.rectangle(self.rgb, (x, y), (x + w, y + h), bgr[::-1], 2)
 
-                    for contour in contours:
-                        # Only consider large enough contours to avoid noise
-                        if cv2.contourArea(contour) > 300:
-                            x, y, w, h = cv2.boundingRect(contour)
+            # Mirror the image horizontally to act as a "mirror" camera, into the display buffer
+            cv2.flip(self.rgb, 1, dst=display_img)
 
-                            # Draw bounding rectangle around detected color region
-                            cv2.rectangle(display_img, (x, y), (x + w, y + h), bgr, 2)
-
-             # If the markers are enabled, draw vertical lines at 1/3 and 2/3 of the width
+            # If the markers are enabled, draw the detection zones (mirrored as well, with readable numbers)
             if self.show_markers:
-                height, width = display_img.shape[:2]
-                cv2.line(display_img, (width // 3, 0), (width // 3, height), (0, 255, 0), 2)
-                cv2.line(display_img, (2 * width // 3, 0), (2 * width // 3, height), (0, 255, 0), 2)
-
-            # Convert BGR to RGB for Qt display
-            rgb_image = cv2.cvtColor(display_img, cv2.COLOR_BGR2RGB)
-
-            # Mirror the image horizontally to act as a "mirror" camera
-            flipped = cv2.flip(rgb_image, 1)
+                drawZones(display_img, self.detector.zoneRects(frame.shape)[0], mirrored=True)
 
             # Create a QImage from the numpy array for PyQt GUI rendering
-            qt_img = QImage(flipped.data, flipped.shape[1], flipped.shape[0], flipped.strides[0], QImage.Format_RGB888)
+            qt_img = QImage(display_img.data, display_img.shape[1], display_img.shape[0], display_img.strides[0], QImage.Format_RGB888)
 
             # Emit signal to update the GUI with the new frame
+            self.emitted += 1
             self.ImageUpdate.emit(qt_img)
 
-
-    # Analyzes the frame to determine in which screen sections the given color appears
+    # Returns the screen sections the given color was detected in, in the last frame processed
+    # (answered from the published detection, without any image processing on the GUI thread)
     def checkColorPresence(self, color):
-        # Get HSV range and convert current frame to HSV
-        lower, upper, _ = self.color_ranges[color]
-        hsv_frame = cv2.cvtColor(self.frame, cv2.COLOR_BGR2HSV)
-
-        # Create mask to isolate the selected color
-        mask = cv2.inRange(hsv_frame, np.array(lower), np.array(upper))
-
-        # Apply morphological operations to clean up small artifacts
-        kernel = np.ones((5, 5), "uint8")
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-
-        # Divide the frame into 3 vertical sections: left, center, right
-        sections = [[], [], []]
-        height, width = mask.shape
-        section_width = width // 3
-
-        # Detect contours in the cleaned mask
-        contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-
-        for contour in contours:
-            # Ignore small contours considered as noise
-            if cv2.contourArea(contour) > 300:
-                # Get bounding box and calculate its horizontal center
-                x, y, w, h = cv2.boundingRect(contour)
-                mid_x = x + w // 2
-
-                # Assign the contour to one of the three screen sections
-                if mid_x < section_width:
-                    sections[0].append(contour)  # Left
-                elif mid_x < 2 * section_width:
-                    sections[1].append(contour)  # Center
-                else:
-                    sections[2].append(contour)  # Right
-
-        # Return list of indices for sections where the color is present
-        return [i for i, section in enumerate(sections) if section]
-
-    # Stop thread execution
+        detection = self.detection
+        if detection is None:
+            return []
+        return list(detection.sectors[color])
+
+    # Stop thread execution (the capture stage first, so the camera is no longer used)
     def stop(self):
         self.ThreadActive = False
+        self.capture_thread.stop()
         self.quit()
+        self.wait()
+        self.processor.close()
+        self.source.close()
 
 # Entry point for the PyQt application
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = MainWindow()
+    parser = argparse.ArgumentParser(description="Camera feed with color calibration and sector detection")
+    parser.add_argument("--source", default="camera:0",
+                        help="camera:0 (the webcam), camera[:N], v4l[:N], synthetic, a directory of images or a video file")
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = MainWindow(args.source)
     window.show()
     sys.exit(app.exec_())